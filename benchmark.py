@@ -0,0 +1,370 @@
+"""
+    Benchmarks of the storage engines on synthetic Employee-like tables.
+
+    Every (engine, rows) run happens in a process of its own, in a fresh
+    temporary directory, on the same rows: the columns are drawn one by one
+    from data/Employee.csv with a fixed seed, so a dataset of any size keeps
+    the values and the skew of the original one.
+
+    The workloads run in order on one table: insert, point lookups by id,
+    IN-lists of ids, year filters, full scans, deletes (by id, then a whole
+    year) and reinserts of as many rows as were deleted. Each one reports
+    latency percentiles, throughput, accessed blocks, cache hits and misses
+    and the size of the files after it, as JSON. Pointers keep their block
+    in 16 bits, so every engine holds a limited number of rows (see
+    capacity()): runs above it are skipped and reported as such, instead of
+    failing halfway through the inserts.
+
+        python benchmark.py --rows 10000 100000 --output results.json
+        python benchmark.py --compare old.json new.json
+
+    --compare prints the workloads that got slower, or read more blocks,
+    by more than --threshold between two result files, and exits with 1
+    when there is any.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT    = os.path.dirname(os.path.abspath(__file__))
+DATA    = os.path.join(ROOT, 'data', 'Employee.csv')
+ENGINES = {'heap': 'DatabaseHeap', 'heapvar': 'DatabaseVar', 'pax': 'DatabasePax'}
+
+PERCENTILES = (50, 90, 99)
+
+
+def columns_of(filename):
+    """Returns the values of each column of filename, in the order of insert()."""
+    with open(filename, 'r') as data:
+        data.readline()
+        rows = [line.rstrip('\n').split(',') for line in data]
+
+    # Education, JoiningYear, City, Age, Gender
+    return (
+        [int(r[3]) for r in rows],
+        [int(r[1]) for r in rows],
+        [r[0] for r in rows],
+        [r[2] for r in rows],
+        [r[4] for r in rows],
+    )
+
+
+def generate_rows(count, seed):
+    """Yields count rows (age, year, education, city, gender), the same ones for a seed."""
+    columns = columns_of(DATA)
+    rng = random.Random(seed)
+
+    for _ in range(count):
+        yield tuple(rng.choice(column) for column in columns)
+
+
+# pointers are packed as 'HH' (block, register or slot)
+MAX_BLOCKS = 2 ** 16 - 1
+
+# exit status of a worker for a run above the capacity of its engine
+SKIPPED = 3
+
+
+def capacity(engine, db):
+    """Returns the rows a table of engine can hold, with the strings of Employee.csv."""
+    # heap and pax keep a pointer to the register after the last one, so
+    # the last register of block MAX_BLOCKS stays unused
+    if engine == 'heap':
+        return db.records_per_block(1) + (MAX_BLOCKS - 1) * db.records_per_block(2) - 1
+
+    if engine == 'pax':
+        return MAX_BLOCKS * db.REGISTERS - 1
+
+    # every string of the dataset fits in the dictionary, so records take a
+    # code byte per string; block 1 also holds the file header
+    from main import RecordVar
+
+    record = RecordVar.FIXED_RECORD_SIZE + 3 + db.SLOT_SIZE
+    return MAX_BLOCKS * ((db.BLOCK_SIZE - db.PAGE_HEADER_SIZE) // record) - -(-db.HEADER_SIZE // record)
+
+
+def percentile(ordered, p):
+    # nearest rank
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def summary(latencies, total):
+    ordered = sorted(latencies)
+
+    result = {
+        'operations':  len(ordered),
+        'seconds':     total,
+        'throughput':  len(ordered) / total if total else None,
+        'mean':        sum(ordered) / len(ordered) if ordered else None,
+        'max':         ordered[-1] if ordered else None,
+    }
+
+    for p in PERCENTILES:
+        result[f'p{p}'] = percentile(ordered, p) if ordered else None
+
+    return result
+
+
+def files_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+class Workload:
+    """Latencies, blocks and cache counters of one workload."""
+
+    def __init__(self, db, directory):
+        self.db        = db
+        self.directory = directory
+        self.latencies = list()
+        self.blocks    = list()
+        self.hits      = db.pool.hits
+        self.misses    = db.pool.misses
+        self.start     = time.perf_counter()
+
+
+    def query(self, **kwargs):
+        start = time.perf_counter()
+        rows = self.db.iter_select(**kwargs)
+
+        for _ in rows:
+            pass
+
+        self.latencies.append(time.perf_counter() - start)
+        self.blocks.append(rows.accessed_blocks)
+
+
+    def delete(self, **kwargs):
+        start = time.perf_counter()
+        blocks = self.db.delete(**kwargs)
+
+        self.latencies.append(time.perf_counter() - start)
+        self.blocks.append(blocks)
+
+
+    def insert(self, rows):
+        for row in rows:
+            start = time.perf_counter()
+            self.db.insert(*row)
+            self.latencies.append(time.perf_counter() - start)
+
+
+    def result(self):
+        # writes of the workload count in its time, not in the next one
+        self.db.flush()
+        result = summary(self.latencies, time.perf_counter() - self.start)
+
+        result['accessed_blocks'] = sum(self.blocks) if self.blocks else None
+        result['mean_blocks']     = sum(self.blocks) / len(self.blocks) if self.blocks else None
+        result['cache_hits']      = self.db.pool.hits - self.hits
+        result['cache_misses']    = self.db.pool.misses - self.misses
+        result['file_size']       = os.path.getsize(os.path.join(self.directory, self.db.FILENAME))
+        result['total_size']      = files_size(self.directory)
+
+        return result
+
+
+def run(engine, count, options, seed, queries, scans):
+    """Runs every workload on a new table of engine, in the current directory."""
+    sys.path.insert(0, os.path.join(ROOT, engine))
+
+    import main
+
+    directory = os.getcwd()
+    db = getattr(main, ENGINES[engine])(**options)
+    limit = capacity(engine, db)
+
+    if count > limit:
+        db.close()
+        print(f'{engine} holds at most {limit} rows, skipping the run of {count} rows', file=sys.stderr)
+        sys.exit(SKIPPED)
+
+    rng = random.Random(seed + 1)
+    results = dict()
+
+    workload = Workload(db, directory)
+    workload.insert(generate_rows(count, seed))
+    results['insert'] = workload.result()
+
+    serial = db.actual_serial()
+    ids = lambda n: rng.sample(range(1, serial + 1), min(n, serial))
+
+    workload = Workload(db, directory)
+    for id in ids(queries):
+        workload.query(id=id)
+    results['point_lookup'] = workload.result()
+
+    workload = Workload(db, directory)
+    for _ in range(max(1, queries // 10)):
+        workload.query(id=set(ids(100)))
+    results['in_list'] = workload.result()
+
+    years = sorted(set(columns_of(DATA)[1]))
+
+    workload = Workload(db, directory)
+    for year in years:
+        workload.query(year=year)
+    results['year_filter'] = workload.result()
+
+    workload = Workload(db, directory)
+    for _ in range(scans):
+        workload.query()
+    results['full_scan'] = workload.result()
+
+    before = len(list(db.iter_select()))
+
+    workload = Workload(db, directory)
+    for id in ids(queries):
+        workload.delete(id=id)
+    workload.delete(year=years[-1])
+    results['delete'] = workload.result()
+
+    deleted = before - len(list(db.iter_select()))
+
+    workload = Workload(db, directory)
+    workload.insert(generate_rows(deleted, seed + 2))
+    results['reinsert'] = workload.result()
+
+    db.close()
+
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit':    commit,
+        'python':    platform.python_version(),
+        'platform':  platform.platform(),
+        'processor': platform.processor(),
+        'cpus':      os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def benchmark(engines, counts, options, seed, queries, scans):
+    results = list()
+
+    for count in counts:
+        for engine in engines:
+            directory = tempfile.mkdtemp(prefix=f'benchmark-{engine}-')
+            output = os.path.join(directory, 'result.json')
+
+            try:
+                worker = subprocess.run(
+                    [
+                        sys.executable, os.path.abspath(__file__), '--worker', engine,
+                        '--rows', str(count), '--options', json.dumps(options), '--seed', str(seed),
+                        '--queries', str(queries), '--scans', str(scans), '--output', output,
+                    ],
+                    cwd=directory,
+                )
+
+                if worker.returncode == SKIPPED:
+                    results.append({'engine': engine, 'rows': count, 'skipped': 'above the capacity of the engine'})
+                    continue
+
+                worker.check_returncode()
+
+                with open(output, 'r') as f:
+                    workloads = json.load(f)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+            results.append({'engine': engine, 'rows': count, 'workloads': workloads})
+            print(f'{engine} {count} rows: {workloads["insert"]["throughput"]:.0f} inserts/s, '
+                  f'full scan p50 {workloads["full_scan"]["p50"]:.4f}s', file=sys.stderr)
+
+    return {
+        'environment': environment(),
+        'parameters':  {'seed': seed, 'queries': queries, 'scans': scans, 'options': options},
+        'results':     results,
+    }
+
+
+# measures compared by --compare, and whether a larger value is better
+MEASURES = {'p50': False, 'p99': False, 'throughput': True, 'mean_blocks': False, 'file_size': False}
+
+
+def compare(old, new, threshold):
+    """Returns the measures that got worse by more than threshold (a fraction), as lines."""
+    before = {(r['engine'], r['rows']): r.get('workloads', {}) for r in old['results']}
+    regressions = list()
+
+    # skipped runs have no workloads
+    for result in new['results']:
+        key = (result['engine'], result['rows'])
+
+        for name, workload in result.get('workloads', {}).items():
+            previous = before.get(key, {}).get(name)
+
+            if previous is None:
+                continue
+
+            for measure, larger_is_better in MEASURES.items():
+                a, b = previous.get(measure), workload.get(measure)
+
+                if not a or b is None:
+                    continue
+
+                change = (a - b) / a if larger_is_better else (b - a) / a
+
+                if change > threshold:
+                    regressions.append(f'{key[0]} {key[1]} rows {name} {measure}: {a:.6g} -> {b:.6g} ({change:+.1%})')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the storage engines on synthetic tables.')
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000],
+                        help='table sizes, from 10000 rows up to the capacity of each engine '
+                             '(about 7M rows for heap and pax and 9.9M for heapvar)')
+    parser.add_argument('--options', default='{}', help='keyword arguments of the engines, as JSON')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=1000, help='point lookups and deletes by id')
+    parser.add_argument('--scans', type=int, default=5, help='full scans')
+    parser.add_argument('--output', help='result file, instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.1, help='regression threshold of --compare')
+    parser.add_argument('--worker', choices=sorted(ENGINES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], 'r') as old, open(args.compare[1], 'r') as new:
+            regressions = compare(json.load(old), json.load(new), args.threshold)
+
+        print('\n'.join(regressions) or 'no regressions')
+        sys.exit(1 if regressions else 0)
+
+    options = json.loads(args.options)
+
+    if args.worker:
+        result = run(args.worker, args.rows[0], options, args.seed, args.queries, args.scans)
+    else:
+        result = benchmark(args.engines, args.rows, options, args.seed, args.queries, args.scans)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
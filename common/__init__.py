@@ -0,0 +1,7 @@
+"""
+   Modules shared by the storage engines: the buffer pool, the write-ahead
+   log, the table locks, the indexes, the zone map, the predicates and
+   aggregations, the block compression, the I/O statistics and the CSV
+   reader. Each engine's main.py puts the root of the repository on
+   sys.path and imports them from here.
+"""
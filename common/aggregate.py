@@ -0,0 +1,193 @@
+class Aggregation:
+   """
+      GROUP BY of a query with COUNT, SUM, AVG, MIN and MAX, computed inside
+      the scan loop. add() is compiled once per query into a Python function
+      feeding records (as the scan unpacked them, or (record, strings) pairs
+      when has_strings) to one accumulator list per group, so no row is put
+      together and no string is decoded until rows() is called.
+
+      group_by is a column or a list of columns. aggs maps the name of every
+      result column to (function, column); count also takes '*', or just
+      'count' alone. Without aggs the groups are counted as 'count'.
+
+      columns and dictionaries are those of Predicate: a string column is
+      read as bytes padded to its width, or as the code of its value in
+      the dictionary (or the value itself when it has none). Group keys and
+      minimums and maximums of strings are decoded by rows(), except MIN and
+      MAX of coded strings, which are decoded as they are compared.
+   """
+
+   FUNCTIONS = ('count', 'sum', 'avg', 'mean', 'min', 'max')
+
+   def __init__(self, group_by, aggs, columns, dictionaries = None):
+      self.group_by     = [group_by] if type(group_by) == str else list(group_by or ())
+      self.aggs         = self.normalize(aggs if aggs is not None else {'count': 'count'})
+      self.dictionaries = dictionaries or dict()
+
+      for column in self.group_by:
+         if column not in columns:
+            raise KeyError(f"UNKNOWN COLUMN {column}")
+
+      for name, function, column in self.aggs:
+         if column == '*':
+            continue
+         if column not in columns:
+            raise KeyError(f"UNKNOWN COLUMN {column}")
+         if function in ('sum', 'avg', 'mean') and (columns[column][2] is not None or column in self.dictionaries):
+            raise ValueError(f"{function.upper()} OF STRING COLUMN {column}")
+
+      # columns the records need, and whether some are in the strings
+      self.used = set(self.group_by) | {column for name, function, column in self.aggs if column != '*'}
+      self.has_strings = any(columns[column][0] == 's' for column in self.used)
+
+      self.project(columns)
+
+
+   def normalize(self, aggs):
+      normalized = list()
+
+      for name, agg in aggs.items():
+         function, column = (agg, '*') if type(agg) == str else agg
+         function = function.lower()
+
+         if function not in self.FUNCTIONS:
+            raise ValueError(f"UNKNOWN AGGREGATE {function}")
+         if column == '*' and function != 'count':
+            raise KeyError(f"{function} NEEDS A COLUMN")
+
+         normalized.append((name, function, column))
+
+      return normalized
+
+
+   def project(self, columns):
+      """Compiles add() for records read through columns, dropping the groups so far."""
+      self.columns = columns
+      self.groups  = dict() # group key -> [count, one slot per aggregate but count]
+      self.add     = self.compile()
+
+
+   def field(self, column):
+      source, position, width = self.columns[column]
+      return f'{source}[{position}]'
+
+
+   def compile(self):
+      namespace = {'__builtins__': {}, 'groups': self.groups}
+
+      keys = [self.field(column) for column in self.group_by]
+      key = keys[0] if len(keys) == 1 else f'({", ".join(keys)},)' if keys else '()'
+
+      # values are read once into locals: x0, x1, ...
+      values, locals_ = dict(), list()
+      init, update = ['1'], ['a[0] += 1']
+
+      for name, function, column in self.aggs:
+         if function == 'count':
+            continue
+
+         expression = self.field(column)
+
+         if function in ('min', 'max') and column in self.dictionaries:
+            decoder = f'd{len(namespace)}'
+            namespace[decoder] = self.decoder(column)
+            expression = f'{decoder}({expression})'
+
+         if expression not in values:
+            values[expression] = f'x{len(values)}'
+            locals_.append(f'{values[expression]} = {expression}')
+
+         value, slot = values[expression], len(init)
+         init.append(value)
+
+         if function == 'min':
+            update.append(f'if {value} < a[{slot}]: a[{slot}] = {value}')
+         elif function == 'max':
+            update.append(f'if {value} > a[{slot}]: a[{slot}] = {value}')
+         else:
+            update.append(f'a[{slot}] += {value}')
+
+      body = '\n'.join(f'      {line}' for line in locals_ + [f'a = get({key})', 'if a is None:'])
+
+      source = (
+         f'def add(rows):\n'
+         f'   get = groups.get\n'
+         f'   for {"r, s" if self.has_strings else "r"} in rows:\n'
+         f'{body}\n'
+         f'         groups[{key}] = [{", ".join(init)}]\n'
+         f'         continue\n'
+         + ''.join(f'      {line}\n' for line in update)
+      )
+
+      exec(source, namespace)
+      return namespace['add']
+
+
+   def decoder(self, column):
+      values = self.dictionaries[column]
+      return lambda token: values[token] if token.__class__ is int else token
+
+
+   def decode(self, column, value):
+      if column in self.dictionaries:
+         return self.decoder(column)(value)
+      if self.columns[column][2] is not None and type(value) == bytes:
+         return value.decode('utf-8').rstrip('\x00')
+
+      return value
+
+
+   def rows(self):
+      """Returns a dict of the group columns and the aggregates for every group, in group order."""
+      functions = [function for name, function, column in self.aggs if function != 'count']
+      merged = dict()
+
+      # a string may be a code in a group and inline in another, so the
+      # groups are merged once their keys are decoded
+      for key, accumulator in self.groups.items():
+         key = (key,) if len(self.group_by) == 1 else key
+         key = tuple(self.decode(column, value) for column, value in zip(self.group_by, key))
+         previous = merged.get(key)
+
+         if previous is None:
+            merged[key] = list(accumulator)
+            continue
+
+         previous[0] += accumulator[0]
+
+         for slot, function in enumerate(functions, 1):
+            if function == 'min':
+               previous[slot] = min(previous[slot], accumulator[slot])
+            elif function == 'max':
+               previous[slot] = max(previous[slot], accumulator[slot])
+            else:
+               previous[slot] += accumulator[slot]
+
+      # without groups the whole table is one group, even when it is empty
+      if not merged and not self.group_by:
+         merged[()] = [0] + [None] * len(functions)
+
+      rows = list()
+
+      for key in sorted(merged):
+         accumulator, slot = merged[key], 1
+         row = dict(zip(self.group_by, key))
+
+         for name, function, column in self.aggs:
+            if function == 'count':
+               row[name] = accumulator[0]
+               continue
+
+            value = accumulator[slot]
+            slot += 1
+
+            if function in ('avg', 'mean'):
+               row[name] = value / accumulator[0] if accumulator[0] else None
+            elif function in ('min', 'max'):
+               row[name] = self.decode(column, value) if value is not None else None
+            else:
+               row[name] = value
+
+         rows.append(row)
+
+      return rows
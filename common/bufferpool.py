@@ -0,0 +1,224 @@
+import threading
+from collections import OrderedDict
+
+
+class NoLatch:
+   """Stands for the latch of a block when the pool has no latches."""
+
+   def acquire(self):
+      return True
+
+   def release(self):
+      pass
+
+   def locked(self):
+      return False
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      return False
+
+
+class BufferPool:
+   """
+      LRU page cache over the blocks of one file.
+
+      Block b (starting at 1) is stored at base_offset + (b - 1) * block_size.
+      Pages are bytearrays changed in place by the caller, who then calls
+      mark_dirty(); dirty pages are written back when evicted or on flush().
+      With a WriteAheadLog attached they are written to the log instead, see
+      WriteAheadLog.attach().
+
+      The pool can be shared by threads. With latches, a thread changing or
+      copying a page while others may use the same block holds latch(block),
+      and latched pages are not evicted.
+
+      With a CompressedStore the blocks are read from and written to the
+      store, which keeps them compressed in the file.
+   """
+
+   NO_LATCH = NoLatch()
+
+   def __init__(self, filename, block_size, size, base_offset = 0, latches = False, store = None):
+      self.filename    = filename
+      self.block_size  = block_size
+      self.base_offset = base_offset
+      self.capacity    = max(2, size // block_size) # pages kept in memory
+      self.pages       = OrderedDict()               # block -> bytearray
+      self.dirty       = set()
+      self.hits        = 0
+      self.misses      = 0
+      self.wal         = None                        # WriteAheadLog, see attach()
+      self.file_id     = None                        # id of the file in the log
+      self.mutex       = threading.RLock()           # guards the pages and the file
+      self.latches     = dict() if latches else None # block -> threading.Lock
+      self.store       = store                       # CompressedStore, or None for a plain file
+      self.io          = None                        # IOStats counting the I/O on the file, see IOStats.attach()
+      self.file        = store.file if store is not None else open(filename, 'rb+')
+
+
+   def block_offset(self, block):
+      return self.base_offset + (block - 1) * self.block_size
+
+
+   def latch(self, block):
+      if self.latches is None:
+         return self.NO_LATCH
+
+      latch = self.latches.get(block)
+
+      if latch is None:
+         latch = self.latches.setdefault(block, threading.Lock())
+
+      return latch
+
+
+   def get(self, block):
+      with self.mutex:
+         page = self.pages.get(block)
+
+         if page is not None:
+            self.pages.move_to_end(block)
+            self.hits += 1
+            return page
+
+         self.misses += 1
+
+         if self.store is not None:
+            data = self.store.read(block, self.wal, self.file_id)
+         else:
+            data = self.wal.read(self.file_id, self.block_offset(block)) if self.wal is not None else None
+
+            if data is None:
+               self.file.seek(self.block_offset(block))
+               data = self.file.read(self.block_size)
+
+         page = bytearray(self.block_size)
+         page[:len(data)] = data
+
+         self.put(block, page)
+         return page
+
+
+   def new_block(self, block):
+      """Returns a zeroed page for a block that is not on disk yet."""
+      page = bytearray(self.block_size)
+
+      with self.mutex:
+         self.put(block, page)
+         self.dirty.add(block)
+
+      return page
+
+
+   def mark_dirty(self, block, page):
+      with self.mutex:
+         if block not in self.pages:
+            self.put(block, page)
+
+         self.dirty.add(block)
+
+
+   def put(self, block, page):
+      self.pages[block] = page
+      self.pages.move_to_end(block)
+
+      while len(self.pages) > self.capacity and self.evict():
+         pass
+
+
+   def evict(self):
+      # the least recently used page, skipping the ones latched by a thread
+      if self.latches is None:
+         block = next(iter(self.pages))
+      else:
+         block = next((block for block in self.pages if not self.latch(block).locked()), None)
+
+         if block is None:
+            return False
+
+      page = self.pages.pop(block)
+
+      if block in self.dirty:
+         self.write_page(block, page)
+         self.dirty.discard(block)
+
+      return True
+
+
+   def write_page(self, block, page):
+      if self.store is not None:
+         self.store.write(block, page, self.wal, self.file_id)
+         return
+
+      if self.wal is not None:
+         self.wal.log(self.file_id, self.block_offset(block), page)
+         return
+
+      self.file.seek(self.block_offset(block))
+      self.file.write(page)
+
+
+   def flush(self):
+      with self.mutex:
+         if self.file.closed:
+            return
+
+         for block in sorted(self.dirty):
+            self.write_page(block, self.pages[block])
+
+         self.dirty.clear()
+         self.file.flush()
+
+         if self.store is not None:
+            self.store.flush()
+
+
+   def clear(self):
+      """Drops every page without writing it (the file was replaced)."""
+      with self.mutex:
+         self.pages.clear()
+         self.dirty.clear()
+
+         if self.store is not None:
+            self.store.reload()
+
+
+   def drop(self, block):
+      """Forgets a block without writing it (it was cut from the file)."""
+      with self.mutex:
+         self.pages.pop(block, None)
+         self.dirty.discard(block)
+
+
+   def truncate(self, block):
+      """Cuts the file before block."""
+      with self.mutex:
+         if self.store is not None:
+            self.store.truncate(block, self.wal, self.file_id)
+         elif self.wal is not None:
+            self.wal.truncate(self.file_id, self.block_offset(block))
+         else:
+            self.file.truncate(self.block_offset(block))
+
+
+   def reopen(self):
+      with self.mutex:
+         self.clear()
+         self.file.close()
+         self.file = self.io.open(self.filename, 'rb+') if self.io is not None else open(self.filename, 'rb+')
+
+
+   def close(self):
+      with self.mutex:
+         if self.file.closed:
+            return
+
+         self.flush()
+
+         if self.store is not None:
+            self.store.close()
+         else:
+            self.file.close()
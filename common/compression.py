@@ -0,0 +1,379 @@
+import os
+import zlib
+import struct
+from bisect import bisect
+
+from .bufferpool import BufferPool
+
+
+class CompressedStore:
+   """
+      Blocks of a file kept compressed with zlib, for a BufferPool that
+      caches them decompressed.
+
+      The file keeps its first base_offset bytes and its first raw_blocks
+      blocks as they are, at their usual offsets. Every other block is
+      stored as a compressed image after them, and the block directory (a
+      file of its own) has the offset, capacity and length of the image of
+      block raw_blocks + k at entry (k - 1) % entries of page
+      (k - 1) // entries + 1. An entry of zeros is a block that was never
+      written (all zeros).
+
+      Images get a capacity rounded up to QUANTUM bytes, so a block that
+      grows a little is rewritten in place. A block that outgrows its
+      capacity moves to the first free extent it fits in, or to the end of
+      the file, and its old image becomes a free extent.
+
+      Only sealed blocks are compressed. The last block is still being
+      filled, so it is kept raw (an image of block_size bytes) and
+      rewritten in place until a block after it is written, which seals
+      it. A block that does not compress is kept raw as well.
+
+      With a WriteAheadLog the images are logged, like the pages of the
+      pool, and the directory has a pool of its own to attach to the log.
+   """
+
+   ENTRY   = struct.Struct('=Q I I') # offset, capacity, length of the image
+   QUANTUM = 256                     # bytes, images grow in place up to their capacity
+   LEVEL   = 6                       # zlib compression level
+
+   def __init__(self, filename, directory, block_size, base_offset = 0, raw_blocks = 0, pool_size = 256 * 1024):
+      self.filename    = filename
+      self.block_size  = block_size
+      self.base_offset = base_offset
+      self.raw_blocks  = raw_blocks
+      self.entries     = block_size // self.ENTRY.size # entries per directory page
+
+      if not os.path.exists(directory):
+         open(directory, 'wb').close()
+
+      self.file      = open(filename, 'rb+')
+      self.directory = BufferPool(directory, block_size, pool_size)
+      self.io        = None # IOStats, see IOStats.attach()
+
+      # physical reads and writes of images, against the logical blocks
+      self.reads         = 0
+      self.bytes_read    = 0
+      self.writes        = 0
+      self.bytes_written = 0
+
+      self.load()
+
+
+   def load(self):
+      # the end of the file and the last block come from the directory
+      self.end     = self.base_offset + self.raw_blocks * self.block_size
+      self.blocks  = self.raw_blocks
+      self.stored  = 0      # bytes of the images
+      self.garbage = 0      # bytes of the file no image uses
+      self.free    = list() # [offset, size] of the extents between images, by offset
+      extents = list()
+
+      for page_no in range(1, os.path.getsize(self.directory.filename) // self.block_size + 1):
+         page = self.directory.get(page_no)
+
+         for i, (offset, capacity, length) in enumerate(self.ENTRY.iter_unpack(page[:self.entries * self.ENTRY.size])):
+            if capacity == 0:
+               continue
+
+            self.end = max(self.end, offset + capacity)
+            self.blocks = max(self.blocks, self.raw_blocks + (page_no - 1) * self.entries + i + 1)
+            self.stored += length
+            extents.append((offset, capacity))
+
+      self.end = max(self.end, os.fstat(self.file.fileno()).st_size)
+      self.garbage = self.end - self.base_offset - self.raw_blocks * self.block_size - self.stored
+
+      position = self.base_offset + self.raw_blocks * self.block_size
+
+      for offset, capacity in sorted(extents) + [(self.end, 0)]:
+         if offset > position:
+            self.free.append([position, offset - position])
+
+         position = max(position, offset + capacity)
+
+
+   def reload(self):
+      """Drops the cached directory pages (the files were changed)."""
+      self.directory.clear()
+      self.load()
+
+
+   def locate(self, block):
+      block -= self.raw_blocks + 1
+      return block // self.entries + 1, (block % self.entries) * self.ENTRY.size
+
+
+   def raw_offset(self, block):
+      return self.base_offset + (block - 1) * self.block_size
+
+
+   def entry(self, block):
+      page_no, offset = self.locate(block)
+      return self.ENTRY.unpack_from(self.directory.get(page_no), offset)
+
+
+   def set_entry(self, block, offset, capacity, length):
+      page_no, position = self.locate(block)
+      page = self.directory.get(page_no)
+
+      self.ENTRY.pack_into(page, position, offset, capacity, length)
+      self.directory.mark_dirty(page_no, page)
+
+
+   def read_bytes(self, offset, length, wal, file_id):
+      data = wal.read(file_id, offset) if wal is not None else None
+
+      if data is None:
+         self.file.seek(offset)
+         data = self.file.read(length)
+
+      self.reads += 1
+      self.bytes_read += len(data)
+
+      return data
+
+
+   def write_bytes(self, offset, data, wal, file_id):
+      if wal is not None:
+         wal.log(file_id, offset, data)
+      else:
+         self.file.seek(offset)
+         self.file.write(data)
+
+      self.writes += 1
+      self.bytes_written += len(data)
+
+
+   def read(self, block, wal = None, file_id = None):
+      """Returns the bytes of block, decompressed."""
+      if block <= self.raw_blocks:
+         return self.read_bytes(self.raw_offset(block), self.block_size, wal, file_id)
+
+      offset, capacity, length = self.entry(block)
+
+      if length == 0:
+         return b''
+
+      data = self.read_bytes(offset, length, wal, file_id)[:length]
+      return data if length == self.block_size else zlib.decompress(data)
+
+
+   def compress(self, page):
+      image = zlib.compress(bytes(page), self.LEVEL)
+      return image if len(image) < self.block_size else bytes(page)
+
+
+   def write(self, block, page, wal = None, file_id = None):
+      """Writes page as the image of block, compressed unless block is the last one."""
+      if block <= self.raw_blocks:
+         return self.write_bytes(self.raw_offset(block), page, wal, file_id)
+
+      if block > self.blocks:
+         self.seal(self.blocks, wal, file_id)
+
+      self.put(block, bytes(page) if block >= self.blocks else self.compress(page), wal, file_id)
+      self.blocks = max(self.blocks, block)
+
+
+   def seal(self, block, wal, file_id):
+      # compresses the raw image of what was the last block
+      if block <= self.raw_blocks or self.entry(block)[2] != self.block_size:
+         return
+
+      self.put(block, self.compress(self.read(block, wal, file_id)), wal, file_id)
+
+
+   def put(self, block, image, wal, file_id):
+      offset, capacity, length = self.entry(block)
+      size = -(-len(image) // self.QUANTUM) * self.QUANTUM
+
+      self.stored -= length
+      self.garbage -= capacity - length
+
+      if len(image) > capacity:
+         self.garbage += capacity
+
+         # the log must not write the old image over what goes there now
+         if wal is not None and capacity != 0:
+            wal.forget(file_id, offset)
+
+         self.release(offset, capacity)
+         offset, capacity = self.allocate(size), size
+
+      # a sealed block gives back the rest of its raw image
+      elif length == self.block_size and size < capacity:
+         self.garbage += capacity - size
+         self.release(offset + size, capacity - size)
+         capacity = size
+
+      self.write_bytes(offset, image, wal, file_id)
+      self.set_entry(block, offset, capacity, len(image))
+
+      self.stored += len(image)
+      self.garbage += capacity - len(image)
+
+
+   def allocate(self, size):
+      """Returns the offset of size free bytes: the first free extent large enough, or the end of the file."""
+      for i, extent in enumerate(self.free):
+         if extent[1] >= size:
+            offset = extent[0]
+
+            if extent[1] == size:
+               del self.free[i]
+            else:
+               extent[0] += size
+               extent[1] -= size
+
+            self.garbage -= size
+            return offset
+
+      # a free extent at the end of the file grows into the new bytes
+      if self.free and self.free[-1][0] + self.free[-1][1] == self.end:
+         offset, free = self.free.pop()
+         self.garbage -= free
+      else:
+         offset = self.end
+
+      self.end = offset + size
+      return offset
+
+
+   def release(self, offset, size):
+      """Makes size bytes at offset a free extent, merged with its neighbours."""
+      if size == 0:
+         return
+
+      i = bisect(self.free, [offset, size])
+
+      if i > 0 and self.free[i - 1][0] + self.free[i - 1][1] == offset:
+         i -= 1
+         self.free[i][1] += size
+      else:
+         self.free.insert(i, [offset, size])
+
+      if i + 1 < len(self.free) and self.free[i][0] + self.free[i][1] == self.free[i + 1][0]:
+         self.free[i][1] += self.free.pop(i + 1)[1]
+
+
+   def truncate(self, block, wal = None, file_id = None):
+      """Forgets the blocks from block on; their images become free extents."""
+      for b in range(max(block, self.raw_blocks + 1), self.blocks + 1):
+         offset, capacity, length = self.entry(b)
+
+         if capacity != 0:
+            self.set_entry(b, 0, 0, 0)
+            self.release(offset, capacity)
+
+            if wal is not None:
+               wal.forget(file_id, offset)
+
+            self.stored -= length
+            self.garbage += length
+
+      self.blocks = min(self.blocks, block - 1)
+
+
+   def stats(self):
+      """Returns the physical reads and writes and the sizes of the blocks stored."""
+      blocks = self.blocks - self.raw_blocks
+
+      return {
+         'blocks':         self.blocks,
+         'logical_bytes':  blocks * self.block_size,
+         'stored_bytes':   self.stored,
+         'garbage_bytes':  self.garbage,
+         'ratio':          blocks * self.block_size / self.stored if self.stored else None,
+         'reads':          self.reads,
+         'bytes_read':     self.bytes_read,
+         'writes':         self.writes,
+         'bytes_written':  self.bytes_written,
+      }
+
+
+   def flush(self):
+      self.directory.flush()
+      self.file.flush()
+
+
+   def close(self):
+      self.directory.close()
+      self.file.close()
+
+
+   @classmethod
+   def compress_file(cls, filename, directory, block_size, base_offset = 0, raw_blocks = 0):
+      """Rewrites the plain file filename with its blocks compressed, and creates directory."""
+      prefix = base_offset + raw_blocks * block_size
+
+      with open(filename, 'rb') as f, open(filename + '.tmp', 'wb') as tmp:
+         tmp.write(f.read(prefix))
+
+      if os.path.exists(directory + '.tmp'):
+         os.remove(directory + '.tmp')
+
+      store = cls(filename + '.tmp', directory + '.tmp', block_size, base_offset, raw_blocks)
+
+      with open(filename, 'rb') as f:
+         f.seek(prefix)
+
+         for block, page in enumerate(iter(lambda: f.read(block_size), b''), raw_blocks + 1):
+            store.write(block, page.ljust(block_size, b'\x00'))
+
+      store.flush()
+      os.fsync(store.file.fileno())
+      os.fsync(store.directory.file.fileno())
+      store.close()
+
+      # see recover_conversion()
+      os.replace(filename + '.tmp', filename)
+      os.replace(directory + '.tmp', directory)
+
+
+   @classmethod
+   def decompress_file(cls, filename, directory, block_size, base_offset = 0, raw_blocks = 0):
+      """Rewrites filename with its blocks as plain blocks, and removes directory."""
+      store = cls(filename, directory, block_size, base_offset, raw_blocks)
+
+      with open(filename + '.tmp', 'wb') as tmp:
+         store.file.seek(0)
+         tmp.write(store.file.read(base_offset + raw_blocks * block_size))
+
+         for block in range(raw_blocks + 1, store.blocks + 1):
+            tmp.write(store.read(block).ljust(block_size, b'\x00'))
+
+         tmp.flush()
+         os.fsync(tmp.fileno())
+
+      store.close()
+
+      # see recover_conversion()
+      os.replace(directory, directory + '.old')
+      os.replace(filename + '.tmp', filename)
+      os.remove(directory + '.old')
+
+
+   @staticmethod
+   def recover_conversion(filename, directory):
+      """
+         Finishes or undoes a conversion cut by a crash. The new file is
+         written to filename.tmp first: while it is there the conversion is
+         undone, once it replaced filename the conversion is finished.
+      """
+      converted = not os.path.exists(filename + '.tmp')
+
+      if os.path.exists(directory + '.old'):
+         if converted:
+            os.remove(directory + '.old')
+         else:
+            os.replace(directory + '.old', directory)
+
+      elif os.path.exists(directory + '.tmp'):
+         if converted:
+            os.replace(directory + '.tmp', directory)
+         else:
+            os.remove(directory + '.tmp')
+
+      if not converted:
+         os.remove(filename + '.tmp')
@@ -0,0 +1,208 @@
+import os
+import struct
+import threading
+
+try:
+   import fcntl
+except ImportError: # no advisory file locks (Windows): only threads are coordinated
+   fcntl = None
+
+
+class LockHold:
+   """Context manager of TableLock.hold()."""
+
+   def __init__(self, lock, mode):
+      self.lock = lock
+      self.mode = mode
+
+   def __enter__(self):
+      # a generator holding the lock may be closed by another thread
+      self.thread = threading.get_ident()
+      self.lock.acquire(self.mode, self.thread)
+      return self
+
+   def __exit__(self, *exc_info):
+      self.lock.release(self.thread)
+      return False
+
+
+class TableLock:
+   """
+      Lock of a table for the threads of a process and, with a lock file,
+      for other processes through fcntl advisory locks.
+
+      'read' and 'scan' are shared and 'write' is exclusive. 'append' runs
+      along with sequential scans ('scan'), whose pages are guarded by block
+      latches (see BufferPool.latch), and excludes every other mode.
+      Requests are served in order, so a stream of readers does not starve
+      a writer.
+
+      A thread may take a lock again, in a mode no stronger than one it
+      holds; asking for a stronger mode raises RuntimeError instead of
+      waiting for itself.
+
+      Across processes the shared modes take LOCK_SH on the lock file and the
+      others LOCK_EX ('append' becomes 'write'). The file keeps a counter the
+      last writer bumps as it leaves, after publish() wrote its changes back.
+      A process that finds the counter changed calls changed() to drop what
+      it cached before reading.
+   """
+
+   COMPATIBLE = {
+      'read':   {'read', 'scan'},
+      'scan':   {'read', 'scan', 'append'},
+      'append': {'scan'},
+      'write':  set(),
+   }
+
+   STRENGTH = {'read': 0, 'scan': 0, 'append': 1, 'write': 2}
+   VERSION  = '=Q'
+
+   def __init__(self, filename = None):
+      self.mutex           = threading.Lock()
+      self.condition       = threading.Condition(self.mutex)
+      self.waiting         = 0                # threads waiting on the condition
+      self.holders         = dict()           # thread -> modes held, in the order taken
+      self.queue           = list()           # (ticket, mode) waiting, in arrival order
+      self.changed         = None             # called when another process wrote the table
+      self.publish         = None             # called by the last writer before unlocking
+      self.fd              = None             # lock file, shared with other processes
+      self.process_mutex   = threading.Lock()
+      self.process_holders = 0                # threads under the file lock
+      self.version         = 0                # counter of the lock file last seen
+
+      if filename is not None and fcntl is not None:
+         self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+         self.version = self.read_version()
+
+
+   def compatible(self, mode, thread):
+      for holder, modes in self.holders.items():
+         if holder != thread and any(held not in self.COMPATIBLE[mode] for held in modes):
+            return False
+
+      return True
+
+
+   def first_in_line(self, ticket, mode):
+      for waiting, waiting_mode in self.queue:
+         if waiting is ticket:
+            return True
+         if waiting_mode not in self.COMPATIBLE[mode]:
+            return False
+
+      return True
+
+
+   def acquire(self, mode, thread = None):
+      if self.fd is not None and mode == 'append':
+         mode = 'write'
+
+      thread = thread if thread is not None else threading.get_ident()
+
+      with self.mutex:
+         modes = self.holders.get(thread)
+
+         if modes:
+            if self.STRENGTH[mode] > max(self.STRENGTH[held] for held in modes):
+               raise RuntimeError(f"{mode.upper()} LOCK WHILE HOLDING A {modes[0].upper()} LOCK")
+
+            while not self.compatible(mode, thread):
+               self.wait()
+
+            modes.append(mode)
+            return
+
+         if self.queue or (self.holders and not self.compatible(mode, thread)):
+            ticket = object()
+            self.queue.append((ticket, mode))
+
+            while not (self.compatible(mode, thread) and self.first_in_line(ticket, mode)):
+               self.wait()
+
+            self.queue.remove((ticket, mode))
+
+         self.holders[thread] = [mode]
+
+      if self.fd is not None:
+         self.lock_process(mode)
+
+
+   def release(self, thread = None):
+      thread = thread if thread is not None else threading.get_ident()
+
+      if self.fd is not None:
+         with self.mutex:
+            modes = self.holders[thread]
+
+         if len(modes) == 1:
+            self.unlock_process(modes[0])
+
+      with self.mutex:
+         modes = self.holders[thread]
+         modes.pop()
+
+         if not modes:
+            del self.holders[thread]
+
+         if self.waiting:
+            self.condition.notify_all()
+
+
+   def wait(self):
+      self.waiting += 1
+
+      try:
+         self.condition.wait()
+      finally:
+         self.waiting -= 1
+
+
+   def hold(self, mode):
+      return LockHold(self, mode)
+
+
+   def lock_process(self, mode):
+      # the first holder of the process takes the file lock for every thread
+      with self.process_mutex:
+         self.process_holders += 1
+
+         if self.process_holders > 1:
+            return
+
+         fcntl.flock(self.fd, fcntl.LOCK_SH if mode in ('read', 'scan') else fcntl.LOCK_EX)
+         version = self.read_version()
+
+         if version != self.version:
+            self.version = version
+
+            if self.changed is not None:
+               self.changed()
+
+
+   def unlock_process(self, mode):
+      with self.process_mutex:
+         self.process_holders -= 1
+
+         if self.process_holders > 0:
+            return
+
+         if mode == 'write':
+            if self.publish is not None:
+               self.publish()
+
+            self.version += 1
+            os.pwrite(self.fd, struct.pack(self.VERSION, self.version), 0)
+
+         fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+   def read_version(self):
+      data = os.pread(self.fd, struct.calcsize(self.VERSION), 0)
+      return struct.unpack(self.VERSION, data)[0] if len(data) == struct.calcsize(self.VERSION) else 0
+
+
+   def close(self):
+      if self.fd is not None:
+         os.close(self.fd)
+         self.fd = None
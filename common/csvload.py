@@ -0,0 +1,60 @@
+import csv
+from itertools import islice
+
+
+# table column -> its column in data/Employee.csv
+EMPLOYEE_MAPPING = {'age': 'Age', 'year': 'JoiningYear', 'education': 'Education', 'city': 'City', 'gender': 'Gender'}
+
+# columns of insert(), with the type of their values and the value of a column left out
+COLUMNS = (('age', int, 0), ('year', int, 0), ('education', str, ''), ('city', str, ''), ('gender', str, ''))
+
+
+def read_chunks(path, mapping = None, chunk_rows = 4096):
+   """
+      Yields the rows of the CSV file at path as lists of up to chunk_rows
+      tuples (age, year, education, city, gender).
+
+      mapping takes a table column to the name of its CSV column, found in
+      the header line, or to its position (an int, starting at 0). Columns
+      left out of mapping get 0 or ''. The default reads data/Employee.csv.
+   """
+   mapping = mapping if mapping is not None else EMPLOYEE_MAPPING
+
+   for column in mapping:
+      if column not in [name for name, kind, default in COLUMNS]:
+         raise KeyError(f"UNKNOWN COLUMN {column}")
+
+   with open(path, 'r', newline='') as f:
+      reader = csv.reader(f)
+      header = next(reader, [])
+      positions = list()
+
+      for name, kind, default in COLUMNS:
+         source = mapping.get(name)
+
+         if source is None:
+            positions.append(None)
+         elif type(source) == int:
+            positions.append(source)
+         elif source in header:
+            positions.append(header.index(source))
+         else:
+            raise KeyError(f"UNKNOWN CSV COLUMN {source}")
+
+      # every column of the chunk is converted at once, then zipped into rows
+      def column(rows, kind, default, position):
+         if position is None:
+            return [default] * len(rows)
+
+         return list(map(kind, [r[position] for r in rows]))
+
+      while True:
+         rows = list(islice(reader, chunk_rows))
+
+         if not rows:
+            return
+
+         try:
+            yield list(zip(*[column(rows, kind, default, position) for (name, kind, default), position in zip(COLUMNS, positions)]))
+         except (ValueError, IndexError):
+            raise ValueError(f"BAD CSV ROW NEAR LINE {reader.line_num}")
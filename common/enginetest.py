@@ -0,0 +1,480 @@
+import os
+import time
+import atexit
+import threading
+
+
+class EngineTest:
+   """
+      Benchmark run by the test.py of every engine, from a directory holding
+      data/Employee.csv. An empty table is loaded with the file ten times,
+      then selects and deletes are timed and their results checked against
+      plain iter_select() answers.
+
+      The engines differ in where the id is in their rows (id_position), in
+      the pointer of an empty table (empty_pointer) and in the ids the timed
+      lookups and deletes use. Engine sections go in checks(), run before
+      the final inserts; parallel_scans(), compressed_store() and csv_load()
+      check the features only some engines have. The table is reopened
+      with the default arguments of its class, to check the recovery of the
+      write-ahead log.
+   """
+
+   SELECTION_TIMES = 10
+   COLUMNS         = ('id', 'age', 'year', 'education', 'city', 'gender')
+
+   def __init__(self, db, id_position, empty_pointer, select_ids, delete_ids):
+      self.db            = db
+      self.id_position   = id_position
+      self.empty_pointer = empty_pointer
+      self.select_ids    = select_ids
+      self.delete_ids    = delete_ids
+
+
+   def load_data(self):
+      total_time = 0
+      count = 0
+
+      for row in self.csv_rows():
+         start_time = time.time()
+         self.db.insert(*row)
+         end_time = time.time()
+
+         total_time += end_time - start_time
+         count += 1
+
+      last_pointer = self.db.last_register_pointer()
+
+      print(f"Total blocks: {last_pointer[0]}")
+
+      return total_time / count
+
+
+   def csv_rows(self):
+      # (age, year, education, city, gender) of every line of the file
+      with open('data/Employee.csv', 'r') as data:
+         head = data.readline()
+
+         for line in data:
+            ls = line.split(',')
+            ls[4] = ls[4].rstrip('\n')
+
+            yield (int(ls[3]), int(ls[1]), ls[0], ls[2], ls[4])
+
+
+   def reopen(self, **options):
+      table = type(self.db)
+      self.db.close()
+      atexit.unregister(self.db.close)
+
+      self.db = table(**options)
+      return self.db
+
+
+   def cache_counters(self):
+      return (self.db.pool.hits, self.db.pool.misses)
+
+
+   def cache_delta(self, before):
+      after = self.cache_counters()
+      return (after[0] - before[0], after[1] - before[1])
+
+
+   def ids(self, **query):
+      return [row[self.id_position] for row in self.db.iter_select(**query)]
+
+
+   def record(self, row):
+      # column -> value of a row, whatever the engine puts before the id
+      return dict(zip(self.COLUMNS, row[self.id_position:]))
+
+
+   def matching_ids(self, test):
+      return [row[self.id_position] for row in self.db.iter_select() if test(self.record(row))]
+
+
+   def timed_selects(self, title, queries):
+      blocks_list = []
+      times = []
+      cache_list = []
+
+      print(title)
+      for query in queries:
+         counters = self.cache_counters()
+         start_time = time.time()
+         blocks = self.db.select(**query)
+         end_time = time.time()
+
+         blocks_list.append(blocks)
+         times.append(end_time - start_time)
+         cache_list.append(self.cache_delta(counters))
+
+      for i in range(len(queries)):
+         print(f'    {i+1}º Read: {times[i]}s ---- {blocks_list[i]} blocks ---- {cache_list[i][0]} cache hits, {cache_list[i][1]} misses')
+
+      print("-------------------------------")
+      print(f'    Mean Time: {sum(times) / len(times)}')
+      print(f'    Mean Accessed Blocks: {sum(blocks_list) / len(blocks_list)}')
+
+      print('\n\n')
+
+
+   def main(self):
+      if self.db.last_register_pointer() == self.empty_pointer:
+         print('Loading Data:')
+         for i in range(10):
+            mean = self.load_data()
+            print(f"Mean time for all insertions: {mean}\n")
+
+      self.selects()
+      self.deletes()
+      self.predicates()
+      self.zone_maps()
+      self.id_directory()
+      self.aggregates()
+      self.concurrent_reads()
+      self.checks()
+      self.recovery()
+
+      print('Inserting Again')
+
+      for i in range(4):
+         mean = self.load_data()
+         print(f"    Mean time: {mean}")
+
+
+   def selects(self):
+      db = self.db
+
+      self.timed_selects('Selecting All', [{}] * self.SELECTION_TIMES)
+      self.timed_selects('Selecting by id', [{'id': id} for id in self.select_ids])
+
+
+      print('Selecting by ids')
+      ids_set = set(self.select_ids)
+
+      counters = self.cache_counters()
+      start_time = time.time()
+      blocks = db.select(id=ids_set)
+      end_time = time.time()
+
+      total = end_time - start_time
+      hits, misses = self.cache_delta(counters)
+
+      print("-------------------------------")
+      print(f'    Total Time: {total}')
+      print(f'    Accessed Blocks: {blocks}')
+      print(f'    Cache Hits: {hits} ---- Cache Misses: {misses}')
+
+      print('\n\n')
+
+
+      print('Selecting a large set of ids')
+      ids_set = set(range(1, db.actual_serial() + 1))
+      scan_blocks = db.select()
+
+      start_time = time.time()
+      rows = db.iter_select(id=ids_set)
+      count = len(list(rows))
+      end_time = time.time()
+
+      print("-------------------------------")
+      print(f'    Total Time: {end_time - start_time}')
+      print(f'    Accessed Blocks: {rows.accessed_blocks} ---- Full Scan: {scan_blocks} blocks')
+
+      assert rows.accessed_blocks <= scan_blocks
+      assert count == len(list(db.iter_select()))
+
+      print('\n\n')
+
+
+   def deletes(self):
+      db = self.db
+      blocks_list = []
+      times = []
+
+      print("Deleting series by id:")
+      for i, id in enumerate(self.delete_ids):
+         start_time = time.time()
+         block = db.delete(id=id)
+         end_time = time.time()
+
+         total_time = end_time - start_time
+
+         blocks_list.append(block)
+         times.append(total_time)
+
+         print(f"    Record {i}: {total_time}s --- {block} blocks accessed.")
+
+      print("-------------------------------")
+      print(f"\n    Deletions by id mean time: {sum(times) / len(times)}")
+      print(f"    Mean accessed blocks: {sum(blocks_list) / len(blocks_list)}")
+
+      print('\n\n')
+
+
+      print('Deleting set of ids')
+      ids = self.ids()
+      ids_set = set(ids[20000:30000])
+
+      start_time = time.time()
+      blocks = db.delete(id=ids_set)
+      end_time = time.time()
+
+      total_time = end_time - start_time
+      left = list(db.iter_select(id=ids_set))
+      count = len(list(db.iter_select()))
+
+      print("-------------------------------")
+      print(f'    Total Time: {total_time}')
+      print(f'    Accessed Blocks: {blocks}')
+      print(f'    Records left: {len(left)} ---- Rows: {len(ids)} -> {count}')
+
+      assert not left
+      assert count == len(ids) - len(ids_set)
+
+      print('\n\n')
+
+
+      print('Deleting by year - Many registers erased')
+      year = 2017
+
+      start_time = time.time()
+      blocks = db.delete(year=year)
+      end_time = time.time()
+
+      total_time = end_time - start_time
+
+      print("-------------------------------")
+      print(f'    Total Time: {total_time}')
+      print(f'    Accessed Blocks: {blocks}')
+
+      print('\n\n')
+
+
+   def predicates(self):
+      print('Selecting where')
+      queries = [
+         ([('year', '>=', 2015), ('age', '<', 30)], lambda r: r['year'] >= 2015 and r['age'] < 30),
+         ([('age', 'between', 25, 28), ('gender', 'Female')], lambda r: 25 <= r['age'] <= 28 and r['gender'] == 'Female'),
+         ([('city', 'in', {'Pune', 'New Delhi'}), ('education', '!=', 'Bachelors')], lambda r: r['city'] in ('Pune', 'New Delhi') and r['education'] != 'Bachelors'),
+         ([('id', '>', self.db.actual_serial() // 2), ('year', 2016)], lambda r: r['id'] > self.db.actual_serial() // 2 and r['year'] == 2016),
+      ]
+
+      for where, test in queries:
+         ids = self.ids(where=where)
+         expected = self.matching_ids(test)
+
+         print(f'    {where}: {len(ids)} rows')
+         assert sorted(ids) == sorted(expected)
+
+      print('\n\n')
+
+
+   def zone_maps(self):
+      print('Skipping blocks by id range')
+      low, high = self.db.actual_serial() // 3, self.db.actual_serial() // 3 + 500
+      scan_blocks = self.db.select()
+
+      rows = self.db.iter_select(where=[('id', 'between', low, high)])
+      ids = [row[self.id_position] for row in rows]
+
+      print("-------------------------------")
+      print(f'    Rows: {len(ids)} ---- Accessed Blocks: {rows.accessed_blocks} ---- Skipped Blocks: {rows.skipped_blocks} ---- Full Scan: {scan_blocks} blocks')
+
+      assert rows.skipped_blocks > 0 and rows.accessed_blocks < scan_blocks
+      assert sorted(ids) == sorted(self.matching_ids(lambda r: low <= r['id'] <= high))
+
+      print('\n\n')
+
+
+   def id_directory(self):
+      print('Looking up ids in the directory')
+      rows = {row[self.id_position]: row for row in self.db.iter_select()}
+      ids = list(range(1, self.db.actual_serial() + 1, 37)) + self.delete_ids + [self.db.actual_serial() + 1]
+
+      start_time = time.time()
+      found = {id: list(self.db.iter_select(id=id)) for id in ids}
+      end_time = time.time()
+
+      print("-------------------------------")
+      print(f'    Total Time: {end_time - start_time}s ---- Ids: {len(ids)} ---- Found: {sum(map(len, found.values()))}')
+
+      assert all(found[id] == ([rows[id]] if id in rows else []) for id in ids)
+
+      print('\n\n')
+
+
+   def aggregates(self):
+      print('Aggregating by year and gender')
+      aggs = {'rows': 'count', 'ages': ('sum', 'age'), 'mean': ('avg', 'age'), 'youngest': ('min', 'age'), 'city': ('max', 'city')}
+
+      start_time = time.time()
+      groups = list(self.db.aggregate(group_by=['year', 'gender'], aggs=aggs, where=[('age', '>=', 25)]))
+      end_time = time.time()
+
+      expected = dict()
+      for row in self.db.iter_select():
+         record = self.record(row)
+
+         if record['age'] >= 25:
+            expected.setdefault((record['year'], record['gender']), []).append(record)
+
+      print("-------------------------------")
+      print(f'    Total Time: {end_time - start_time}s ---- Groups: {len(groups)}')
+
+      assert sorted((group['year'], group['gender']) for group in groups) == sorted(expected)
+
+      for group in groups:
+         records = expected[(group['year'], group['gender'])]
+         ages = [record['age'] for record in records]
+
+         assert group['rows'] == len(records) and group['ages'] == sum(ages) and group['youngest'] == min(ages)
+         assert abs(group['mean'] - sum(ages) / len(ages)) < 1e-9
+         assert group['city'] == max(record['city'] for record in records)
+
+      print('\n\n')
+
+
+   def concurrent_reads(self):
+      print('Selecting from many threads')
+      queries = [{}, {'year': 2016}, {'id': set(self.select_ids)}, {'where': [('age', '<', 30)]}]
+      expected = [sorted(self.ids(**query)) for query in queries]
+      answers = dict()
+
+      def read(thread):
+         answers[thread] = [sorted(self.ids(**query)) for query in queries]
+
+      threads = [threading.Thread(target=read, args=(thread,)) for thread in range(4)]
+
+      start_time = time.time()
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      end_time = time.time()
+
+      print("-------------------------------")
+      print(f'    Total Time: {end_time - start_time}s ---- Threads: {len(threads)}')
+
+      assert len(answers) == len(threads)
+      assert all(answer == expected for answer in answers.values())
+
+      print('\n\n')
+
+
+   def parallel_scans(self, workers = 2):
+      # for the engines scanning with worker processes, see iter_select()
+      print('Scanning in parallel')
+      for where in (None, [('year', '>=', 2015), ('gender', 'Male')]):
+         start_time = time.time()
+         rows = list(self.db.iter_select(where=where, workers=workers))
+         end_time = time.time()
+
+         print(f'    {where}: {len(rows)} rows in {end_time - start_time}s with {workers} workers')
+         assert rows == list(self.db.iter_select(where=where))
+
+      print('\n\n')
+
+
+   def compressed_store(self):
+      # for the engines with compressed=True, see CompressedStore
+      print('Compressing the blocks')
+      rows = list(self.db.iter_select())
+      ids = set(self.select_ids)
+
+      db = self.reopen(compressed=True)
+      stats = db.compression_stats()
+      compressed = list(db.iter_select())
+      found = list(db.iter_select(id=ids))
+
+      db.insert(30, 2015, 'Bachelors', 'Pune', 'Male')
+      serial = db.actual_serial()
+
+      db = self.reopen(compressed=False)
+
+      print("-------------------------------")
+      print(f'    Blocks: {stats["blocks"]} ---- Stored: {stats["stored_bytes"]} bytes of {stats["logical_bytes"]} ---- Ratio: {stats["ratio"]}')
+
+      assert compressed == rows
+      assert sorted(found) == sorted(row for row in rows if row[self.id_position] in ids)
+      assert db.compression_stats() is None
+      assert sorted(self.ids()) == sorted([row[self.id_position] for row in rows] + [serial])
+
+      print('\n\n')
+
+
+   def csv_load(self):
+      # for the engines with load_csv()
+      print('Loading the file at once')
+      ids = self.ids()
+      serial = self.db.actual_serial()
+      rows = list(self.csv_rows())
+
+      start_time = time.time()
+      loaded = self.db.load_csv('data/Employee.csv')
+      end_time = time.time()
+
+      new = [self.record(row) for row in self.db.iter_select(id=set(range(serial + 1, serial + loaded + 1)))]
+      new.sort(key=lambda record: record['id'])
+
+      print("-------------------------------")
+      print(f'    Total Time: {end_time - start_time}s ---- Rows: {loaded}')
+
+      assert loaded == len(rows) and self.db.actual_serial() == serial + loaded
+      assert [record['id'] for record in new] == list(range(serial + 1, serial + loaded + 1))
+      assert [tuple(record[column] for column in self.COLUMNS[1:]) for record in new] == rows
+      assert sorted(self.ids()) == sorted(ids + [record['id'] for record in new])
+
+      print('\n\n')
+
+
+   def checks(self):
+      pass
+
+
+   def recovery(self):
+      print('Committing and crashing')
+      ids = self.ids()
+      serial = self.db.actual_serial()
+      rows = list(self.csv_rows())[:200]
+      new = list(range(serial + 1, serial + len(rows) + 1))
+
+      # closed here, so only the child writes to the files until it dies
+      table = type(self.db)
+      self.db.close()
+      atexit.unregister(self.db.close)
+
+      # the child commits half of the rows, leaves the other half to the
+      # committer thread and dies without writing anything back
+      pid = os.fork()
+
+      if pid == 0:
+         db = table()
+
+         for row in rows[:100]:
+            db.insert(*row)
+
+         db.commit()
+
+         for row in rows[100:]:
+            db.insert(*row)
+
+         time.sleep(db.wal.commit_interval * 20)
+         os._exit(0)
+
+      os.waitpid(pid, 0)
+
+      self.db = db = table()
+      recovered = self.ids()
+
+      print("-------------------------------")
+      print(f'    Recovered log records: {db.wal.recovered}')
+      print(f'    Rows: {len(ids)} -> {len(recovered)}')
+
+      assert db.wal.recovered > 0
+      assert db.actual_serial() == serial + len(rows)
+      assert sorted(recovered) == sorted(ids + new)
+      assert sorted(self.ids(id=set(new))) == new
+
+      print('\n\n')
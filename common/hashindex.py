@@ -0,0 +1,360 @@
+import os
+import struct
+from array import array
+
+from .bufferpool import BufferPool
+
+
+class HashIndex:
+   """
+      Persistent extendible hash index from unsigned int keys to posting lists
+      of unsigned int values (packed record pointers).
+
+      Page 1 (meta):     global depth, pages in use, first free page and the
+                         directory (2 ** depth bucket pages).
+      Bucket pages:      local depth, entries, then (key, head posting page,
+                         values) for every key in the bucket.
+      Posting pages:     next posting page and number of values, then the
+                         values. New values go to the head page, so it is
+                         the only page that may not be full.
+
+      Pages emptied by removals are kept in a free list and reused.
+   """
+
+   META_STRUCT    = '=I I I'      # global depth, pages in use, free page
+   META_SIZE      = struct.calcsize(META_STRUCT)
+   BUCKET_HEADER  = '=H H'        # local depth, entries
+   ENTRY_STRUCT   = '=I I I'      # key, head posting page, values
+   POSTING_HEADER = '=I H'        # next posting page, values
+   MAX_DEPTH      = 9
+
+   def __init__(self, filename, block_size = 4096, pool_size = 1024 * 1024):
+      self.filename         = filename
+      self.block_size       = block_size
+      self.bucket_capacity  = (block_size - struct.calcsize(self.BUCKET_HEADER)) // struct.calcsize(self.ENTRY_STRUCT)
+      self.posting_capacity = (block_size - struct.calcsize(self.POSTING_HEADER)) // 4
+
+      created = not os.path.exists(filename)
+      if created:
+         with open(filename, 'wb') as f:
+            f.write(bytes(block_size))
+
+      self.pool = BufferPool(filename, block_size, pool_size)
+
+      if created:
+         self.reset()
+      else:
+         self.reload()
+
+
+   def reload(self):
+      """Reads the meta data again, dropping the cached pages (the file was changed)."""
+      self.pool.clear()
+
+      meta = self.pool.get(1)
+      self.depth, self.pages, self.free_page = struct.unpack_from(self.META_STRUCT, meta, 0)
+      self.directory = array('I', meta[self.META_SIZE:self.META_SIZE + 4 * (1 << self.depth)])
+
+
+   def reset(self):
+      """Drops every key, leaving one empty bucket."""
+      self.pool.clear()
+      self.pool.truncate(2)
+
+      self.depth, self.pages, self.free_page = 0, 2, 0
+      self.directory = array('I', [2])
+
+      self.pool.get(1)
+      struct.pack_into(self.BUCKET_HEADER, self.pool.new_block(2), 0, 0, 0)
+      self.write_meta()
+
+
+   def write_meta(self):
+      page = self.pool.get(1)
+      struct.pack_into(self.META_STRUCT, page, 0, self.depth, self.pages, self.free_page)
+      page[self.META_SIZE:self.META_SIZE + 4 * len(self.directory)] = self.directory.tobytes()
+      self.pool.mark_dirty(1, page)
+
+
+   def hash(self, key):
+      h = (key * 2654435761) & 0xFFFFFFFF
+      return h ^ (h >> 16)
+
+
+   def new_page(self):
+      if self.free_page != 0:
+         page_no = self.free_page
+         self.free_page = struct.unpack_from('=I', self.pool.get(page_no), 0)[0]
+      else:
+         self.pages += 1
+         page_no = self.pages
+
+      self.write_meta()
+      return page_no, self.pool.new_block(page_no)
+
+
+   def free(self, page_no):
+      page = self.pool.get(page_no)
+      struct.pack_into('=I', page, 0, self.free_page)
+      self.pool.mark_dirty(page_no, page)
+
+      self.free_page = page_no
+      self.write_meta()
+
+
+   def bucket(self, key):
+      page_no = self.directory[self.hash(key) & ((1 << self.depth) - 1)]
+      return page_no, self.pool.get(page_no)
+
+
+   def find_entry(self, page, key):
+      # returns (position, head posting page, values) or None
+      entries = struct.unpack_from('=H', page, 2)[0]
+
+      for i in range(entries):
+         entry_key, head, count = struct.unpack_from(self.ENTRY_STRUCT, page, 4 + 12 * i)
+         if entry_key == key:
+            return i, head, count
+
+      return None
+
+
+   def lookup(self, key):
+      """Returns (values of key, index pages read)."""
+      page_no, page = self.bucket(key)
+      entry = self.find_entry(page, key)
+      pages_read = 1
+
+      if entry is None:
+         return [], pages_read
+
+      values = array('I')
+      posting = entry[1]
+
+      while posting != 0:
+         page = self.pool.get(posting)
+         posting, n = struct.unpack_from(self.POSTING_HEADER, page, 0)
+         values.extend(array('I', page[6:6 + 4 * n]))
+         pages_read += 1
+
+      return list(values), pages_read
+
+
+   def add(self, key, value):
+      page_no, page = self.bucket(key)
+      entry = self.find_entry(page, key)
+
+      if entry is None:
+         entries = struct.unpack_from('=H', page, 2)[0]
+
+         if entries == self.bucket_capacity:
+            self.split(page_no, page)
+            return self.add(key, value)
+
+         head, head_page = self.new_page()
+         struct.pack_into(self.POSTING_HEADER, head_page, 0, 0, 0)
+
+         entry = (entries, head, 0)
+         struct.pack_into('=H', page, 2, entries + 1)
+
+      i, head, count = entry
+      head_page = self.pool.get(head)
+      next_page, n = struct.unpack_from(self.POSTING_HEADER, head_page, 0)
+
+      if n == self.posting_capacity:
+         next_page, n = head, 0
+         head, head_page = self.new_page()
+
+      struct.pack_into(self.POSTING_HEADER, head_page, 0, next_page, n + 1)
+      struct.pack_into('=I', head_page, 6 + 4 * n, value)
+      self.pool.mark_dirty(head, head_page)
+
+      struct.pack_into(self.ENTRY_STRUCT, page, 4 + 12 * i, key, head, count + 1)
+      self.pool.mark_dirty(page_no, page)
+
+
+   def remove(self, key, value):
+      """Removes one value from the posting list of key."""
+      page_no, page = self.bucket(key)
+      entry = self.find_entry(page, key)
+
+      if entry is None:
+         return False
+
+      i, head, count = entry
+      head_page = self.pool.get(head)
+      head_next, head_n = struct.unpack_from(self.POSTING_HEADER, head_page, 0)
+      last_value = struct.unpack_from('=I', head_page, 6 + 4 * (head_n - 1))[0]
+
+      posting = head
+      while posting != 0:
+         posting_page = self.pool.get(posting)
+         next_page, n = struct.unpack_from(self.POSTING_HEADER, posting_page, 0)
+         values = array('I', posting_page[6:6 + 4 * n])
+
+         if value in values:
+            break
+
+         posting = next_page
+      else:
+         return False
+
+      # the last value of the head page takes the place of the removed one
+      struct.pack_into('=I', posting_page, 6 + 4 * values.index(value), last_value)
+      self.pool.mark_dirty(posting, posting_page)
+
+      head_page = self.pool.get(head)
+      struct.pack_into(self.POSTING_HEADER, head_page, 0, head_next, head_n - 1)
+      self.pool.mark_dirty(head, head_page)
+
+      if count == 1:
+         self.free(head)
+         self.remove_entry(page_no, i)
+         return True
+
+      if head_n == 1:
+         self.free(head)
+         head = head_next
+
+      page = self.pool.get(page_no)
+      struct.pack_into(self.ENTRY_STRUCT, page, 4 + 12 * i, key, head, count - 1)
+      self.pool.mark_dirty(page_no, page)
+
+      return True
+
+
+   def remove_many(self, key, values):
+      """
+         Removes a set of values from the posting list of key in one pass
+         over it, and returns how many were found. The values left are
+         packed into the last pages of the list, the others are freed.
+      """
+      page_no, page = self.bucket(key)
+      entry = self.find_entry(page, key)
+
+      if entry is None:
+         return 0
+
+      i, head, count = entry
+      postings, kept = list(), array('I')
+
+      posting = head
+      while posting != 0:
+         posting_page = self.pool.get(posting)
+         next_page, n = struct.unpack_from(self.POSTING_HEADER, posting_page, 0)
+         kept.extend(value for value in array('I', posting_page[6:6 + 4 * n]) if value not in values)
+
+         postings.append(posting)
+         posting = next_page
+
+      removed = count - len(kept)
+
+      if removed == 0:
+         return 0
+
+      if not kept:
+         for posting in postings:
+            self.free(posting)
+
+         self.remove_entry(page_no, i)
+         return removed
+
+      # only the new head page may not be full
+      used = -(-len(kept) // self.posting_capacity)
+      first = len(kept) - (used - 1) * self.posting_capacity
+
+      for posting in postings[:len(postings) - used]:
+         self.free(posting)
+
+      start = 0
+      for position, posting in enumerate(postings[len(postings) - used:]):
+         end = first if position == 0 else start + self.posting_capacity
+         next_page = postings[len(postings) - used + position + 1] if position < used - 1 else 0
+
+         posting_page = self.pool.get(posting)
+         struct.pack_into(self.POSTING_HEADER, posting_page, 0, next_page, end - start)
+         posting_page[6:6 + 4 * (end - start)] = kept[start:end].tobytes()
+         self.pool.mark_dirty(posting, posting_page)
+
+         start = end
+
+      page = self.pool.get(page_no)
+      struct.pack_into(self.ENTRY_STRUCT, page, 4 + 12 * i, key, postings[len(postings) - used], len(kept))
+      self.pool.mark_dirty(page_no, page)
+
+      return removed
+
+
+   def drop(self, key):
+      """Removes key and its whole posting list."""
+      page_no, page = self.bucket(key)
+      entry = self.find_entry(page, key)
+
+      if entry is None:
+         return
+
+      posting = entry[1]
+      while posting != 0:
+         next_page = struct.unpack_from('=I', self.pool.get(posting), 0)[0]
+         self.free(posting)
+         posting = next_page
+
+      self.remove_entry(page_no, entry[0])
+
+
+   def remove_entry(self, page_no, i):
+      # the last entry of the bucket takes the place of entry i
+      page = self.pool.get(page_no)
+      entries = struct.unpack_from('=H', page, 2)[0]
+
+      last = 4 + 12 * (entries - 1)
+      page[4 + 12 * i:4 + 12 * i + 12] = page[last:last + 12]
+      struct.pack_into('=H', page, 2, entries - 1)
+
+      self.pool.mark_dirty(page_no, page)
+
+
+   def split(self, page_no, page):
+      local_depth, entries = struct.unpack_from(self.BUCKET_HEADER, page, 0)
+
+      if local_depth == self.depth:
+         if self.depth == self.MAX_DEPTH:
+            raise IndexError("HASH DIRECTORY FULL")
+
+         self.directory.extend(self.directory)
+         self.depth += 1
+
+      new_no, new_page = self.new_page()
+      page = self.pool.get(page_no)
+
+      stay, move = list(), list()
+      for i in range(entries):
+         entry = page[4 + 12 * i:16 + 12 * i]
+         key = struct.unpack_from('=I', entry, 0)[0]
+
+         if self.hash(key) >> local_depth & 1:
+            move.append(entry)
+         else:
+            stay.append(entry)
+
+      struct.pack_into(self.BUCKET_HEADER, page, 0, local_depth + 1, len(stay))
+      page[4:4 + 12 * len(stay)] = b''.join(stay)
+      self.pool.mark_dirty(page_no, page)
+
+      struct.pack_into(self.BUCKET_HEADER, new_page, 0, local_depth + 1, len(move))
+      new_page[4:4 + 12 * len(move)] = b''.join(move)
+      self.pool.mark_dirty(new_no, new_page)
+
+      for slot in range(len(self.directory)):
+         if self.directory[slot] == page_no and slot >> local_depth & 1:
+            self.directory[slot] = new_no
+
+      self.write_meta()
+
+
+   def flush(self):
+      self.pool.flush()
+
+
+   def close(self):
+      self.pool.close()
@@ -0,0 +1,99 @@
+import os
+import struct
+
+from .bufferpool import BufferPool
+
+
+class IdDirectory:
+   """
+      Array of packed record pointers indexed by id. Ids come from the serial
+      of the header, one per insert, so they are dense and id k is simply
+      entry k - 1: page (k - 1) // entries + 1, entries = block_size // 4.
+
+      An entry is 0 for an id never written and TOMBSTONE for a deleted one.
+      A lookup reads one page, which `height` reports so the directory
+      counts in accessed blocks like a one level index.
+   """
+
+   ENTRY     = struct.Struct('=I')
+   TOMBSTONE = 0xFFFFFFFF
+
+   def __init__(self, filename, block_size = 4096, pool_size = 1024 * 1024):
+      self.filename   = filename
+      self.block_size = block_size
+      self.entries    = block_size // self.ENTRY.size # ids per page
+      self.height     = 1
+
+      if not os.path.exists(filename):
+         open(filename, 'wb').close()
+
+      self.pool = BufferPool(filename, block_size, pool_size)
+
+
+   def reset(self):
+      """Forgets every id."""
+      self.pool.clear()
+      self.pool.truncate(1)
+
+
+   def reload(self):
+      """Drops the cached pages (the file was changed)."""
+      self.pool.clear()
+
+
+   def locate(self, key):
+      return (key - 1) // self.entries + 1, ((key - 1) % self.entries) * self.ENTRY.size
+
+
+   def search(self, key):
+      """Returns the value of key, or None. Reads one page."""
+      if key < 1:
+         return None
+
+      page_no, offset = self.locate(key)
+      value = self.ENTRY.unpack_from(self.pool.get(page_no), offset)[0]
+
+      return value if value not in (0, self.TOMBSTONE) else None
+
+
+   def insert(self, key, value):
+      """Sets the value of key, replacing the one it had."""
+      page_no, offset = self.locate(key)
+      page = self.pool.get(page_no)
+
+      self.ENTRY.pack_into(page, offset, value)
+      self.pool.mark_dirty(page_no, page)
+
+
+   def insert_many(self, first_key, values):
+      """Sets the values of first_key, first_key + 1, ..., a page at a time."""
+      key, i = first_key, 0
+
+      while i < len(values):
+         page_no, offset = self.locate(key)
+         page = self.pool.get(page_no)
+         n = min(len(values) - i, (self.block_size - offset) // self.ENTRY.size)
+
+         struct.pack_into(f'={n}I', page, offset, *values[i:i + n])
+         self.pool.mark_dirty(page_no, page)
+
+         key, i = key + n, i + n
+
+
+   def delete(self, key):
+      """Writes a tombstone for key, returning its value (or None when it was not there)."""
+      value = self.search(key)
+
+      if value is None:
+         return None
+
+      self.insert(key, self.TOMBSTONE)
+      return value
+
+
+   def flush(self):
+      self.pool.flush()
+
+
+   def close(self):
+      self.pool.close()
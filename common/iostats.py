@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+
+
+class CountedFile:
+   """
+      File object counting its seeks, reads and writes, and the bytes they
+      moved, in an IOStats. Everything else goes to the file itself.
+   """
+
+   def __init__(self, file, io):
+      self.file = file
+      self.io   = io
+
+
+   def seek(self, offset, whence = 0):
+      self.io.count('seeks')
+      return self.file.seek(offset, whence)
+
+
+   def read(self, size = -1):
+      data = self.file.read(size)
+      self.io.count('reads')
+      self.io.count('bytes_read', len(data))
+      return data
+
+
+   def write(self, data):
+      written = self.file.write(data)
+      self.io.count('writes')
+      self.io.count('bytes_written', written)
+      return written
+
+
+   def __getattr__(self, name):
+      return getattr(self.file, name)
+
+
+   def __enter__(self):
+      return self
+
+
+   def __exit__(self, *exc_info):
+      self.file.close()
+      return False
+
+
+def fsync(file):
+   """os.fsync of file, counted when it is a CountedFile."""
+   if isinstance(file, CountedFile):
+      file.io.count('fsyncs')
+
+   os.fsync(file.fileno())
+
+
+class Operation:
+   """
+      One operation of an IOStats, timed in a with block. Details set before
+      the block ends go to the trace with it.
+   """
+
+   __slots__ = ('io', 'name', 'start', 'counters', 'details')
+
+   def __init__(self, io, name):
+      self.io      = io
+      self.name    = name
+      self.details = None
+
+
+   def __enter__(self):
+      self.counters = self.io.copy_counters() if self.io.trace is not None else None
+      self.start    = time.perf_counter()
+      return self
+
+
+   def __exit__(self, *exc_info):
+      self.io.record(self.name, time.perf_counter() - self.start, self.counters, self.details)
+      return False
+
+
+class IOStats:
+   """
+      Counters of the I/O of a table and latency histograms of its operations.
+
+      The files of the table are CountedFiles, from open() or attach(), so
+      every seek, read and write on them is counted where it happens. Memory
+      maps count as maps and the bytes taken from them, header_reads and
+      header_writes count the header going to or coming from the file or the
+      log, and compactions and compaction_steps come from the engine.
+
+      Operations are timed in operation() blocks, and their latencies go to
+      a histogram of BUCKETS powers of two microseconds: bucket k holds the
+      latencies under 2 ** k us. An operation run by another one, like the
+      commit of a group commit, is timed on its own as well. With a trace
+      callback, every operation also calls trace with a dict of its name,
+      seconds, details and the counters it moved.
+
+      Counters are shared by the threads of the table and only change under
+      mutex, so the counters moved by an operation include the I/O of the
+      operations running with it.
+   """
+
+   COUNTERS = (
+      'opens', 'seeks', 'reads', 'writes', 'bytes_read', 'bytes_written', 'maps', 'bytes_mapped',
+      'header_reads', 'header_writes', 'fsyncs', 'compactions', 'compaction_steps',
+   )
+   BUCKETS = 32
+
+   def __init__(self, trace = None):
+      self.trace = trace
+      self.mutex = threading.Lock()
+      self.reset()
+
+
+   def reset(self):
+      with self.mutex:
+         self.counters   = dict.fromkeys(self.COUNTERS, 0)
+         self.operations = dict() # name -> [seconds, histogram]
+
+
+   def count(self, name, amount = 1):
+      with self.mutex:
+         self.counters[name] += amount
+
+
+   def copy_counters(self):
+      with self.mutex:
+         return dict(self.counters)
+
+
+   def open(self, filename, mode):
+      self.count('opens')
+      return CountedFile(open(filename, mode), self)
+
+
+   def attach(self, owner):
+      """
+         Counts the I/O on the file of owner (a BufferPool, WriteAheadLog or
+         CompressedStore) from now on. A pool over a store shares its file.
+      """
+      store = getattr(owner, 'store', None)
+
+      if store is not None:
+         self.attach(store)
+         owner.file = store.file
+      elif isinstance(owner.file, CountedFile):
+         owner.file.io = self
+      else:
+         owner.file = CountedFile(owner.file, self)
+         self.count('opens')
+
+      owner.io = self
+
+
+   def operation(self, name):
+      return Operation(self, name)
+
+
+   def record(self, name, seconds, counters = None, details = None):
+      bucket = int(seconds * 1e6).bit_length()
+
+      with self.mutex:
+         operation = self.operations.get(name)
+
+         if operation is None:
+            operation = self.operations[name] = [0.0, [0] * self.BUCKETS]
+
+         operation[0] += seconds
+         operation[1][bucket if bucket < self.BUCKETS else self.BUCKETS - 1] += 1
+
+      # the trace is called outside the mutex, it may do I/O of its own
+      if counters is not None and self.trace is not None:
+         event = {'operation': name, 'seconds': seconds, **(details or {})}
+
+         for counter, value in self.copy_counters().items():
+            event[counter] = value - counters[counter]
+
+         self.trace(event)
+
+
+   def percentile(self, histogram, count, p):
+      # upper bound of the bucket holding the p-th percentile, in seconds
+      rank = -(-count * p // 100)
+
+      for bucket, n in enumerate(histogram):
+         rank -= n
+
+         if rank <= 0:
+            return 2 ** bucket / 1e6
+
+      return None
+
+
+   def snapshot(self):
+      """Returns the counters and, for every operation, its count, time, percentiles and histogram."""
+      with self.mutex:
+         counters   = dict(self.counters)
+         operations = {name: (sum(histogram), seconds, list(histogram)) for name, (seconds, histogram) in self.operations.items()}
+
+      return {
+         'counters':   counters,
+         'operations': {
+            name: {
+               'count':     count,
+               'seconds':   seconds,
+               'mean':      seconds / count,
+               'p50':       self.percentile(histogram, count, 50),
+               'p90':       self.percentile(histogram, count, 90),
+               'p99':       self.percentile(histogram, count, 99),
+               'histogram': {2 ** bucket: n for bucket, n in enumerate(histogram) if n},
+            }
+            for name, (count, seconds, histogram) in operations.items()
+         },
+      }
@@ -0,0 +1,152 @@
+class Predicate:
+   """
+      A conjunction of conditions on the columns of a table, compiled once per
+      query into Python functions over unpacked records.
+
+      Conditions are (column, value) for equality, or IN when value is a set,
+      frozenset or list, (column, operator, value) with the operators below,
+      or (column, 'between', low, high). A dict {column: value} is accepted
+      as a list of (column, value) conditions.
+
+      columns maps every column name to (source, position, width): the
+      condition reads source[position], where source is 'r' for the unpacked
+      record and 's' for its decoded strings. String values are encoded to
+      width bytes, padded with \\x00, when width is not None.
+
+      dictionaries maps string columns to the list of their values by code
+      (see StringDictionary). For these columns source[position] is the code
+      of the value, or the value itself when it has none, and =, != and IN
+      compare codes instead of strings.
+   """
+
+   OPERATORS = ('=', '==', '!=', '<', '<=', '>', '>=', 'in', 'between')
+
+   def __init__(self, where, columns, guard = 'True', dictionaries = None):
+      self.columns      = columns
+      self.dictionaries = dictionaries or dict()
+      self.constants    = dict()
+      self.conditions   = self.normalize(where)
+
+      # keys of the conditions an index can answer, or None
+      self.ids   = self.keys('id')
+      self.years = self.keys('year')
+
+      record  = ' and '.join([guard] + self.expressions('r'))
+      strings = ' and '.join(['True'] + self.expressions('s'))
+
+      self.has_strings = strings != 'True'
+
+      self.test         = self.compile(f'lambda r: {record}')
+      self.test_strings = self.compile(f'lambda s: {strings}')
+      # per block: (position, record) of every record of rows that passes
+      self.positions    = self.compile(f'lambda rows: [(i, r) for i, r in enumerate(rows) if {record}]')
+      # the records of rows that pass, lazily
+      self.records      = self.compile(f'lambda rows: (r for r in rows if {record})')
+
+
+   def normalize(self, where):
+      if type(where) == dict:
+         where = where.items()
+
+      conditions = list()
+
+      for condition in where or ():
+         column = condition[0]
+
+         if column not in self.columns:
+            raise KeyError(f"UNKNOWN COLUMN {column}")
+
+         if len(condition) == 2:
+            value = condition[1]
+            operator = 'in' if type(value) in (set, frozenset, list) else '='
+            conditions.append((column, operator, value))
+            continue
+
+         operator = condition[1].lower() if type(condition[1]) == str else condition[1]
+
+         if operator not in self.OPERATORS:
+            raise ValueError(f"UNKNOWN OPERATOR {operator}")
+
+         if operator == 'between':
+            low, high = condition[2:] if len(condition) == 4 else condition[2]
+            conditions.append((column, '>=', low))
+            conditions.append((column, '<=', high))
+            continue
+
+         conditions.append((column, '=' if operator == '==' else operator, condition[2]))
+
+      return conditions
+
+
+   def keys(self, column):
+      keys = None
+
+      for name, operator, value in self.conditions:
+         if name != column or operator not in ('=', 'in'):
+            continue
+
+         values = {value} if operator == '=' else set(value)
+         keys = values if keys is None else keys & values
+
+      return keys
+
+
+   def encode(self, column, value):
+      width = self.columns[column][2]
+
+      if width is None or type(value) != str:
+         return value
+
+      return value.encode('utf-8')[:width].ljust(width, b'\x00')
+
+
+   def expressions(self, source):
+      expressions = list()
+
+      for column, operator, value in self.conditions:
+         if self.columns[column][0] != source:
+            continue
+
+         field = f'{source}[{self.columns[column][1]}]'
+
+         if column in self.dictionaries:
+            expressions.append(self.coded_expression(column, operator, value, field))
+            continue
+
+         if operator == 'in':
+            value = frozenset(self.encode(column, v) for v in value)
+         else:
+            value = self.encode(column, value)
+
+         name = self.constant(value)
+         expressions.append(f'{field} {"==" if operator == "=" else operator} {name}')
+
+      return expressions
+
+
+   def constant(self, value):
+      # constants are bound by name, so values are never turned into code
+      name = f'c{len(self.constants)}'
+      self.constants[name] = value
+
+      return name
+
+
+   def coded_expression(self, column, operator, value, field):
+      values = self.dictionaries[column]
+
+      if operator in ('=', '!=', 'in'):
+         # a value matches its code, or itself where it was kept inline
+         strings = [v for v in (value if operator == 'in' else [value]) if type(v) == str]
+         accepted = frozenset(strings) | frozenset(values.index(v) for v in strings if v in values)
+
+         return f'{field} {"not in" if operator == "!=" else "in"} {self.constant(accepted)}'
+
+      # other comparisons need the string of a code
+      decode = lambda token: values[token] if token.__class__ is int else token
+
+      return f'{self.constant(decode)}({field}) {operator} {self.constant(value)}'
+
+
+   def compile(self, source):
+      return eval(source, {'__builtins__': {}, 'enumerate': enumerate, **self.constants})
@@ -0,0 +1,174 @@
+import threading
+
+
+class SelectIterator:
+   """
+      Rows of a query, read and decoded only as they are consumed. The access
+      statistics count what was read so far; they are final once the rows are
+      exhausted or close() is called, which also sets finished.
+   """
+
+   def __init__(self, rows, *args):
+      # rows is a generator function taking the query arguments and stats.
+      # Blocks a scan left unread, as the zone map ruled them out, are
+      # counted in skipped_blocks instead of accessed_blocks. With a
+      # compressed file, physical_blocks and bytes_read count the images
+      # read from the file, the blocks not found decompressed in the pool.
+      self.accessed_blocks = 0
+      self.skipped_blocks  = 0
+      self.physical_blocks = None
+      self.bytes_read      = None
+      self.rows            = 0
+      self.finished        = False
+      self.generator       = rows(*args, stats=self)
+
+
+   def __iter__(self):
+      return self
+
+
+   def __next__(self):
+      try:
+         row = next(self.generator)
+      except StopIteration:
+         self.finished = True
+         raise
+
+      self.rows += 1
+      return row
+
+
+   def close(self):
+      self.generator.close()
+      self.finished = True
+
+
+   def __enter__(self):
+      return self
+
+
+   def __exit__(self, *exc_info):
+      self.close()
+      return False
+
+
+class Table:
+   """
+      What the tables of every engine do the same way around their files:
+      queries under the table lock, flushes, commits and checkpoints of the
+      write-ahead log, and reloads after another process changed the table.
+
+      A table sets io (IOStats), lock (TableLock), flush_latch, pool (the
+      BufferPool of its data file), wal (or None), header,
+      header_dirty and pending_header_writes, and it provides
+      write_changes(), which writes its dirty pages and header, and
+      indexes(), the structures kept next to the data file.
+   """
+
+   def indexes(self):
+      """Returns the indexes, maps and dictionaries of the table, which reload() drops."""
+      return []
+
+
+   def locked(self, mode, rows, name):
+      # the rows are read under the table lock, released once they are
+      # exhausted or the iterator is closed; the query is timed as name
+      def locked_rows(*args, stats):
+         with self.io.operation(name) as operation, self.lock.hold(mode):
+            store = self.pool.store
+            reads, bytes_read = (store.reads, store.bytes_read) if store is not None else (0, 0)
+
+            try:
+               yield from rows(*args, stats=stats)
+            finally:
+               if store is not None:
+                  stats.physical_blocks = store.reads - reads
+                  stats.bytes_read      = store.bytes_read - bytes_read
+
+               operation.details = {'accessed_blocks': stats.accessed_blocks, 'skipped_blocks': stats.skipped_blocks, 'rows': stats.rows}
+
+      return locked_rows
+
+
+   def flush(self):
+      """Writes the cached header, the dirty blocks and index pages back to disk."""
+      with self.io.operation('flush'), self.lock.hold('read'), self.flush_latch:
+         self.write_changes()
+
+         if self.wal is not None:
+            self.wal.write_back()
+
+
+   def commit(self):
+      """
+         Makes every change so far durable with one sync of the log. The files
+         get them later, from flush() or a checkpoint.
+      """
+      if self.wal is None:
+         return self.flush()
+
+      with self.io.operation('commit'), self.lock.hold('read'), self.flush_latch:
+         self.uncommitted = False
+         self.write_changes()
+         self.wal.commit()
+
+
+   def group_commit(self):
+      # called between operations, so a commit never holds half of one
+      if self.wal is None:
+         return
+
+      if self.wal.due():
+         self.commit()
+      else:
+         self.uncommitted = True
+
+
+   def start_committer(self):
+      """
+         Starts the thread making the group commit due after the last
+         operation, so changes are durable commit_interval after they were
+         made even if no operation or close() follows.
+      """
+      self.uncommitted    = False # changes made since the last commit
+      self.committer_stop = threading.Event()
+      self.committer      = None
+
+      if self.wal is not None:
+         self.committer = threading.Thread(target=self.run_committer, name='committer', daemon=True)
+         self.committer.start()
+
+
+   def run_committer(self):
+      # commit() waits for the operation holding the table to end
+      while not self.committer_stop.wait(self.wal.commit_interval):
+         if self.uncommitted and self.wal.due():
+            self.commit()
+
+
+   def stop_committer(self):
+      self.committer_stop.set()
+
+      if self.committer is not None and self.committer is not threading.current_thread():
+         self.committer.join()
+
+
+   def checkpoint(self):
+      """Writes every change to the files, syncs them and empties the log."""
+      with self.io.operation('checkpoint'), self.lock.hold('read'), self.flush_latch:
+         self.flush()
+
+         if self.wal is not None:
+            self.wal.checkpoint()
+
+
+   def reload(self):
+      """Drops the cached header and pages, after another process changed the table."""
+      self.header = None
+      self.header_dirty = False
+      self.pending_header_writes = 0
+
+      self.pool.clear()
+
+      for index in self.indexes():
+         index.reload()
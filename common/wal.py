@@ -0,0 +1,240 @@
+import os
+import time
+import zlib
+import struct
+import threading
+
+from .iostats import fsync
+
+
+class WriteAheadLog:
+   """
+      Append only redo log of the writes made to a set of files, synced in
+      groups: one commit makes the writes of many operations durable.
+
+      Every record is RECORD_HEADER (kind, file id, offset, length, crc32)
+      followed by length bytes. A WRITE record carries the new bytes at
+      offset of the file, a TRUNCATE record cuts the file at offset and a
+      COMMIT record closes the group of records before it. On open, the
+      committed groups are applied to the files again (redo recovery) and a
+      group left without its COMMIT by a crash is dropped.
+
+      Buffer pools attached to the log write their pages here instead of to
+      their files. Logged writes reach the files in write_back(), only after
+      they were committed; until then read() returns them to the pools.
+      Pools may log from several threads; commits, write backs and
+      checkpoints are called by one thread at a time.
+   """
+
+   RECORD_FIELDS      = '=B B Q I'          # kind, file id, offset, length
+   RECORD_HEADER      = RECORD_FIELDS + ' I' # and crc32 of the fields and bytes
+   RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+
+   WRITE    = 1
+   TRUNCATE = 2
+   COMMIT   = 3
+
+   def __init__(self, filename, files, commit_interval = 0.05, checkpoint_size = 16 * 1024 * 1024):
+      self.filename        = filename
+      self.files           = files             # file id -> filename, for recovery
+      self.pools           = dict()            # file id -> attached BufferPool
+      self.commit_interval = commit_interval   # seconds between group commits
+      self.checkpoint_size = checkpoint_size   # bytes of log that start a checkpoint
+      self.buffer          = bytearray()       # records not in the log file yet
+      self.pending         = dict()            # (file id, offset) -> bytes logged since the last commit
+      self.committed       = dict()            # (file id, offset) -> bytes committed, not written back
+      self.truncations     = list()            # (file id, offset) not applied yet
+      self.size            = 0                 # bytes in the log file
+      self.last_commit     = time.monotonic()
+      self.commits         = 0
+      self.checkpoints     = 0
+      self.recovered       = 0
+      self.mutex           = threading.RLock() # taken after the mutex of a pool, never before
+      self.io              = None              # IOStats, see IOStats.attach()
+      self.file            = open(filename, 'ab')
+
+
+   def append(self, kind, file_id, offset, data = b''):
+      header = struct.pack(self.RECORD_FIELDS, kind, file_id, offset, len(data))
+      crc = zlib.crc32(data, zlib.crc32(header))
+
+      self.buffer += header
+      self.buffer += struct.pack('=I', crc)
+      self.buffer += data
+
+
+   def attach(self, file_id, pool):
+      """Makes pool write its pages through the log, once its file is synced."""
+      pool.flush()
+      fsync(pool.file)
+
+      pool.wal     = self
+      pool.file_id = file_id
+      self.pools[file_id] = pool
+
+
+   def log(self, file_id, offset, data):
+      data = bytes(data)
+
+      with self.mutex:
+         self.append(self.WRITE, file_id, offset, data)
+         self.pending[(file_id, offset)] = data
+
+
+   def truncate(self, file_id, offset):
+      with self.mutex:
+         self.append(self.TRUNCATE, file_id, offset)
+         self.truncations.append((file_id, offset))
+
+         for writes in (self.pending, self.committed):
+            for key in [key for key in writes if key[0] == file_id and key[1] >= offset]:
+               del writes[key]
+
+
+   def forget(self, file_id, offset):
+      """
+         Drops the write at offset of the file from the writes not written
+         back yet, when nothing uses those bytes any more and others may be
+         written over them. The log keeps it: recovery writes in log order.
+      """
+      with self.mutex:
+         self.pending.pop((file_id, offset), None)
+         self.committed.pop((file_id, offset), None)
+
+
+   def read(self, file_id, offset):
+      """Returns the logged bytes at offset of the file not written back yet, or None."""
+      data = self.pending.get((file_id, offset))
+      return data if data is not None else self.committed.get((file_id, offset))
+
+
+   def due(self):
+      return time.monotonic() - self.last_commit >= self.commit_interval
+
+
+   def commit(self):
+      """Syncs every record logged so far with one fsync."""
+      with self.mutex:
+         self.last_commit = time.monotonic()
+
+         if not self.buffer or self.file.closed:
+            return
+
+         self.append(self.COMMIT, 0, self.commits)
+
+         self.file.write(self.buffer)
+         self.file.flush()
+         fsync(self.file)
+
+         self.size += len(self.buffer)
+         self.buffer.clear()
+         self.commits += 1
+
+         self.committed.update(self.pending)
+         self.pending.clear()
+
+      if self.size >= self.checkpoint_size:
+         self.checkpoint()
+
+
+   def write_back(self):
+      """Commits the log and writes the committed changes to the files, without syncing them."""
+      if self.file.closed:
+         return
+
+      self.commit()
+
+      for file_id, pool in self.pools.items():
+         with pool.mutex, self.mutex:
+            # writes logged before a truncation past them were already dropped
+            for truncated_id, offset in self.truncations:
+               if truncated_id == file_id:
+                  pool.file.truncate(offset)
+
+            for key in sorted(key for key in self.committed if key[0] == file_id):
+               pool.file.seek(key[1])
+               pool.file.write(self.committed.pop(key))
+
+            self.truncations = [truncation for truncation in self.truncations if truncation[0] != file_id]
+            pool.file.flush()
+
+
+   def checkpoint(self):
+      """Writes the committed changes to the files, syncs them and empties the log."""
+      if self.file.closed:
+         return
+
+      self.write_back()
+
+      for pool in self.pools.values():
+         fsync(pool.file)
+
+      with self.mutex:
+         self.file.truncate(0)
+         fsync(self.file)
+
+         self.size = 0
+         self.checkpoints += 1
+
+
+   def recover(self):
+      """Applies the committed groups of the log to the files and empties it."""
+      with open(self.filename, 'rb') as f:
+         log = f.read()
+
+      redo, group = list(), list()
+      position = 0
+
+      while position + self.RECORD_HEADER_SIZE <= len(log):
+         kind, file_id, offset, length, crc = struct.unpack_from(self.RECORD_HEADER, log, position)
+         start = position + self.RECORD_HEADER_SIZE
+         data = log[start:start + length]
+
+         # a torn or partly written record ends the log
+         if len(data) != length or zlib.crc32(data, zlib.crc32(log[position:start - 4])) != crc:
+            break
+
+         position = start + length
+
+         if kind == self.COMMIT:
+            redo.extend(group)
+            group = list()
+         else:
+            group.append((kind, file_id, offset, data))
+
+      files = dict()
+
+      for kind, file_id, offset, data in redo:
+         filename = self.files.get(file_id)
+
+         # a missing index is rebuilt from the data file instead
+         if filename is None or not os.path.exists(filename):
+            continue
+
+         if file_id not in files:
+            files[file_id] = open(filename, 'rb+')
+
+         if kind == self.WRITE:
+            files[file_id].seek(offset)
+            files[file_id].write(data)
+         else:
+            files[file_id].truncate(offset)
+
+      for f in files.values():
+         f.flush()
+         fsync(f)
+         f.close()
+
+      self.file.truncate(0)
+      fsync(self.file)
+
+      self.recovered = len(redo)
+      return self.recovered
+
+
+   def close(self):
+      if self.file.closed:
+         return
+
+      self.checkpoint()
+      self.file.close()
@@ -0,0 +1,190 @@
+import os
+import struct
+
+from .bufferpool import BufferPool
+
+
+class ZoneMap:
+   """
+      Minimum and maximum id, year and age of the records of every data
+      block, with the count of its live records, so scans can skip the
+      blocks a predicate cannot match.
+
+      Block b (starting at 1) is entry (b - 1) % entries of page
+      (b - 1) // entries + 1, with entries = block_size // ENTRY.size.
+
+      Inserts widen the ranges of their block. Deletes only lower the count:
+      the ranges stay as wide as the records the block held, which is still
+      correct, until the block has no live records and its entry is reset.
+   """
+
+   ENTRY   = struct.Struct('=I I I I I I I') # live records, min/max id, min/max year, min/max age
+   COLUMNS = {'id': 1, 'year': 3, 'age': 5}  # column -> position of its minimum in ENTRY
+   EMPTY   = bytes(ENTRY.size)
+
+   def __init__(self, filename, block_size = 4096, pool_size = 256 * 1024):
+      self.filename   = filename
+      self.block_size = block_size
+      self.entries    = block_size // self.ENTRY.size # entries per page
+
+      if not os.path.exists(filename):
+         open(filename, 'wb').close()
+
+      self.pool = BufferPool(filename, block_size, pool_size)
+
+
+   def reset(self):
+      """Forgets every block."""
+      self.pool.clear()
+      self.pool.truncate(1)
+
+
+   def reload(self):
+      """Drops the cached pages (the file was changed)."""
+      self.pool.clear()
+
+
+   def locate(self, block):
+      return (block - 1) // self.entries + 1, ((block - 1) % self.entries) * self.ENTRY.size
+
+
+   def get(self, block):
+      """Returns the entry of block: (live, min id, max id, min year, max year, min age, max age)."""
+      page_no, offset = self.locate(block)
+      return self.ENTRY.unpack_from(self.pool.get(page_no), offset)
+
+
+   def add(self, block, id, year, age):
+      """Counts a record written to block."""
+      page_no, offset = self.locate(block)
+      page = self.pool.get(page_no)
+      entry = self.ENTRY.unpack_from(page, offset)
+
+      if entry[0] == 0:
+         self.ENTRY.pack_into(page, offset, 1, id, id, year, year, age, age)
+      else:
+         self.ENTRY.pack_into(
+            page, offset, entry[0] + 1,
+            id if id < entry[1] else entry[1], id if id > entry[2] else entry[2],
+            year if year < entry[3] else entry[3], year if year > entry[4] else entry[4],
+            age if age < entry[5] else entry[5], age if age > entry[6] else entry[6],
+         )
+
+      self.pool.mark_dirty(page_no, page)
+
+
+   def add_many(self, block, ids, years, ages):
+      """Counts the records written to block, given by their columns."""
+      if not ids:
+         return
+
+      page_no, offset = self.locate(block)
+      page = self.pool.get(page_no)
+      entry = self.ENTRY.unpack_from(page, offset)
+      values = [len(ids), min(ids), max(ids), min(years), max(years), min(ages), max(ages)]
+
+      if entry[0] != 0:
+         values = [
+            entry[0] + values[0],
+            min(entry[1], values[1]), max(entry[2], values[2]),
+            min(entry[3], values[3]), max(entry[4], values[4]),
+            min(entry[5], values[5]), max(entry[6], values[6]),
+         ]
+
+      self.ENTRY.pack_into(page, offset, *values)
+      self.pool.mark_dirty(page_no, page)
+
+
+   def remove(self, block):
+      """Uncounts a record deleted from block."""
+      page_no, offset = self.locate(block)
+      page = self.pool.get(page_no)
+      live = self.ENTRY.unpack_from(page, offset)[0]
+
+      if live <= 1:
+         page[offset:offset + self.ENTRY.size] = self.EMPTY
+      else:
+         struct.pack_into('=I', page, offset, live - 1)
+
+      self.pool.mark_dirty(page_no, page)
+
+
+   def bounds(self, predicate):
+      """
+         Returns {column: (low, high)} of the values the predicate lets
+         through for the columns kept here, or None when it lets none.
+         Conditions the ranges cannot answer (!=, values that are not
+         integers) are left to the scan.
+      """
+      bounds = dict()
+
+      for column, operator, value in (predicate.conditions if predicate is not None else ()):
+         if column not in self.COLUMNS or operator == '!=':
+            continue
+
+         if operator == 'in':
+            values = list(value)
+
+            if not values:
+               return None
+            if any(type(v) != int for v in values):
+               continue
+
+            low, high = min(values), max(values)
+
+         elif type(value) != int:
+            continue
+
+         elif operator == '=':
+            low, high = value, value
+         elif operator == '<':
+            low, high = None, value - 1
+         elif operator == '<=':
+            low, high = None, value
+         elif operator == '>':
+            low, high = value + 1, None
+         else:
+            low, high = value, None
+
+         old_low, old_high = bounds.get(column, (None, None))
+
+         if old_low is not None and (low is None or old_low > low):
+            low = old_low
+         if old_high is not None and (high is None or old_high < high):
+            high = old_high
+
+         if low is not None and high is not None and low > high:
+            return None
+
+         bounds[column] = (low, high)
+
+      return bounds
+
+
+   def may_match(self, block, bounds):
+      """Tells if block may hold a live record within bounds, see bounds()."""
+      if bounds is None:
+         return False
+
+      entry = self.get(block)
+
+      if entry[0] == 0:
+         return False
+
+      for column, (low, high) in bounds.items():
+         position = self.COLUMNS[column]
+
+         if low is not None and entry[position + 1] < low:
+            return False
+         if high is not None and entry[position] > high:
+            return False
+
+      return True
+
+
+   def flush(self):
+      self.pool.flush()
+
+
+   def close(self):
+      self.pool.close()
@@ -0,0 +1,166 @@
+import mmap
+
+try:
+   import numpy as np
+except ImportError: # numpy is optional, only the columnar scans need it
+   np = None
+
+
+class ColumnarScan:
+   """
+      Vectorized scans of a DatabaseHeap file with NumPy.
+
+      The file is memory mapped and viewed in place as a (blocks, registers)
+      structured array with the layout of TABLE_STRUCTURE, so filters are
+      masks over whole columns instead of one struct.unpack per register.
+      Results are column arrays: ids, ages and years as unsigned ints and
+      strings decoded to str arrays.
+   """
+
+   OPERATORS = {
+      '=':  'equal',
+      '!=': 'not_equal',
+      '<':  'less',
+      '<=': 'less_equal',
+      '>':  'greater',
+      '>=': 'greater_equal',
+   }
+
+   AGGREGATES = ('count', 'sum', 'min', 'max', 'mean')
+
+   def __init__(self, db):
+      if np is None:
+         raise ImportError("COLUMNAR SCANS NEED numpy")
+
+      self.db = db
+      self.per_block = db.BLOCK_SIZE // db.RECORD_SIZE
+
+      # the same fields as TABLE_STRUCTURE, packed with native byte order
+      self.dtype = np.dtype([
+         ('deleted',   '=u2'),
+         ('id',        '=u4'),
+         ('age',       '=u4'),
+         ('year',      '=u4'),
+         ('education', 'S9'),
+         ('city',      'S9'),
+         ('gender',    'S6'),
+      ])
+
+      assert self.dtype.itemsize == db.RECORD_SIZE
+
+
+   def view(self, mm):
+      """Returns (records, valid mask, blocks) over the blocks in use."""
+      last_pointer = self.db.last_register_pointer()
+      blocks = last_pointer[0] if last_pointer[1] > 1 else last_pointer[0] - 1
+      blocks = min(blocks, (len(mm) - self.db.HEADER_SIZE) // self.db.BLOCK_SIZE)
+
+      records = np.ndarray(
+         shape   = (blocks, self.per_block),
+         dtype   = self.dtype,
+         buffer  = mm,
+         offset  = self.db.HEADER_SIZE,
+         strides = (self.db.BLOCK_SIZE, self.db.RECORD_SIZE),
+      )
+
+      # registers in use: block 1 holds fewer, the last block is not full
+      in_use = np.full(blocks, self.per_block)
+      if blocks > 0:
+         in_use[0] = self.db.records_per_block(1)
+      if blocks == last_pointer[0]:
+         in_use[-1] = min(in_use[-1], last_pointer[1] - 1)
+
+      valid = np.arange(self.per_block) < in_use[:, None]
+      valid &= records['deleted'] == 0
+
+      return records, valid, blocks
+
+
+   def mask(self, records, valid, predicate):
+      mask = valid.copy()
+
+      for column, operator, value in predicate.conditions:
+         field = records[column]
+
+         if operator == 'in':
+            mask &= np.isin(field, [predicate.encode(column, v) for v in value])
+         else:
+            mask &= getattr(np, self.OPERATORS[operator])(field, predicate.encode(column, value))
+
+      return mask
+
+
+   def column(self, records, name, mask):
+      values = records[name][mask]
+
+      if values.dtype.kind == 'S':
+         return np.char.decode(values, 'utf-8')
+
+      return values
+
+
+   def scan(self, columns=None, where=None, group_by=None):
+      # every array kept from the map is a copy, so the map can be closed
+      predicate = self.db.predicate(where)
+      names = list(columns or self.db.COLUMNS) + ([group_by] if group_by else [])
+
+      with self.db.io.operation('columnar_scan'), self.db.lock.hold('read'), self.db.io.open(self.db.FILENAME, 'rb') as f:
+         self.db.flush()
+
+         with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            self.db.io.count('maps')
+            self.db.io.count('bytes_mapped', len(mm))
+
+            records, valid, blocks = self.view(mm)
+            mask = self.mask(records, valid, predicate)
+
+            result = {name: self.column(records, name, mask) for name in names}
+            del records, valid, mask
+
+      return result, blocks
+
+
+   def select(self, columns=None, where=None):
+      """Returns ({column: array}, accessed blocks) of the registers matching where."""
+      return self.scan(columns, where)
+
+
+   def aggregate(self, function, column=None, where=None, group_by=None):
+      """
+         Returns (result, accessed blocks) of count, sum, min, max or mean of
+         column over the registers matching where. With group_by the result
+         is a {group: value} dict.
+      """
+      if function not in self.AGGREGATES:
+         raise ValueError(f"UNKNOWN AGGREGATE {function}")
+
+      if function != 'count' and column is None:
+         raise KeyError(f"{function} NEEDS A COLUMN")
+
+      columns, blocks = self.scan([column or 'id'], where, group_by)
+      values = columns[column or 'id']
+
+      if group_by is None:
+         if function == 'count':
+            return int(values.size), blocks
+         if values.size == 0:
+            return None, blocks
+
+         return getattr(values, function)().item(), blocks
+
+      groups, inverse = np.unique(columns[group_by], return_inverse=True)
+      counts = np.bincount(inverse, minlength=groups.size)
+
+      if function == 'count':
+         results = counts
+      elif function == 'sum':
+         results = np.bincount(inverse, weights=values, minlength=groups.size).astype(np.int64)
+      elif function == 'mean':
+         results = np.bincount(inverse, weights=values, minlength=groups.size) / counts
+      else:
+         # sorting by group then value puts each group minimum first, maximum last
+         order = np.lexsort((values, inverse))
+         starts = np.searchsorted(inverse[order], np.arange(groups.size), side='left' if function == 'min' else 'right')
+         results = values[order][starts if function == 'min' else starts - 1]
+
+      return {group.item(): result.item() for group, result in zip(groups, results)}, blocks
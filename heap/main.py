@@ -1,11 +1,39 @@
 import os
+import sys
+import mmap
+import atexit
 import struct
+import threading
 from datetime import datetime
 from pprint import pprint
 
-
-class DatabaseHeap:
+# the modules shared by the engines are in common/, at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.iddirectory import IdDirectory
+from common.bufferpool import BufferPool
+from common.compression import CompressedStore
+from common.hashindex import HashIndex
+from common.zonemap import ZoneMap
+from columnar import ColumnarScan
+from parallel import ParallelScan
+from common.wal import WriteAheadLog
+from common.concurrency import TableLock
+from common.iostats import IOStats
+from common.predicate import Predicate
+from common.aggregate import Aggregation
+from common.table import SelectIterator, Table
+from common.csvload import read_chunks
+
+
+class DatabaseHeap(Table):
    FILENAME         = 'test.bin'
+   ID_INDEX         = 'test.id.dir'
+   YEAR_INDEX       = 'test.year.idx'
+   ZONE_MAP         = 'test.zone'
+   BLOCK_DIRECTORY  = 'test.blocks'
+   WAL_FILE         = 'test.wal'
+   LOCK_FILE        = 'test.lock'
    BLOCK_SIZE       = 4096
    HEADER_STRUCTURE = f'=H H I I I I 64s 64s 64s'
    TABLE_STRUCTURE  = f'=H I I I 9s 9s 6s'
@@ -13,11 +41,136 @@ class DatabaseHeap:
    HEADER_SIZE      = struct.calcsize(HEADER_STRUCTURE)
    RECORD_SIZE      = struct.calcsize(TABLE_STRUCTURE)
    DELETED_STRUCT   = f'=H I {RECORD_SIZE - 6}s'
+   RECORD           = struct.Struct(TABLE_STRUCTURE)
+
+   # where= columns: (source, position in the unpacked record, string width)
+   COLUMNS = {
+      'id':        ('r', 1, None),
+      'age':       ('r', 2, None),
+      'year':      ('r', 3, None),
+      'education': ('r', 4, 9),
+      'city':      ('r', 5, 9),
+      'gender':    ('r', 6, 6),
+   }
+
+   HEADER_FLUSH_INTERVAL = 1000 # header updates kept in memory before writing
+   BUFFER_POOL_SIZE      = 4 * 1024 * 1024 # bytes of blocks kept in memory
+   INDEX_POOL_SIZE       = 1024 * 1024     # bytes of index pages kept in memory
+   COMMIT_INTERVAL       = 0.05            # seconds between group commits of the log
+   CHECKPOINT_SIZE       = 16 * 1024 * 1024 # bytes of log that start a checkpoint
+   LOAD_CHUNK_ROWS       = 4096            # CSV rows parsed and appended at a time by load_csv()
+
+   def __init__(self, header_flush_interval = None, buffer_pool_size = None, year_index = None, wal = True, commit_interval = None,
+                shared = False, block_latches = False, compressed = None, trace = None):
+      # I/O counters and latencies of the operations, see stats(). trace is
+      # called with a dict for every operation and query, see IOStats.
+      self.io = IOStats(trace)
+
+      # Many readers or one writer at a time, see TableLock. With shared the
+      # lock is also taken on LOCK_FILE, for other processes using the table.
+      # With block_latches inserts run along with sequential scans.
+      self.lock          = TableLock(self.LOCK_FILE if shared else None)
+      self.block_latches = block_latches
+      self.flush_latch   = threading.RLock()
+      self.lock.acquire('write')
+
+      # worker processes of parallel scans, started by the first one
+      self.parallel_scan = None
+
+      # The header is parsed once and kept in memory. Changes are written back
+      # by flush(), on exit, or after HEADER_FLUSH_INTERVAL header updates.
+      self.header = None
+      self.header_dirty = False
+      self.pending_header_writes = 0
+      self.header_flush_interval = header_flush_interval if header_flush_interval is not None else self.HEADER_FLUSH_INTERVAL
+
+      # Changes go to the write-ahead log first, synced once per group commit:
+      # after an operation, when COMMIT_INTERVAL has passed since the last one,
+      # or by the committer thread once it passed after the last operation.
+      # A log left by a crash is redone before anything else is read.
+      self.wal = WriteAheadLog(
+         self.WAL_FILE,
+         {0: self.FILENAME, 1: self.ID_INDEX, 2: self.YEAR_INDEX, 3: self.ZONE_MAP, 4: self.BLOCK_DIRECTORY},
+         commit_interval if commit_interval is not None else self.COMMIT_INTERVAL,
+         self.CHECKPOINT_SIZE,
+      )
+      CompressedStore.recover_conversion(self.FILENAME, self.BLOCK_DIRECTORY)
+      self.wal.recover()
+
+      if not wal:
+         self.wal.close()
+         os.remove(self.WAL_FILE)
+         self.wal = None
 
-   def __init__(self):
       if not os.path.exists(self.FILENAME):
          self._create_file()
 
+      # Blocks compressed with zlib, see CompressedStore. None keeps the file
+      # as it is, True compresses a plain file and False decompresses it.
+      self.compressed = os.path.exists(self.BLOCK_DIRECTORY)
+
+      if compressed and not self.compressed:
+         CompressedStore.compress_file(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, self.HEADER_SIZE)
+      elif compressed is False and self.compressed:
+         CompressedStore.decompress_file(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, self.HEADER_SIZE)
+
+      self.compressed = compressed if compressed is not None else self.compressed
+      store = CompressedStore(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, self.HEADER_SIZE) if self.compressed else None
+
+      self.pool = BufferPool(self.FILENAME, self.BLOCK_SIZE, buffer_pool_size or self.BUFFER_POOL_SIZE, base_offset=self.HEADER_SIZE,
+                             latches=block_latches, store=store)
+
+      # primary key index: id -> punned pointer (block, register), one entry per serial
+      build_id_index = not os.path.exists(self.ID_INDEX)
+      self.id_index = IdDirectory(self.ID_INDEX, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+      if build_id_index:
+         self.build_id_index()
+
+      # min/max id, year and age and live records of every block
+      build_zone_map = not os.path.exists(self.ZONE_MAP)
+      self.zones = ZoneMap(self.ZONE_MAP, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+      if build_zone_map:
+         self.build_zone_map()
+
+      # optional secondary index: year -> posting list of punned pointers.
+      # None keeps the index only if its file exists, False drops it.
+      self.year_index = None
+
+      if year_index is False and os.path.exists(self.YEAR_INDEX):
+         os.remove(self.YEAR_INDEX)
+
+      elif year_index or (year_index is None and os.path.exists(self.YEAR_INDEX)):
+         build_year_index = not os.path.exists(self.YEAR_INDEX)
+         self.year_index = HashIndex(self.YEAR_INDEX, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+         if build_year_index:
+            self.build_year_index()
+
+      if self.wal is not None:
+         self.wal.attach(0, self.pool)
+         self.wal.attach(1, self.id_index.pool)
+         self.wal.attach(3, self.zones.pool)
+
+         if self.year_index is not None:
+            self.wal.attach(2, self.year_index.pool)
+
+         if self.compressed:
+            self.wal.attach(4, self.pool.store.directory)
+
+         self.io.attach(self.wal)
+
+      for pool in self.pools().values():
+         self.io.attach(pool)
+
+      self.lock.changed = self.reload
+      self.lock.publish = self.flush
+      self.lock.release()
+
+      self.start_committer()
+      atexit.register(self.close)
+
 
    def _create_file(self):
       """Creates a new file with a header."""
@@ -47,6 +200,10 @@ class DatabaseHeap:
 
          f.write(header_block)
 
+      self.header = None
+      self.header_dirty = False
+      self.pending_header_writes = 0
+
 
    def next_register_pointer(self, block: int, register: int):
       if block == 1:
@@ -63,47 +220,150 @@ class DatabaseHeap:
       return self.pointer(new_block, new_register)
 
 
-   def write_block(self):
-      with open(self.FILENAME, 'ab+') as f:
-         block = struct.pack(
-            f'{self.BLOCK_SIZE}s',
-            ''.ljust(self.BLOCK_SIZE, '\x00')[:(self.BLOCK_SIZE)].encode('utf-8')
-         )
-
-         f.write(block)
+   def write_block(self, block):
+      # new blocks only exist in the buffer pool until they are written back
+      return self.pool.new_block(block)
 
 
    def write_header(self, last_pointer = None, del_pointer = None, new_serial = None):
-      # the pointers are bytes
+      # the pointers are bytes; only the cached header is changed here
       header_data = self.read_header()
 
-      put_last_pointer = last_pointer if last_pointer is not None else self.pointer(*header_data[3])
-      put_del_pointer  = del_pointer if del_pointer is not None else self.pointer(*header_data[4])
-      put_new_serial   = new_serial if new_serial is not None else self.actual_serial()
+      if last_pointer is not None:
+         header_data[3] = struct.unpack('HH', last_pointer)
+      if del_pointer is not None:
+         header_data[4] = struct.unpack('HH', del_pointer)
+      if new_serial is not None:
+         header_data[5] = new_serial
+
+      header_data[8] = str(datetime.now())
+
+      self.header_dirty = True
+      self.pending_header_writes += 1
+
+      if self.pending_header_writes >= self.header_flush_interval:
+         self.flush()
+
 
+   def indexes(self):
+      return [self.id_index, self.zones] + ([self.year_index] if self.year_index is not None else [])
+
+
+   def write_changes(self):
+      # dirty pages and the header go to the files, or to the log if there is one
+      self.pool.flush()
+      self.id_index.flush()
+      self.zones.flush()
+
+      if self.year_index is not None:
+         self.year_index.flush()
+
+      if self.header is None or not self.header_dirty:
+         return
+
+      header_data       = self.header
       table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
-      timestamp_created = self.created_timestamp().ljust(64, '\x00')[:64]
-      timestamp_updated = str(datetime.now()).ljust(64, '\x00')[:64]
+      timestamp_created = header_data[7].ljust(64, '\x00')[:64]
+      timestamp_updated = header_data[8].ljust(64, '\x00')[:64]
+
+      header = struct.pack(
+         self.HEADER_STRUCTURE,
+       # ----------------------------------
+         self.BLOCK_SIZE,                  
+         self.HEADER_SIZE,                 
+         self.RECORD_SIZE,                 
+         self.punn(self.pointer(*header_data[3])),
+         self.punn(self.pointer(*header_data[4])),
+         header_data[5],
+         table_name.encode('utf-8'),       
+         timestamp_created.encode('utf-8'),
+         timestamp_updated.encode('utf-8'),
+       # ----------------------------------
+      )
 
-      with open(self.FILENAME, 'rb+') as f:
-         f.seek(0)
+      if self.wal is not None:
+         self.wal.log(0, 0, header)
+      else:
+         with self.io.open(self.FILENAME, 'rb+') as f:
+            f.seek(0)
+            f.write(header)
 
-         header = struct.pack(
-            self.HEADER_STRUCTURE,
-          # ----------------------------------
-            self.BLOCK_SIZE,                  
-            self.HEADER_SIZE,                 
-            self.RECORD_SIZE,                 
-            self.punn(put_last_pointer),      
-            self.punn(put_del_pointer),       
-            put_new_serial,                   
-            table_name.encode('utf-8'),       
-            timestamp_created.encode('utf-8'),
-            timestamp_updated.encode('utf-8'),
-          # ----------------------------------
-         )
+      self.io.count('header_writes')
+
+      self.header_dirty = False
+      self.pending_header_writes = 0
+
+
+   def close(self):
+      self.stop_committer()
+
+      with self.lock.hold('write'):
+         self.flush()
+
+         if self.wal is not None:
+            self.wal.close()
+
+         self.pool.close()
+         self.id_index.close()
+         self.zones.close()
+
+         if self.year_index is not None:
+            self.year_index.close()
+
+      if self.parallel_scan is not None:
+         self.parallel_scan.close()
+         self.parallel_scan = None
+
+      self.lock.close()
+
+
+   def build_id_index(self):
+      """(Re)builds the id index from the records in the file."""
+      self.id_index.reset()
+
+      for block, area in self.mmap_blocks():
+         for register, data in enumerate(self.RECORD.iter_unpack(area)):
+            if data[0] == 1:
+               continue
+
+            self.id_index.insert(data[1], self.punn(self.pointer(block, register + 1)))
+
+      self.id_index.flush()
+
+
+   def build_zone_map(self):
+      """(Re)builds the zone map from the records in the file."""
+      self.zones.reset()
+
+      for block, area in self.mmap_blocks():
+         live = [data for data in self.RECORD.iter_unpack(area) if data[0] != 1]
+         self.zones.add_many(block, [data[1] for data in live], [data[3] for data in live], [data[2] for data in live])
 
-         f.write(header)
+      self.zones.flush()
+
+
+   def build_year_index(self):
+      """(Re)builds the year index from the records in the file."""
+      self.year_index.reset()
+
+      for block, area in self.mmap_blocks():
+         for register, data in enumerate(self.RECORD.iter_unpack(area)):
+            if data[0] == 1:
+               continue
+
+            self.year_index.add(data[3], self.punn(self.pointer(block, register + 1)))
+
+      self.year_index.flush()
+
+
+   def index_register(self, pointer, serial, year, age):
+      # adds a register just written at pointer to the indexes and zone map
+      punned = self.punn(self.pointer(*pointer))
+      self.id_index.insert(serial, punned)
+      self.zones.add(pointer[0], serial, year if year is not None else 0, age if age is not None else 0)
+
+      if self.year_index is not None:
+         self.year_index.add(year if year is not None else 0, punned)
 
 
    def write_register(self,
@@ -115,74 +375,187 @@ class DatabaseHeap:
 
       del_pointer = self.del_register_pointer() # (bloco, registro)
       last_pointer = self.last_register_pointer()
-      new_head_deleted = None
+      NEW_SERIAL = self.actual_serial() + 1
+
+      register = self.pack_register(NEW_SERIAL, age, year, education, city, gender)
 
       if del_pointer != (0, 0):
-         offset = self.calculate_offset(del_pointer)
-      else:
-         offset = self.calculate_offset(last_pointer)
+         with self.pool.latch(del_pointer[0]):
+            page = self.pool.get(del_pointer[0])
+            start = (del_pointer[1] - 1) * self.RECORD_SIZE
 
-      put_age       = age if age is not None else 0
-      put_year      = year if year is not None else 0
-      put_education = education.ljust(9, '\x00')[:9] if education is not None else ''.ljust(9, '\x00')[:9]
-      put_city      = city.ljust(9, '\x00')[:9] if city is not None else ''.ljust(9, '\x00')[:9]
-      put_gender    = gender.ljust(6, '\x00')[:6] if gender is not None else ''.ljust(6, '\x00')[:6]
-      NEW_SERIAL    = self.actual_serial() + 1
+            next_pointer_deleted = struct.unpack_from(self.DELETED_STRUCT, page, start)[1]
+            new_head_deleted = self.deref(next_pointer_deleted)
+
+            page[start:start + self.RECORD_SIZE] = register
+            self.pool.mark_dirty(del_pointer[0], page)
+
+         self.index_register(del_pointer, NEW_SERIAL, year, age)
+         self.write_header(del_pointer=self.pointer(*new_head_deleted), new_serial=NEW_SERIAL)
+         return
 
       next_register = self.next_register_pointer(*last_pointer)
-      if struct.unpack('HH', next_register)[0] > last_pointer[0] and del_pointer == (0, 0):
-         self.write_block()
 
-      with open(self.FILENAME, 'rb+') as f:
-         f.seek(offset)
+      with self.pool.latch(last_pointer[0]):
+         page = self.pool.get(last_pointer[0])
+         start = (last_pointer[1] - 1) * self.RECORD_SIZE
 
-         if del_pointer != (0, 0):
-            del_register = f.read(self.RECORD_SIZE)
-            next_pointer_deleted = struct.unpack(self.DELETED_STRUCT, del_register)[1]
-            new_head_deleted = self.deref(next_pointer_deleted)
+         page[start:start + self.RECORD_SIZE] = register
+         self.pool.mark_dirty(last_pointer[0], page)
 
-            f.seek(offset)
+      self.index_register(last_pointer, NEW_SERIAL, year, age)
 
-         register = struct.pack(
-            self.TABLE_STRUCTURE,
-            0,                   # DELETED MARK
-            NEW_SERIAL,
-            put_age,
-            put_year,
-            put_education.encode('utf-8'),
-            put_city.encode('utf-8'),
-            put_gender.encode('utf-8'),)
+      if struct.unpack('HH', next_register)[0] > last_pointer[0]:
+         self.write_block(last_pointer[0] + 1)
 
-         f.write(register)
+      self.write_header(last_pointer=next_register, new_serial=NEW_SERIAL)
 
 
-      if del_pointer != (0, 0):
-         self.write_header(del_pointer=self.pointer(*new_head_deleted), new_serial=NEW_SERIAL)
-      else:
-         self.write_header(last_pointer=next_register, new_serial=NEW_SERIAL)
+   def records_per_block(self, block: int) -> int:
+      if block == 1:
+         return (self.BLOCK_SIZE - self.HEADER_SIZE) // self.RECORD_SIZE
+
+      return self.BLOCK_SIZE // self.RECORD_SIZE
+
+
+   def pack_register(self, serial, age, year, education, city, gender):
+      return struct.pack(
+         self.TABLE_STRUCTURE,
+         0,                   # DELETED MARK
+         serial,
+         age if age is not None else 0,
+         year if year is not None else 0,
+         (education if education is not None else '').encode('utf-8'),
+         (city if city is not None else '').encode('utf-8'),
+         (gender if gender is not None else '').encode('utf-8'),)
+
+
+   def write_many_registers(self, rows) -> int:
+      """Writes many registers with a single header update.
+
+      Deleted slots are reused first (following the free list), then records are
+      appended. Records are placed directly into the pages of the buffer pool, so
+      each touched block is written back with one call when it is evicted or
+      flushed.
+      """
+      header_data  = self.read_header()
+      last_pointer = header_data[3]
+      del_pointer  = header_data[4]
+      serial       = header_data[5]
+      written      = 0
+
+      # the latch of the block being filled is held while its page is kept
+      page_block, page, latch = 0, None, None
+
+      try:
+         for age, year, education, city, gender in rows:
+            # a row that cannot be packed stops here, before any page changes
+            register = self.pack_register(serial + 1, age, year, education, city, gender)
+            serial += 1
 
+            if del_pointer != (0, 0):
+               block, position = del_pointer
+            else:
+               block, position = last_pointer
 
+            if block != page_block:
+               if latch is not None:
+                  latch.release()
 
-   def read_register(self, pointer):
-      offset = self.calculate_offset(pointer)
+               latch = self.pool.latch(block)
+               latch.acquire()
+               page_block, page = block, self.pool.get(block)
+
+            start = (position - 1) * self.RECORD_SIZE
+
+            if del_pointer != (0, 0):
+               next_pointer_deleted = struct.unpack_from(self.DELETED_STRUCT, page, start)[1]
+               del_pointer = self.deref(next_pointer_deleted)
+
+            else:
+               if position < self.records_per_block(block):
+                  last_pointer = (block, position + 1)
+               else:
+                  last_pointer = (block + 1, 1)
+                  self.write_block(block + 1)
+
+            page[start:start + self.RECORD_SIZE] = register
+            self.pool.mark_dirty(block, page)
+
+            self.index_register((block, position), serial, year, age)
+
+            written += 1
+
+      finally:
+         if latch is not None:
+            latch.release()
 
-      with open(self.FILENAME, 'rb') as f:
-         f.seek(offset)
+         # the rows written before an error stay, so the header must count them
+         if written > 0:
+            self.write_header(
+               last_pointer=self.pointer(*last_pointer),
+               del_pointer=self.pointer(*del_pointer),
+               new_serial=serial,
+            )
 
-         register = f.read(self.RECORD_SIZE)
-         data = struct.unpack(self.TABLE_STRUCTURE, register)
+      return written
 
-         return data
 
+   def append_registers(self, rows, last_pointer, serial, index = True):
+      """Appends rows at last_pointer (the next free register), filling a block
+      at a time, and returns the new last_pointer and serial.
 
-   def compare(self, dt1, dt2) -> bool:
-      if type(dt2) == str or type(dt2) == int:
-         return dt1 == dt2
+      The header is left to the caller. Without index the records are not
+      added to the indexes and the zone map, which have to be rebuilt.
+      """
+      pack = self.RECORD.pack
+      i = 0
 
-      elif type(dt2) == set:
-         return dt1 in dt2
+      while i < len(rows):
+         block, position = last_pointer
+         n = min(len(rows) - i, self.records_per_block(block) - position + 1)
+         ids = range(serial + 1, serial + n + 1)
+         chunk = rows[i:i + n]
 
-      return False
+         data = b''.join([
+            pack(0, id, age, year, education.encode('utf-8'), city.encode('utf-8'), gender.encode('utf-8'))
+            for id, (age, year, education, city, gender) in zip(ids, chunk)
+         ])
+
+         start = (position - 1) * self.RECORD_SIZE
+         page = self.pool.get(block)
+         page[start:start + len(data)] = data
+         self.pool.mark_dirty(block, page)
+
+         if index:
+            registers = [v for register in range(position, position + n) for v in (block, register)]
+            punned = struct.unpack(f'{n}I', struct.pack(f'{2 * n}H', *registers))
+
+            self.id_index.insert_many(serial + 1, punned)
+            self.zones.add_many(block, ids, [row[1] for row in chunk], [row[0] for row in chunk])
+
+            if self.year_index is not None:
+               for row, value in zip(chunk, punned):
+                  self.year_index.add(row[1], value)
+
+         # the block of last_pointer is always in the pool, see write_register()
+         if position + n > self.records_per_block(block):
+            last_pointer = (block + 1, 1)
+            self.write_block(block + 1)
+         else:
+            last_pointer = (block, position + n)
+
+         serial += n
+         i += n
+
+      return last_pointer, serial
+
+
+   def read_register(self, pointer):
+      page = self.pool.get(pointer[0])
+      data = self.RECORD.unpack_from(page, (pointer[1] - 1) * self.RECORD_SIZE)
+
+      return data
 
 
    def readable_out(self, data):
@@ -195,227 +568,344 @@ class DatabaseHeap:
          data[5].decode('utf-8').rstrip('\x00'),
          data[6].decode('utf-8').rstrip('\x00'),
       )
-   
-   def read_by_id(self, id):
-      pointer = struct.unpack('HH', self.pointer(1, 1))
-      first_offset = self.calculate_offset(pointer)
-      last_pointer = self.last_register_pointer()
-      accessed_blocks = 1
 
-      table = list()
 
-      with open(self.FILENAME, 'rb') as f:
-         f.seek(first_offset)
+   def mmap_blocks(self, blocks=None):
+      """
+         Yields (block, record area) for every block in use, or for the
+         (block, registers) in blocks, read from a memory map of the file. The record area holds only the registers in use, so
+         it can be decoded at once with RECORD.iter_unpack. Scans done this way
+         do not go through (nor evict) the buffer pool.
 
-         while pointer != last_pointer:
-            f.seek(self.calculate_offset(pointer))
-            register = f.read(self.RECORD_SIZE)
-            data = struct.unpack(self.TABLE_STRUCTURE, register)
+         With block latches the blocks are copied from the buffer pool under
+         their latches instead, as inserts may be changing them, and so are
+         the blocks of a compressed file, which the pool decompresses.
+      """
+      blocks = blocks if blocks is not None else self.blocks_in_use()
 
-            # Next Pointer
-            next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-            if next_pointer[0] > pointer[0]:
-               accessed_blocks += 1
+      if self.block_latches or self.compressed:
+         for block, registers in blocks:
+            with self.pool.latch(block):
+               area = bytes(self.pool.get(block)[:registers * self.RECORD_SIZE])
 
-            pointer = next_pointer
-            
-            if data[0] == 1 or not self.compare(data[1], id):
-               continue
+            yield block, area
 
-            readable_data = self.readable_out(data)
-            table.append(readable_data)
+         return
 
-            if type(id) != set:
-               break
+      self.pool.flush()
 
-      return (table, accessed_blocks)
-   
+      # with a write-ahead log, the file only gets the pages from flush()
+      if self.pool.wal is not None:
+         self.flush()
 
-   def read_by_year(self, year):
-      pointer = struct.unpack('HH', self.pointer(1, 1))
-      first_offset = self.calculate_offset(pointer)
+      with self.io.open(self.FILENAME, 'rb') as f:
+         with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            self.io.count('maps')
+
+            for block, registers in blocks:
+               start = self.calculate_offset((block, 1))
+               area  = mm[start:start + registers * self.RECORD_SIZE]
+               self.io.count('bytes_mapped', len(area))
+
+               yield block, area
+
+
+   def blocks_in_use(self):
       last_pointer = self.last_register_pointer()
-      accessed_blocks = 1
 
-      table = list()
+      for block in range(1, last_pointer[0] + 1):
+         if block == last_pointer[0]:
+            registers = last_pointer[1] - 1
+         else:
+            registers = self.records_per_block(block)
 
-      with open(self.FILENAME, 'rb') as f:
-         f.seek(first_offset)
+         if registers == 0:
+            break
 
-         while pointer != last_pointer:
-            f.seek(self.calculate_offset(pointer))
-            register = f.read(self.RECORD_SIZE)
-            data = struct.unpack(self.TABLE_STRUCTURE, register)
+         yield block, registers
 
-            # Next Pointer
-            next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-            if next_pointer[0] > pointer[0]:
-               accessed_blocks += 1
 
-            pointer = next_pointer
-            
-            if data[0] == 1 or not self.compare(data[3], year):
-               continue
+   def blocks_to_scan(self, predicate, stats):
+      # the blocks in use the zone map cannot rule out for predicate
+      bounds = self.zones.bounds(predicate)
 
-            readable_data = self.readable_out(data)
-            table.append(readable_data)
+      for block, registers in self.blocks_in_use():
+         if self.zones.may_match(block, bounds):
+            yield block, registers
+         else:
+            stats.skipped_blocks += 1
 
-      return (table, accessed_blocks)
 
+   def iter_by_id(self, id, stats):
+      # index lookups: accessed blocks are the index pages plus the data blocks
+      ids = sorted(id) if type(id) == set else [id]
+      data_blocks = set()
 
-   def read_many_registers(self):
-      pointer = struct.unpack('HH', self.pointer(1, 1))
-      first_offset = self.calculate_offset(pointer)
-      last_pointer = self.last_register_pointer()
-      accessed_blocks = 1
+      for key in ids:
+         stats.accessed_blocks += self.id_index.height
+         value = self.id_index.search(key)
+
+         if value is None:
+            continue
+
+         pointer = self.deref(value)
+         if pointer[0] not in data_blocks:
+            data_blocks.add(pointer[0])
+            stats.accessed_blocks += 1
+
+         data = self.read_register(pointer)
+
+         if data[0] == 1 or data[1] != key:
+            continue
+
+         yield self.readable_out(data)
+
+
+   def iter_by_year(self, year, stats):
+      yield from self.iter_where(self.predicate(year=year), stats)
+
+
+   def predicate(self, where=None, id=None, year=None) -> Predicate:
+      # id and year are conditions too, so they can be combined with where
+      conditions = list(where.items()) if type(where) == dict else list(where or ())
+
+      if id is not None:
+         conditions.append(('id', id))
+      if year is not None:
+         conditions.append(('year', year))
 
-      table = list()
+      return Predicate(conditions, self.COLUMNS, guard='r[0] == 0')
 
-      with open(self.FILENAME, 'rb') as f:
-         f.seek(first_offset)
 
-         while pointer != last_pointer:
-            f.seek(self.calculate_offset(pointer))
-            register = f.read(self.RECORD_SIZE)
-            data = struct.unpack(self.TABLE_STRUCTURE, register)
+   def where_candidates(self, predicate, stats):
+      """
+         Yields (pointer, register) for every register that passes predicate,
+         found through the id index, the year index or a scan of every block.
+      """
+      if self.uses_index(predicate):
+         yield from self.index_candidates(predicate, stats)
+         return
 
-            # Next Pointer
-            next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-            if next_pointer[0] > pointer[0]:
-               accessed_blocks += 1
+      for block, area in self.mmap_blocks(self.blocks_to_scan(predicate, stats)):
+         stats.accessed_blocks += 1
 
-            pointer = next_pointer
-            
+         for register, data in predicate.positions(self.RECORD.iter_unpack(area)):
+            yield (block, register + 1), data
+
+
+   def uses_index(self, predicate):
+      # one index search per id costs about height blocks, so large id sets
+      # are cheaper to check during a single scan
+      use_id_index = predicate.ids is not None and \
+         len(predicate.ids) * self.id_index.height < self.last_register_pointer()[0]
+
+      return use_id_index or (predicate.ids is None and predicate.years is not None and self.year_index is not None)
+
+
+   def index_candidates(self, predicate, stats):
+      # accessed blocks are the index pages plus the data blocks
+      pointers = list()
+
+      if predicate.ids is not None:
+         for key in predicate.ids:
+            stats.accessed_blocks += self.id_index.height
+            value = self.id_index.search(key)
+
+            if value is not None:
+               pointers.append(value)
+
+      else:
+         for key in predicate.years:
+            values, pages = self.year_index.lookup(key)
+            stats.accessed_blocks += pages
+            pointers.extend(values)
+
+      data_blocks = set()
+
+      for pointer in sorted(map(self.deref, pointers)):
+         if pointer[0] not in data_blocks:
+            data_blocks.add(pointer[0])
+            stats.accessed_blocks += 1
+
+         data = self.read_register(pointer)
+
+         if predicate.test(data):
+            yield pointer, data
+
+
+   def iter_where(self, predicate, stats):
+      for pointer, data in self.where_candidates(predicate, stats):
+         yield self.readable_out(data)
+
+
+   def iter_many_registers(self, stats):
+      for block, area in self.mmap_blocks(self.blocks_to_scan(None, stats)):
+         stats.accessed_blocks += 1
+
+         for data in self.RECORD.iter_unpack(area):
             if data[0] == 1:
                continue
 
-            readable_data = self.readable_out(data)
-            table.append(readable_data)
+            yield self.readable_out(data)
 
-      return (table, accessed_blocks)
 
+   def projection(self, columns):
+      """
+         Returns a Struct unpacking only the deleted mark and the given columns
+         of a register, skipping the bytes of the others, and the COLUMNS of
+         the records it unpacks.
+      """
+      names = {position: column for column, (source, position, width) in self.COLUMNS.items()}
+      formats, projected = list(), dict()
 
-   def deletion_by_id(self, id):
-      pointer = struct.unpack('HH', self.pointer(1, 1))
-      last_pointer = self.last_register_pointer()
-      del_pointer  = self.pointer(*self.del_register_pointer())
-      accessed_blocks = 1
-      deleted = 0
-
-      with open(self.FILENAME, 'rb+') as f:
-         while pointer != last_pointer:
-            offset = self.calculate_offset(pointer)
-            f.seek(offset)
-            register = f.read(self.RECORD_SIZE)
-            data = struct.unpack(self.TABLE_STRUCTURE, register)
-            
-            if data[0] == 1:
-               next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-               if next_pointer[0] > pointer[0]:
-                  accessed_blocks += 1
+      for position, fmt in enumerate(self.TABLE_STRUCTURE.lstrip('=').split()):
+         column = names.get(position)
 
-               pointer = next_pointer
-               continue
+         if position == 0 or column in columns:
+            if column is not None:
+               projected[column] = ('r', len(projected) + 1, self.COLUMNS[column][2])
 
-            if data[1] == id:
-               f.seek(self.calculate_offset(pointer))
-               deletion_record = struct.pack(
-                  self.DELETED_STRUCT,
-                  1, self.punn(del_pointer),
-                  ''.ljust(self.RECORD_SIZE - 6, '\x00')[:(self.RECORD_SIZE - 6)].encode('utf-8')
-               )
+            formats.append(fmt)
+         else:
+            formats.append(f'{struct.calcsize("=" + fmt)}x')
 
-               f.write(deletion_record)
-               
-               deleted = 1
-               break
+      return struct.Struct('=' + ' '.join(formats)), projected
 
-            next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-            if next_pointer[0] > pointer[0]:
-               accessed_blocks += 1
 
-            pointer = next_pointer
+   def iter_aggregate(self, predicate, aggregation, stats):
+      if self.uses_index(predicate):
+         aggregation.add(data for pointer, data in self.index_candidates(predicate, stats))
+         yield from aggregation.rows()
+         return
+
+      # scans unpack only the columns of the groups, aggregates and conditions
+      record, columns = self.projection(aggregation.used | {column for column, operator, value in predicate.conditions})
+      aggregation.project(columns)
+      test = Predicate(predicate.conditions, columns, guard='r[0] == 0')
+
+      for block, area in self.mmap_blocks(self.blocks_to_scan(predicate, stats)):
+         stats.accessed_blocks += 1
+         aggregation.add(test.records(record.iter_unpack(area)))
+
+      yield from aggregation.rows()
+
+
+   def read_by_id(self, id):
+      rows = SelectIterator(self.locked('read', self.iter_by_id, 'select_by_id'), id)
+      return (list(rows), rows.accessed_blocks)
+
 
-      if deleted == 1:
-         self.write_header(del_pointer=self.pointer(*pointer))
+   def read_by_year(self, year):
+      rows = SelectIterator(self.locked('read', self.iter_by_year, 'select_by_year'), year)
+      return (list(rows), rows.accessed_blocks)
+
+
+   def read_many_registers(self, workers=None):
+      rows = self.iter_select(workers=workers)
+      return (list(rows), rows.accessed_blocks)
+
+
+   def deletion_record(self, next_deleted):
+      return struct.pack(
+         self.DELETED_STRUCT,
+         1, self.punn(self.pointer(*next_deleted)),
+         ''.ljust(self.RECORD_SIZE - 6, '\x00')[:(self.RECORD_SIZE - 6)].encode('utf-8')
+      )
+
+
+   def deletion_by_id(self, id):
+      accessed_blocks = self.id_index.height
+      value = self.id_index.search(id)
+
+      if value is None:
+         return accessed_blocks
+
+      pointer = self.deref(value)
+      page = self.pool.get(pointer[0])
+      start = (pointer[1] - 1) * self.RECORD_SIZE
+      data = self.RECORD.unpack_from(page, start)
+      accessed_blocks += 1
+
+      if data[0] == 1 or data[1] != id:
+         return accessed_blocks
+
+      page[start:start + self.RECORD_SIZE] = self.deletion_record(self.del_register_pointer())
+      self.pool.mark_dirty(pointer[0], page)
+
+      self.id_index.delete(id)
+      self.zones.remove(pointer[0])
+      if self.year_index is not None:
+         self.year_index.remove(data[3], value)
+      self.write_header(del_pointer=self.pointer(*pointer))
       
       return accessed_blocks
 
 
    def deletion_by_year(self, year):
-      header_data = self.read_header()
-      pointer = struct.unpack('HH', self.pointer(1, 1))
-      last_pointer = self.last_register_pointer()
-      accessed_blocks = 1
+      if self.year_index is not None:
+         return self.deletion_by_year_index(year)
 
+      return self.deletion_where(self.predicate(year=year))
+
+
+   def deletion_by_year_index(self, year):
+      values, accessed_blocks = self.year_index.lookup(year)
       deleted_pointers = self.del_register_pointer()
+      data_blocks = set()
 
-      with open(self.FILENAME, 'rb+') as f:
-         while pointer != last_pointer:
-            offset = self.calculate_offset(pointer)
-            f.seek(offset)
-            register = f.read(self.RECORD_SIZE)
-            data = struct.unpack(self.TABLE_STRUCTURE, register)
-            
-            if data[0] == 1:
-               next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-               if next_pointer[0] > pointer[0]:
-                  accessed_blocks += 1
+      for pointer in sorted(map(self.deref, values)):
+         page = self.pool.get(pointer[0])
+         start = (pointer[1] - 1) * self.RECORD_SIZE
+         data = self.RECORD.unpack_from(page, start)
+         data_blocks.add(pointer[0])
 
-               pointer = next_pointer
-               continue
+         if data[0] == 1 or data[3] != year:
+            continue
+
+         page[start:start + self.RECORD_SIZE] = self.deletion_record(deleted_pointers)
+         self.pool.mark_dirty(pointer[0], page)
+         self.id_index.delete(data[1])
+         self.zones.remove(pointer[0])
 
-            if data[3] == year:
-               f.seek(self.calculate_offset(pointer))
+         deleted_pointers = pointer
 
-               deletion_record = struct.pack(
-                  self.DELETED_STRUCT,
-                  1, self.punn(self.pointer(*deleted_pointers)),
-                  ''.ljust(self.RECORD_SIZE - 6, '\x00')[:(self.RECORD_SIZE - 6)].encode('utf-8')
-               )
+      self.year_index.drop(year)
 
-               deleted_pointers = pointer
+      if deleted_pointers != self.del_register_pointer():
+         self.write_header(del_pointer=self.pointer(*deleted_pointers))
 
-               f.write(deletion_record)
+      return accessed_blocks + len(data_blocks)
 
-               put_last_pointer  = self.pointer(*header_data[3])
-               put_del_pointer   = self.pointer(*pointer)                # Only change
-               put_new_serial    = self.actual_serial()
-               table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
-               timestamp_created = header_data[7].ljust(64, '\x00')[:64]
-               timestamp_updated = header_data[8].ljust(64, '\x00')[:64]
 
-               f.seek(0)
+   def deletion_where(self, predicate):
+      # every deleted register is chained in front of the free list in memory,
+      # and the header gets the new head of the list once, at the end
+      candidates = SelectIterator(self.where_candidates, predicate)
+      deleted_pointers = self.del_register_pointer()
+      year_values = dict()
 
-               header = struct.pack(
-                  self.HEADER_STRUCTURE,
-                # ----------------------------------
-                  self.BLOCK_SIZE,                  
-                  self.HEADER_SIZE,                 
-                  self.RECORD_SIZE,                 
-                  self.punn(put_last_pointer),      
-                  self.punn(put_del_pointer),       
-                  put_new_serial,                   
-                  table_name.encode('utf-8'),       
-                  timestamp_created.encode('utf-8'),
-                  timestamp_updated.encode('utf-8'),
-                # ----------------------------------
-               )
+      for pointer, data in candidates:
+         page = self.pool.get(pointer[0])
+         start = (pointer[1] - 1) * self.RECORD_SIZE
 
-               f.write(header)
+         page[start:start + self.RECORD_SIZE] = self.deletion_record(deleted_pointers)
+         self.pool.mark_dirty(pointer[0], page)
 
-               next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-               off = self.calculate_offset(next_pointer)
+         self.id_index.delete(data[1])
+         self.zones.remove(pointer[0])
+         year_values.setdefault(data[3], set()).add(self.punn(self.pointer(*pointer)))
 
-               f.seek(off)
+         deleted_pointers = pointer
 
-            next_pointer = struct.unpack('HH', self.next_register_pointer(*pointer))
-            if next_pointer[0] > pointer[0]:
-               accessed_blocks += 1
+      # one pass over the posting list of every year
+      if self.year_index is not None:
+         for year, values in year_values.items():
+            self.year_index.remove_many(year, values)
 
-            pointer = next_pointer
-         
-         return accessed_blocks
+      if deleted_pointers != self.del_register_pointer():
+         self.write_header(del_pointer=self.pointer(*deleted_pointers))
+
+      return candidates.accessed_blocks
 
 
    def calculate_offset(self, pointer, null=False):
@@ -430,8 +920,18 @@ class DatabaseHeap:
 
 
    def read_header(self):
+      """Returns the cached header, reading it from the file the first time."""
+      if self.header is None:
+         self.header = self.load_header()
+
+      return self.header
+
+
+   def load_header(self):
       """Read the header information."""
-      with open(self.FILENAME, 'rb') as f:
+      self.io.count('header_reads')
+
+      with self.io.open(self.FILENAME, 'rb') as f:
          f.seek(0)
          header = f.read(self.HEADER_SIZE)
          unpacked_data = struct.unpack(self.HEADER_STRUCTURE, header)
@@ -486,36 +986,203 @@ class DatabaseHeap:
 
 
    def insert(self, age, year, education, city, gender):
-      self.write_register(age, year, education, city, gender)
+      with self.io.operation('insert'), self.lock.hold(self.insert_mode()):
+         self.write_register(age, year, education, city, gender)
+         self.group_commit()
 
 
-   def select(self, id=None, year=None):
-      if id == None and year == None:
-         data, accessed_blocks = self.read_many_registers()
-         # pprint(data)
-         return accessed_blocks
-      
-      elif id != None and year == None:
-         data, accessed_blocks = self.read_by_id(id)
-         # pprint(data)
-         return accessed_blocks
+   def insert_many(self, rows) -> int:
+      # rows: iterable of (age, year, education, city, gender)
+      with self.io.operation('insert_many'), self.lock.hold(self.insert_mode()):
+         written = self.write_many_registers(rows)
+         self.group_commit()
+
+      return written
+
+
+   def load_csv(self, path, mapping = None, rebuild_indexes = False) -> int:
+      """Bulk loads the rows of a CSV file, like COPY, and returns how many.
+
+      The file is read LOAD_CHUNK_ROWS rows at a time (see read_chunks() for
+      mapping) and the records are appended a block at a time, after the last
+      one: deleted registers are not reused. The header is written once, at
+      the end. With rebuild_indexes the indexes and the zone map are rebuilt
+      from the file afterwards instead of kept up to date row by row, which
+      pays off when the file is large against the table.
+
+      A bad row stops the load with a ValueError; the rows before its chunk
+      stay loaded.
+      """
+      with self.io.operation('load_csv') as operation, self.lock.hold('write'):
+         header_data  = self.read_header()
+         last_pointer = header_data[3]
+         serial       = first = header_data[5]
+
+         try:
+            for rows in read_chunks(path, mapping, self.LOAD_CHUNK_ROWS):
+               last_pointer, serial = self.append_registers(rows, last_pointer, serial, not rebuild_indexes)
+         finally:
+            if serial > first:
+               self.write_header(last_pointer=self.pointer(*last_pointer), new_serial=serial)
+
+               if rebuild_indexes:
+                  self.build_id_index()
+                  self.build_zone_map()
+
+                  if self.year_index is not None:
+                     self.build_year_index()
+
+         operation.details = {'rows': serial - first}
+
+      self.commit()
+
+      return serial - first
+
+
+   def insert_mode(self):
+      # with block latches, scans read the blocks an insert changes under
+      # their latches, so inserts need not wait for them
+      return 'append' if self.block_latches else 'write'
+
+
+   def iter_select(self, id=None, year=None, where=None, workers=None) -> SelectIterator:
+      """
+         Returns an iterator over the rows of the query, read lazily. Its
+         accessed_blocks are final once it is exhausted or closed. The table
+         lock is held until then, so a query left unfinished should be closed,
+         or used in a with block.
+
+         where takes conditions on any column, see Predicate, for example
+         [('year', '>=', 2015), ('city', 'in', {'Pune', 'New Delhi'})].
+
+         With workers, a query answered by a full scan is split between that
+         many processes, see ParallelScan. Workers read the file itself, so
+         the scans of a compressed file are not split.
+      """
+      if workers is not None and workers > 1 and not self.compressed:
+         predicate = self.predicate(where, id, year)
+
+         if not self.uses_index(predicate):
+            return SelectIterator(self.locked('read', self.parallel(workers).rows, 'parallel_scan'), predicate)
+
+      if id == None and year == None and where == None:
+         return SelectIterator(self.locked('scan', self.iter_many_registers, 'scan'))
       
-      elif id == None and year != None:
-         data, accessed_blocks = self.read_by_year(year)
-         # pprint(data)
-         return accessed_blocks
+      elif id != None and year == None and where == None and type(id) != set:
+         return SelectIterator(self.locked('read', self.iter_by_id, 'select_by_id'), id)
       
       else:
-         raise NotImplemented
+         # sets of ids go through uses_index(), which scans when that is cheaper
+         return SelectIterator(self.locked('read', self.iter_where, 'select_where'), self.predicate(where, id, year))
+
+
+   def aggregate(self, group_by=None, aggs=None, where=None, id=None, year=None) -> SelectIterator:
+      """
+         Returns an iterator over the groups of a GROUP BY query, as dicts of
+         the group columns and the aggregates, for example
+         aggregate(['city', 'year'], {'headcount': 'count', 'age': ('avg', 'age')}).
+         See Aggregation.
+
+         The aggregates are computed in the scan loop, or over the registers
+         found by an index, with only the columns of the query unpacked. The
+         table lock is held until the iterator is exhausted or closed, as in
+         iter_select().
+      """
+      aggregation = Aggregation(group_by, aggs, self.COLUMNS)
+      mode = 'scan' if id == None and year == None and where == None else 'read'
+
+      return SelectIterator(self.locked(mode, self.iter_aggregate, 'aggregate'), self.predicate(where, id, year), aggregation)
+
+
+   def columnar(self) -> ColumnarScan:
+      """Returns NumPy column scans over this table (needs numpy), see ColumnarScan."""
+      if self.compressed:
+         raise ValueError("COLUMNAR SCANS NEED A PLAIN FILE")
+
+      return ColumnarScan(self)
+
+
+   def compression_stats(self):
+      """
+         Returns the sizes of the compressed blocks and the images read and
+         written so far (see CompressedStore.stats()), with the hits and
+         misses of the buffer pool, or None for a plain file.
+      """
+      if not self.compressed:
+         return None
+
+      stats = self.pool.store.stats()
+      stats['cache_hits']   = self.pool.hits
+      stats['cache_misses'] = self.pool.misses
+
+      return stats
+
+
+   def pools(self):
+      """Returns the buffer pools of the table by name."""
+      pools = {'data': self.pool, 'id_index': self.id_index.pool, 'zone_map': self.zones.pool}
+
+      if self.year_index is not None:
+         pools['year_index'] = self.year_index.pool
+      if self.compressed:
+         pools['block_directory'] = self.pool.store.directory
+
+      return pools
+
+
+   def stats(self, reset = False):
+      """
+         Returns the I/O counters and the latencies of the operations and
+         queries so far (see IOStats.snapshot()), the hits and misses of every
+         buffer pool, the commits and checkpoints of the log and the figures
+         of compression_stats(). With reset the counters and latencies start
+         over.
+      """
+      stats = self.io.snapshot()
+      stats['cache'] = {name: {'hits': pool.hits, 'misses': pool.misses} for name, pool in self.pools().items()}
+      stats['wal'] = {'commits': self.wal.commits, 'checkpoints': self.wal.checkpoints, 'size': self.wal.size} if self.wal is not None else None
+      stats['compression'] = self.compression_stats()
+
+      if reset:
+         self.io.reset()
+
+      return stats
+
+
+   def parallel(self, workers) -> ParallelScan:
+      """Returns the parallel scans of this table with workers processes."""
+      if self.parallel_scan is not None and self.parallel_scan.workers != workers:
+         self.parallel_scan.close()
+         self.parallel_scan = None
+
+      if self.parallel_scan is None:
+         self.parallel_scan = ParallelScan(self, workers)
+
+      return self.parallel_scan
+
+
+   def select(self, id=None, year=None, where=None, workers=None):
+      rows = self.iter_select(id, year, where, workers)
+
+      for row in rows:
+         pass # pprint(row)
+
+      return rows.accessed_blocks
       
 
-   def delete(self, id=None, year=None):
-      if id == None and year == None:
+   def delete(self, id=None, year=None, where=None):
+      if id == None and year == None and where == None:
          raise KeyError("DELETION must have a key")
-      elif id != None and year == None:
-         return self.deletion_by_id(id)
-      elif id == None and year != None:
-         return self.deletion_by_year(year)
-      else:
-         raise NotImplemented
+
+      with self.io.operation('delete'), self.lock.hold('write'):
+         if id != None and year == None and where == None and type(id) != set:
+            blocks = self.deletion_by_id(id)
+         elif id == None and year != None and where == None:
+            blocks = self.deletion_by_year(year)
+         else:
+            blocks = self.deletion_where(self.predicate(where, id, year))
+
+         self.group_commit()
+
+      return blocks
 
@@ -0,0 +1,77 @@
+import mmap
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from common.predicate import Predicate
+
+
+def scan_range(task):
+   """Filters and decodes the record areas of one block range, in a worker process."""
+   filename, record_structure, areas, conditions, columns = task
+
+   record    = struct.Struct(record_structure)
+   predicate = Predicate(conditions, columns, guard='r[0] == 0')
+   rows      = list()
+
+   with open(filename, 'rb') as f:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+         for start, length in areas:
+            for register, data in predicate.positions(record.iter_unpack(mm[start:start + length])):
+               rows.append((
+                  data[0],
+                  data[1],
+                  data[2],
+                  data[3],
+                  data[4].decode('utf-8').rstrip('\x00'),
+                  data[5].decode('utf-8').rstrip('\x00'),
+                  data[6].decode('utf-8').rstrip('\x00'),
+               ))
+
+   return rows
+
+
+class ParallelScan:
+   """
+      Full scans of a DatabaseHeap file split into block ranges, each one
+      filtered and decoded by a worker process.
+
+      The ranges are contiguous and handed out in file order, a few per
+      worker so a slow range does not hold back the others, and their rows
+      are merged back in the same order. Workers read the file itself, so
+      the changes kept in memory are written back before a scan.
+   """
+
+   RANGES_PER_WORKER = 4
+
+   def __init__(self, db, workers):
+      self.db       = db
+      self.workers  = workers
+      self.executor = ProcessPoolExecutor(workers)
+
+
+   def tasks(self, predicate, stats):
+      blocks = list(self.db.blocks_to_scan(predicate, stats))
+      size = max(1, -(-len(blocks) // (self.workers * self.RANGES_PER_WORKER)))
+
+      for first in range(0, len(blocks), size):
+         areas = [
+            (self.db.calculate_offset((block, 1)), registers * self.db.RECORD_SIZE)
+            for block, registers in blocks[first:first + size]
+         ]
+
+         yield (self.db.FILENAME, self.db.TABLE_STRUCTURE, areas, predicate.conditions, predicate.columns)
+
+
+   def rows(self, predicate, stats):
+      # generator for SelectIterator: accessed blocks are the blocks scanned
+      self.db.flush()
+
+      tasks = list(self.tasks(predicate, stats))
+
+      for task, rows in zip(tasks, self.executor.map(scan_range, tasks)):
+         stats.accessed_blocks += len(task[2])
+         yield from rows
+
+
+   def close(self):
+      self.executor.shutdown()
@@ -1,156 +1,77 @@
 from main import DatabaseHeap
+from common.enginetest import EngineTest
 
 import time
+import struct
+from collections import Counter
 
-db = DatabaseHeap()
-
-def load_data():
-	total_time = 0
-	count = 0
-
-	with open('data/Employee.csv', 'r') as data:
-		head = data.readline()
-
-		for line in data:
-			ls = line.split(',')
-			ls[4] = ls[4].rstrip('\n')
-			
-			start_time = time.time()
-			db.insert(int(ls[3]), int(ls[1]), ls[0], ls[2], ls[4])
-			end_time = time.time()
-
-			total_time += end_time - start_time
-			count += 1
-	
-	last_pointer = db.last_register_pointer()
-
-	print(f"Total blocks: {last_pointer[0]}")
-	
-	return total_time / count
-
-
-def main():
-	if db.last_register_pointer() == (1, 1):
-		print('Loading Data:')
-		for i in range(10):
-			mean = load_data()
-			print(f"Mean time for all insertions: {mean}\n")
-	
-	blocks_list = []
-	times = []
-	SELECTION_TIMES = 10
-
-	print('Selecting All')
-	for i in range(SELECTION_TIMES):
-		start_time = time.time()
-		blocks = db.select()
-		end_time = time.time()
-
-		total = end_time - start_time
-
-		blocks_list.append(blocks)
-		times.append(total)
-	
 
-	for i in range(SELECTION_TIMES):
-		print(f'    {i+1}º Read: {times[i]}s ---- {blocks_list[i]} blocks')
-	
-	print("-------------------------------")
-	print(f'    Mean Time: {sum(times) / len(times)}')
-	print(f'    Mean Accessed Blocks: {sum(blocks_list) / len(blocks_list)}')
+class HeapTest(EngineTest):
+	def checks(self):
+		self.bad_rows()
+		self.columnar_scan()
+		self.parallel_scans()
+		self.compressed_store()
+		self.csv_load()
 
-	print('\n\n')
-	
-
-	ids = [44, 64, 94, 491, 930, 1381, 2084, 3085, 10930, 15939, 35329, 40000]
-	blocks_list = []
-	times = []
-
-	print('Selecting by id')
-	for id in ids:
-		start_time = time.time()
-		blocks = db.select(id=id)
-		end_time = time.time()
 
-		total = end_time - start_time
+	def bad_rows(self):
+		db = self.db
 
-		blocks_list.append(blocks)
-		times.append(total)
-	
+		print('Inserting many with a bad row')
+		serial = db.actual_serial()
+		rows = [(30, 2015, 'Bachelors', 'Pune', 'Male')] * 6 + [('bad', 2015, 'Bachelors', 'Pune', 'Male')]
 
-	for i in range(len(ids)):
-		print(f'    {i+1}º Read: {times[i]}s ---- {blocks_list[i]} blocks')
-	
-	print("-------------------------------")
-	print(f'    Mean Time: {sum(times) / len(times)}')
-	print(f'    Mean Accessed Blocks: {sum(blocks_list) / len(blocks_list)}')
+		try:
+			db.insert_many(rows)
+		except struct.error as error:
+			print(f'    Error: {error}')
 
-	print('\n\n')
+		for i in range(5):
+			db.insert(30, 2015, 'Bachelors', 'Pune', 'Male')
 
+		ids = self.ids()
+		missing = [id for id in range(serial + 1, db.actual_serial() + 1) if not list(db.iter_select(id=id))]
 
-	print('Selecting by ids')
-	ids_set = set(ids)
+		print("-------------------------------")
+		print(f'    Serial: {serial} -> {db.actual_serial()}')
+		print(f'    Duplicated ids: {len(ids) - len(set(ids))} ---- Missing ids: {missing}')
 
-	start_time = time.time()
-	blocks = db.select(id=ids_set)
-	end_time = time.time()
+		assert db.actual_serial() == serial + 11
+		assert len(ids) == len(set(ids)) and not missing
 
-	total = end_time - start_time
-	
-	print("-------------------------------")
-	print(f'    Total Time: {total}')
-	print(f'    Accessed Blocks: {blocks}')
+		print('\n\n')
 
-	print('\n\n')
 
+	def columnar_scan(self):
+		scan = self.db.columnar()
 
-	ids = [44, 64, 94, 491, 930, 1381, 2084, 3085, 10930, 15939, 35329, 40000]
-	blocks_list = []
-	times = []
-
-	print("Deleting series by id:")
-	for i, id in enumerate(ids):
+		print('Scanning columns')
 		start_time = time.time()
-		block = db.delete(id=id)
+		columns, blocks = scan.select(columns=['id'], where=[('year', '>=', 2015), ('city', 'Pune')])
 		end_time = time.time()
 
-		total_time = end_time - start_time
-
-		blocks_list.append(block)
-		times.append(total_time)
-
-		print(f"    Record {i}: {total_time}s --- {block} blocks accessed.")
-	
-	print("-------------------------------")
-	print(f"\n    Deletions by id mean time: {sum(times) / len(times)}")
-	print(f"    Mean accessed blocks: {sum(blocks_list) / len(blocks_list)}")
-
-	print('\n\n')
-
-
-	blocks_list = []
-	times = []
-
-	print('Deleting by year - Many registers erased')
-	year = 2017
+		counts, _ = scan.aggregate('count', group_by='year')
+		ages, _ = scan.aggregate('max', 'age', group_by='year')
 
-	start_time = time.time()
-	blocks = db.delete(year=year)
-	end_time = time.time()
+		years = Counter(self.record(row)['year'] for row in self.db.iter_select())
+		oldest = dict()
 
-	total_time = end_time - start_time
+		for row in self.db.iter_select():
+			record = self.record(row)
+			oldest[record['year']] = max(oldest.get(record['year'], 0), record['age'])
 
-	print("-------------------------------")
-	print(f'    Total Time: {total_time}')
-	print(f'    Accessed Blocks: {blocks}')
+		print("-------------------------------")
+		print(f'    Total Time: {end_time - start_time}')
+		print(f'    Rows: {len(columns["id"])} ---- Accessed Blocks: {blocks}')
 
-	print('\n\n')
+		assert sorted(columns['id'].tolist()) == sorted(self.matching_ids(lambda r: r['year'] >= 2015 and r['city'] == 'Pune'))
+		assert counts == dict(years)
+		assert ages == oldest
 
-	print('Inserting Again')
+		print('\n\n')
 
-	for i in range(4):
-		mean = load_data()
-		print(f"    Mean time: {mean}")
 
+ids = [44, 64, 94, 491, 930, 1381, 2084, 3085, 10930, 15939, 35329, 40000]
 
-main()
+HeapTest(DatabaseHeap(), id_position=1, empty_pointer=(1, 1), select_ids=ids, delete_ids=ids).main()
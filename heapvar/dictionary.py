@@ -0,0 +1,107 @@
+import os
+import struct
+
+from common.bufferpool import BufferPool
+
+
+class StringDictionary:
+    """
+        Codes of the values of the string columns of a table, kept in one
+        page. Column k (starting at 0) gives its values codes 0, 1, 2, ...
+        in the order they are first written, up to MAX_CODES values.
+
+        The page holds the number of entries followed by the entries, each
+        one the column, the length and the utf-8 bytes of a value. The code
+        of a value is its position among the entries of its column.
+
+        A value gets no code once its column has MAX_CODES values, when it
+        is longer than 255 bytes or when the page is full, and records keep
+        it inline. Codes are never taken back, so the dictionary only grows.
+    """
+
+    COUNT     = struct.Struct('=H')
+    ENTRY     = struct.Struct('=B B') # column, length of the value
+    MAX_CODES = 256                   # codes of a column, one byte each
+
+    def __init__(self, filename, columns, block_size = 4096, pool_size = 2 * 4096):
+        self.filename   = filename
+        self.columns    = columns
+        self.block_size = block_size
+
+        if not os.path.exists(filename):
+            open(filename, 'wb').close()
+
+        self.pool = BufferPool(filename, block_size, pool_size)
+        self.load()
+
+
+    def load(self):
+        # values[k][code] is the value of code in column k, codes[k] the opposite
+        self.values = [list() for _ in range(self.columns)]
+        self.codes  = [dict() for _ in range(self.columns)]
+
+        page = self.pool.get(1)
+        end = self.COUNT.size
+
+        for _ in range(self.COUNT.unpack_from(page, 0)[0]):
+            column, length = self.ENTRY.unpack_from(page, end)
+            value = page[end + self.ENTRY.size:end + self.ENTRY.size + length].decode('utf-8')
+
+            self.codes[column][value] = len(self.values[column])
+            self.values[column].append(value)
+            end += self.ENTRY.size + length
+
+        self.end = end # first free byte of the page
+
+
+    def reset(self):
+        """Forgets every value."""
+        self.pool.clear()
+        self.pool.truncate(1)
+        self.load()
+
+
+    def reload(self):
+        """Drops the cached page (the file was changed)."""
+        self.pool.clear()
+        self.load()
+
+
+    def code(self, column, value):
+        """Returns the code of value in column, giving it one if there is room, or None."""
+        code = self.codes[column].get(value)
+
+        if code is not None:
+            return code
+
+        encoded = value.encode('utf-8')
+        needed = self.ENTRY.size + len(encoded)
+
+        if len(self.values[column]) >= self.MAX_CODES or len(encoded) > 255 or self.end + needed > self.block_size:
+            return None
+
+        page = self.pool.get(1)
+        self.ENTRY.pack_into(page, self.end, column, len(encoded))
+        page[self.end + self.ENTRY.size:self.end + needed] = encoded
+        self.COUNT.pack_into(page, 0, self.COUNT.unpack_from(page, 0)[0] + 1)
+        self.pool.mark_dirty(1, page)
+
+        code = len(self.values[column])
+        self.codes[column][value] = code
+        self.values[column].append(value)
+        self.end += needed
+
+        return code
+
+
+    def decode(self, tokens):
+        """Returns the strings of tokens, which are codes (int) or the strings themselves."""
+        return [self.values[k][t] if t.__class__ is int else t for k, t in enumerate(tokens)]
+
+
+    def flush(self):
+        self.pool.flush()
+
+
+    def close(self):
+        self.pool.close()
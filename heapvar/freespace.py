@@ -0,0 +1,94 @@
+import os
+
+from common.bufferpool import BufferPool
+
+
+class FreeSpaceMap:
+    """
+        One byte per data block with the class of its free space: a block of
+        class c has at least c * (block_size // 256) free bytes.
+
+        Block b (starting at 1) is byte (b - 1) % block_size of page
+        (b - 1) // block_size + 1, so one page covers block_size blocks.
+    """
+
+    CLASSES = 256
+
+    def __init__(self, filename, block_size = 4096, pool_size = 256 * 1024):
+        self.filename   = filename
+        self.block_size = block_size
+        self.unit       = block_size // self.CLASSES # free bytes per class
+
+        if not os.path.exists(filename):
+            open(filename, 'wb').close()
+
+        self.pool = BufferPool(filename, block_size, pool_size)
+
+        # translation tables mapping the classes >= c to 1 and the others to 0,
+        # so a page is searched with bytes.find instead of a Python loop
+        self.tables = [
+            bytes(int(k >= c) for k in range(self.CLASSES))
+            for c in range(self.CLASSES)
+        ]
+
+
+    def reset(self):
+        """Forgets every block."""
+        self.pool.clear()
+        self.pool.truncate(1)
+
+
+    def reload(self):
+        """Drops the cached pages (the file was changed)."""
+        self.pool.clear()
+
+
+    def locate(self, block):
+        return (block - 1) // self.block_size + 1, (block - 1) % self.block_size
+
+
+    def free_class(self, free_bytes):
+        return min(self.CLASSES - 1, free_bytes // self.unit)
+
+
+    def get(self, block):
+        """Returns the free bytes of block, rounded down to its class."""
+        page_no, i = self.locate(block)
+        return self.pool.get(page_no)[i] * self.unit
+
+
+    def set(self, block, free_bytes):
+        page_no, i = self.locate(block)
+        page = self.pool.get(page_no)
+        free_class = self.free_class(free_bytes)
+
+        if page[i] != free_class:
+            page[i] = free_class
+            self.pool.mark_dirty(page_no, page)
+
+
+    def find(self, needed, last_block):
+        """Returns the first block up to last_block with needed free bytes, or None."""
+        free_class = -(-needed // self.unit)
+
+        if free_class >= self.CLASSES:
+            return None
+
+        table = self.tables[free_class]
+
+        for page_no in range(1, self.locate(last_block)[0] + 1):
+            i = self.pool.get(page_no).translate(table).find(1)
+
+            if i != -1:
+                block = (page_no - 1) * self.block_size + i + 1
+                return block if block <= last_block else None
+
+        return None
+
+
+    def flush(self):
+        self.pool.flush()
+
+
+    def close(self):
+        self.pool.close()
@@ -1,11 +1,36 @@
 import os
+import sys
+import time
+import atexit
 import struct
+import threading
 from pprint import pprint
 from datetime import datetime
 
+# the modules shared by the engines are in common/, at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.iddirectory import IdDirectory
+from freespace import FreeSpaceMap
+from common.bufferpool import BufferPool
+from common.compression import CompressedStore
+from common.hashindex import HashIndex
+from common.zonemap import ZoneMap
+from dictionary import StringDictionary
+from common.predicate import Predicate
+from common.aggregate import Aggregation
+from common.table import SelectIterator, Table
+from parallel import ParallelScan
+from common.wal import WriteAheadLog
+from common.concurrency import TableLock
+from common.iostats import IOStats
+from common.csvload import read_chunks
+
 class RecordVar:
+    # the first field flags the strings stored as dictionary codes: bit k for string k
     FIXED_RECORD      = f'=H H H H I I I'
     FIXED_RECORD_SIZE = struct.calcsize(FIXED_RECORD)
+    ALL_CODED         = 0b111
 
     def __init__(
         self, 
@@ -15,10 +40,14 @@ class RecordVar:
         education: str, 
         city: str, 
         gender: str,
+        codes: tuple = (None, None, None),
     ):  
-        self.encode1 = education.encode('utf-8')
-        self.encode2 = city.encode('utf-8')
-        self.encode3 = gender.encode('utf-8')
+        # a string with a code is stored as one byte
+        self.encode1, self.encode2, self.encode3 = [
+            bytes((code,)) if code is not None else string.encode('utf-8')
+            for code, string in zip(codes, (education, city, gender))
+        ]
+        self.flags = sum(1 << k for k, code in enumerate(codes) if code is not None)
 
         self.offset1 = self.FIXED_RECORD_SIZE + len(self.encode1)
         self.offset2 = self.FIXED_RECORD_SIZE + len(self.encode1) + len(self.encode2)
@@ -36,7 +65,7 @@ class RecordVar:
         return struct.pack(
             self.FIXED_RECORD + f'{len(self.encode1)}s {len(self.encode2)}s {len(self.encode3)}s',
             # -------------------------------------------------------------------------------- #
-            0,
+            self.flags,
             self.offset1, self.offset2, self.offset3,
             self.id,
             self.age,
@@ -47,33 +76,244 @@ class RecordVar:
         )
 
 
-class DatabaseVar:
+class DatabaseVar(Table):
     """
         BLOCK SIZE            H      4096
         Header Size           H      204
-        Pt Last Register      I      (BLOCK, START BYTE)
+        Pt Last Register      I      (BLOCK, SLOT) of the last record appended
         NEXT SERIAL           I      Starts in 1
         Table Name:           64s    employee
         Timestamp created:    64s
         Timestamp updated:    64s    
+
+        Blocks are slotted pages. A page header (right after the file header
+        in block 1) is followed by the records, growing forward, while the
+        slot directory grows backward from the end of the block. Slot s
+        (starting at 1) is at BLOCK_SIZE - s * SLOT_SIZE and holds the offset
+        and length of its record; a length of 0 marks a free slot. Records
+        are addressed by (block, slot), which stays valid when the page is
+        compacted.
+
+        Strings found in the dictionary of the table are stored as one byte
+        codes, and the rest inline, see StringDictionary. The dictionary is
+        part of the table: unlike the indexes it cannot be rebuilt from the
+        records.
+
+        The free space map keeps the free space of every block, so new
+        records fill the space left by deleted ones before the file grows.
+
+        Once the deleted bytes reach COMPACTION_THRESHOLD the file is
+        compacted a few blocks at a time, after each insert and delete: the
+        records of the last block move to the free space of earlier blocks
+        and the emptied block is cut from the file. See compact_step().
+
+        With compressed=True every block but the first is kept compressed in
+        the file and decompressed in the buffer pool, see CompressedStore.
+
+        Every change is written to the write-ahead log before the files, and
+        the log is synced once per group commit instead of once per record.
+        See WriteAheadLog.
     """
     
     FILENAME       = 'heapvar.bin'
+    ID_INDEX       = 'heapvar.id.dir'
+    YEAR_INDEX     = 'heapvar.year.idx'
+    FREE_SPACE_MAP = 'heapvar.fsm'
+    ZONE_MAP       = 'heapvar.zone'
+    DICTIONARY     = 'heapvar.dict'
+    BLOCK_DIRECTORY = 'heapvar.blocks'
+    WAL_FILE       = 'heapvar.wal'
+    LOCK_FILE      = 'heapvar.lock'
     BLOCK_SIZE     = 4096
     HEADER_STRUCT  = f'=H H H I I 64s 64s 64s'
     HEADER_SIZE    = struct.calcsize(HEADER_STRUCT)
+    PAGE_HEADER    = f'=H H H H H' # slots, live records, dead bytes, free space start, free space end
+    PAGE_HEADER_SIZE = struct.calcsize(PAGE_HEADER)
+    SLOT_STRUCT    = f'=H H'     # record offset, record length
+    SLOT_SIZE      = struct.calcsize(SLOT_STRUCT)
     TABLE_NAME     = 'employee'
 
+    # where= columns: (fixed fields 'r' or strings 's', position, string width)
+    COLUMNS = {
+        'id':        ('r', 4, None),
+        'age':       ('r', 5, None),
+        'year':      ('r', 6, None),
+        'education': ('s', 0, None),
+        'city':      ('s', 1, None),
+        'gender':    ('s', 2, None),
+    }
+
+    HEADER_FLUSH_INTERVAL = 1000 # header updates kept in memory before writing
+    BUFFER_POOL_SIZE      = 4 * 1024 * 1024 # bytes of blocks kept in memory
+    INDEX_POOL_SIZE       = 1024 * 1024     # bytes of index pages kept in memory
+    COMMIT_INTERVAL       = 0.05            # seconds between group commits of the log
+    CHECKPOINT_SIZE       = 16 * 1024 * 1024 # bytes of log that start a checkpoint
+    LOAD_CHUNK_ROWS       = 4096            # CSV rows parsed and appended at a time by load_csv()
+
+    COMPACTION_THRESHOLD     = 2 ** 16 - 1 # deleted bytes that start a compaction
+    COMPACTION_STEP_BLOCKS   = 1           # blocks released by each compaction step
+    COMPACTION_STEP_SECONDS  = 0.005       # time budget of each compaction step
+
+
+    def __init__(
+        self,
+        header_flush_interval: int | None = None,
+        buffer_pool_size: int | None = None,
+        year_index: bool | None = None,
+        wal: bool = True,
+        commit_interval: float | None = None,
+        shared: bool = False,
+        block_latches: bool = False,
+        compressed: bool | None = None,
+        trace=None,
+    ):
+        # I/O counters and latencies of the operations, see stats(). trace is
+        # called with a dict for every operation and query, see IOStats.
+        self.io: IOStats = IOStats(trace)
+
+        # Many readers or one writer at a time, see TableLock. With shared the
+        # lock is also taken on LOCK_FILE, for other processes using the table.
+        # With block_latches inserts run along with sequential scans.
+        self.lock: TableLock = TableLock(self.LOCK_FILE if shared else None)
+        self.block_latches: bool = block_latches
+        self.flush_latch: threading.RLock = threading.RLock()
+        self.lock.acquire('write')
+
+        # worker processes of parallel scans, started by the first one
+        self.parallel_scan: ParallelScan | None = None
+
+        # The header is parsed once and kept in memory. Changes are written back
+        # by flush(), on exit, or after HEADER_FLUSH_INTERVAL header updates.
+        self.header: list | None = None
+        self.header_dirty: bool = False
+        self.pending_header_writes: int = 0
+        self.header_flush_interval: int = header_flush_interval if header_flush_interval is not None else self.HEADER_FLUSH_INTERVAL
+
+        # Changes go to the write-ahead log first, synced once per group commit:
+        # after an operation, when COMMIT_INTERVAL has passed since the last one,
+        # or by the committer thread once it passed after the last operation.
+        # A log left by a crash is redone before anything else is read.
+        self.wal: WriteAheadLog | None = WriteAheadLog(
+            self.WAL_FILE,
+            {
+                0: self.FILENAME, 1: self.ID_INDEX, 2: self.YEAR_INDEX,
+                3: self.FREE_SPACE_MAP, 4: self.ZONE_MAP, 5: self.DICTIONARY,
+                6: self.BLOCK_DIRECTORY,
+            },
+            commit_interval if commit_interval is not None else self.COMMIT_INTERVAL,
+            self.CHECKPOINT_SIZE,
+        )
+        CompressedStore.recover_conversion(self.FILENAME, self.BLOCK_DIRECTORY)
+        self.wal.recover()
+
+        if not wal:
+            self.wal.close()
+            os.remove(self.WAL_FILE)
+            self.wal = None
+
+        new_table: bool = not os.path.exists(self.FILENAME)
 
-    def __init__(self):
-        if not os.path.exists(self.FILENAME):
+        if new_table:
             self.create_file()
+
+        # Blocks compressed with zlib, but for block 1 which holds the header,
+        # see CompressedStore. None keeps the file as it is, True compresses
+        # a plain file and False decompresses it.
+        self.compressed: bool = os.path.exists(self.BLOCK_DIRECTORY)
+
+        if compressed and not self.compressed:
+            CompressedStore.compress_file(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, raw_blocks=1)
+        elif compressed is False and self.compressed:
+            CompressedStore.decompress_file(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, raw_blocks=1)
+
+        self.compressed = compressed if compressed is not None else self.compressed
+        store: CompressedStore | None = None
+
+        if self.compressed:
+            store = CompressedStore(self.FILENAME, self.BLOCK_DIRECTORY, self.BLOCK_SIZE, raw_blocks=1)
+
+        self.pool: BufferPool = BufferPool(
+            self.FILENAME, self.BLOCK_SIZE, buffer_pool_size or self.BUFFER_POOL_SIZE,
+            latches=block_latches, store=store,
+        )
+
+        # codes of the strings, one dictionary per string column
+        self.dictionary: StringDictionary = StringDictionary(self.DICTIONARY, 3, self.BLOCK_SIZE)
+
+        if new_table:
+            self.dictionary.reset()
+
+        # primary key index: id -> punned pointer (block, slot), one entry per serial
+        build_id_index: bool = not os.path.exists(self.ID_INDEX)
+        self.id_index: IdDirectory = IdDirectory(self.ID_INDEX, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+        if build_id_index:
+            self.build_id_index()
+
+        build_free_space_map: bool = not os.path.exists(self.FREE_SPACE_MAP)
+        self.fsm: FreeSpaceMap = FreeSpaceMap(self.FREE_SPACE_MAP, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+        if build_free_space_map:
+            self.build_free_space_map()
+
+        # min/max id, year and age and live records of every block
+        build_zone_map: bool = not os.path.exists(self.ZONE_MAP)
+        self.zones: ZoneMap = ZoneMap(self.ZONE_MAP, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+        if build_zone_map:
+            self.build_zone_map()
+
+        # optional secondary index: year -> posting list of punned pointers.
+        # None keeps the index only if its file exists, False drops it.
+        self.year_index: HashIndex | None = None
+
+        if year_index is False and os.path.exists(self.YEAR_INDEX):
+            os.remove(self.YEAR_INDEX)
+
+        elif year_index or (year_index is None and os.path.exists(self.YEAR_INDEX)):
+            build_year_index: bool = not os.path.exists(self.YEAR_INDEX)
+            self.year_index = HashIndex(self.YEAR_INDEX, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+            if build_year_index:
+                self.build_year_index()
+
+        if self.wal is not None:
+            self.wal.attach(0, self.pool)
+            self.wal.attach(1, self.id_index.pool)
+            self.wal.attach(3, self.fsm.pool)
+            self.wal.attach(4, self.zones.pool)
+            self.wal.attach(5, self.dictionary.pool)
+
+            if self.compressed:
+                self.wal.attach(6, self.pool.store.directory)
+
+            if self.year_index is not None:
+                self.wal.attach(2, self.year_index.pool)
+
+            self.io.attach(self.wal)
+
+        for pool in self.pools().values():
+            self.io.attach(pool)
+
+        # a compaction interrupted by a crash or exit is resumed
+        self.compacting: bool = False
+        self.compaction: dict = dict()
+
+        if self.deleted_bytes() >= self.COMPACTION_THRESHOLD:
+            self.start_compaction()
+
+        self.lock.changed = self.reload
+        self.lock.publish = self.flush
+        self.lock.release()
+
+        self.start_committer()
+        atexit.register(self.close)
     
 
     def create_file(self):
         """Creates a new file with a header."""
         with open(self.FILENAME, 'wb') as f:
-            pt_last_register  = self.pointer(1, self.HEADER_SIZE)
+            pt_last_register  = self.pointer(1, 0)
             table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
             timestamp_created = str(datetime.now()).ljust(64, '\x00')[:64]
             timestamp_updated = timestamp_created
@@ -94,17 +334,111 @@ class DatabaseVar:
                 # ---------------------------------- #
             )
 
+            header_block = bytearray(header_block)
+            self.init_page(1, header_block)
+
             f.write(header_block)
+
+        self.header = None
+        self.header_dirty = False
+        self.pending_header_writes = 0
     
 
-    def write_block(self):
-        with open(self.FILENAME, 'ab+') as f:
-            block = struct.pack(
-                f'{self.BLOCK_SIZE}s',
-                ''.ljust(self.BLOCK_SIZE, '\x00')[:(self.BLOCK_SIZE)].encode('utf-8')
-            )
+    def write_block(self, block: int) -> bytearray:
+        # new blocks only exist in the buffer pool until they are written back
+        page = self.pool.new_block(block)
+        self.init_page(block, page)
+
+        return page
+
 
-            f.write(block)
+    def write_bytes(self, pointer: tuple, data: bytes):
+        """Writes data at pointer (block, start byte)."""
+        with self.pool.latch(pointer[0]):
+            page = self.pool.get(pointer[0])
+            page[pointer[1]:pointer[1] + len(data)] = data
+            self.pool.mark_dirty(pointer[0], page)
+
+
+    def page_base(self, block: int) -> int:
+        # block 1 starts with the file header
+        return self.HEADER_SIZE if block == 1 else 0
+
+
+    def init_page(self, block: int, page: bytearray):
+        base = self.page_base(block)
+        struct.pack_into(self.PAGE_HEADER, page, base, 0, 0, 0, base + self.PAGE_HEADER_SIZE, self.BLOCK_SIZE)
+
+
+    def read_slot(self, page: bytearray, slot: int) -> tuple:
+        return struct.unpack_from(self.SLOT_STRUCT, page, self.BLOCK_SIZE - slot * self.SLOT_SIZE)
+
+
+    def place_record(self, block: int, page: bytearray, data: bytes) -> int | None:
+        """Stores data in the page, returning its slot or None if it does not fit."""
+        base = self.page_base(block)
+        slots, live, dead, free_start, free_end = struct.unpack_from(self.PAGE_HEADER, page, base)
+
+        # a free slot is reused before the directory grows
+        slot = slots + 1
+        if live < slots:
+            slot = next(s for s in range(1, slots + 1) if self.read_slot(page, s)[1] == 0)
+
+        needed = len(data) + (self.SLOT_SIZE if slot > slots else 0)
+
+        if free_end - free_start < needed:
+            if self.free_space(block, page) < needed:
+                return None
+
+            free_start = self.compact_page(block, page)
+            dead = 0
+
+        page[free_start:free_start + len(data)] = data
+        struct.pack_into(self.SLOT_STRUCT, page, self.BLOCK_SIZE - slot * self.SLOT_SIZE, free_start, len(data))
+
+        if slot > slots:
+            slots += 1
+            free_end -= self.SLOT_SIZE
+
+        struct.pack_into(self.PAGE_HEADER, page, base, slots, live + 1, dead, free_start + len(data), free_end)
+        self.pool.mark_dirty(block, page)
+        self.fsm.set(block, free_end - free_start - len(data) + dead)
+
+        return slot
+
+
+    def free_space(self, block: int, page: bytearray) -> int:
+        """Bytes available in the page once it is compacted."""
+        slots, live, dead, free_start, free_end = struct.unpack_from(self.PAGE_HEADER, page, self.page_base(block))
+
+        return free_end - free_start + dead
+
+
+    def dead_bytes(self, block: int, page: bytearray) -> int:
+        return struct.unpack_from('=H', page, self.page_base(block) + 4)[0]
+
+
+    def compact_page(self, block: int, page: bytearray) -> int:
+        """Moves the live records to the start of the page, returning the new free space start."""
+        base = self.page_base(block)
+        slots, live, dead, free_start, free_end = struct.unpack_from(self.PAGE_HEADER, page, base)
+
+        records = sorted(
+            (self.read_slot(page, s), s) for s in range(1, slots + 1)
+            if self.read_slot(page, s)[1] != 0
+        )
+
+        # records only move towards the start, so they never overwrite each other
+        free_start = base + self.PAGE_HEADER_SIZE
+        for (offset, length), slot in records:
+            page[free_start:free_start + length] = page[offset:offset + length]
+            struct.pack_into(self.SLOT_STRUCT, page, self.BLOCK_SIZE - slot * self.SLOT_SIZE, free_start, length)
+            free_start += length
+
+        struct.pack_into(self.PAGE_HEADER, page, base, slots, live, 0, free_start, free_end)
+        self.pool.mark_dirty(block, page)
+
+        return free_start
     
 
     def write_record(
@@ -115,326 +449,699 @@ class DatabaseVar:
         city: str, 
         gender: str,
     ):
-        next_id: int            = self.actual_serial() + 1
-        last_pointer: tuple     = self.last_register_pointer()
-        record: RecordVar       = RecordVar(next_id, age, year, education, city, gender)
-        record_size: int        = record.offset3
-        record_too_bigger: bool = record_size >= self.distance_end_of_block(last_pointer)
-        
-        if record_too_bigger:
-            self.write_block()
-        
-        next_last_pointer = self.next_pointer(last_pointer, record_size)
-        written_data      = record.mount_struct()
-        written_offset    = self.calculate_offset(last_pointer)
+        next_id: int       = self.actual_serial() + 1
+        last_block: int    = self.last_register_pointer()[0]
+        codes: tuple       = tuple(self.dictionary.code(k, string) for k, string in enumerate((education, city, gender)))
+        record: RecordVar  = RecordVar(next_id, age, year, education, city, gender, codes)
+        written_data       = record.mount_struct()
+
+        if len(written_data) + self.SLOT_SIZE > self.BLOCK_SIZE - self.HEADER_SIZE - self.PAGE_HEADER_SIZE:
+            raise ValueError("RECORD TOO BIG FOR A BLOCK")
+
+        # the first block with room for the record and a new slot, or a new block
+        block = self.fsm.find(len(written_data) + self.SLOT_SIZE, last_block)
+
+        # scans may copy the block meanwhile, see scan_records()
+        with self.pool.latch(block if block is not None else last_block + 1):
+            if block is None:
+                block = last_block + 1
+                page = self.write_block(block)
+            else:
+                page = self.pool.get(block)
+
+            dead = self.dead_bytes(block, page)
+            slot = self.place_record(block, page, written_data)
+            reclaimed = dead - self.dead_bytes(block, page)
+
+        self.index_record((block, slot), next_id, year, age)
+
+        self.write_header(
+            last_pointer=(block, slot) if block >= last_block else None,
+            new_serial=next_id,
+            deleted_bytes=-reclaimed if reclaimed != 0 else None,
+        )
+    
 
-        with open(self.FILENAME, 'rb+') as f:
-            f.seek(written_offset)
-            f.write(written_data)
+    def append_records(self, rows: list, last_pointer: tuple, serial: int, index: bool = True) -> tuple:
+        """
+            Appends rows after the last record, filling the free space at the
+            end of its block and then new blocks, a block at a time. Returns
+            the new last_pointer and serial.
 
-        self.write_header(last_pointer=next_last_pointer, new_serial=next_id)
-    
+            The header is left to the caller. Without index the records are
+            not added to the indexes and the zone map, which have to be rebuilt.
+        """
+        code    = self.dictionary.code
+        fixed   = struct.Struct(RecordVar.FIXED_RECORD)
+        strings = dict() # (education, city, gender) -> flags, string offsets and bytes, as RecordVar has them
+        records = list()
 
-    def compare(self, dt1, dt2) -> bool:
-        if type(dt2) == str or type(dt2) == int:
-            return dt1 == dt2
+        for id, (age, year, education, city, gender) in enumerate(rows, serial + 1):
+            encoded = strings.get((education, city, gender))
 
-        elif type(dt2) == set:
-            return dt1 in dt2
+            if encoded is None:
+                codes = (code(0, education), code(1, city), code(2, gender))
+                record = RecordVar(id, age, year, education, city, gender, codes)
 
-        return False
-    
+                if len(record.mount_struct()) + self.SLOT_SIZE > self.BLOCK_SIZE - self.HEADER_SIZE - self.PAGE_HEADER_SIZE:
+                    raise ValueError("RECORD TOO BIG FOR A BLOCK")
 
-    def delete_by_id(self, id: int) -> int:
-        pointer = (1, self.HEADER_SIZE)
-        last_pointer  = self.last_register_pointer()
-        deleted_struct_size = 0
+                encoded = strings[(education, city, gender)] = (
+                    record.flags, record.offset1, record.offset2, record.offset3, record.encode1 + record.encode2 + record.encode3,
+                )
 
-        accessed_blocks = 1
+            flags, offset1, offset2, offset3, tail = encoded
+            records.append(fixed.pack(flags, offset1, offset2, offset3, id, age, year) + tail)
 
-        with open(self.FILENAME, 'rb+') as f:
-            while pointer != last_pointer:
-                f.seek(self.calculate_offset(pointer))
+        block, i = last_pointer[0], 0
+        page = self.pool.get(block)
 
-                start = f.read(RecordVar.FIXED_RECORD_SIZE)
-                unpack_start = struct.unpack(
-                    RecordVar.FIXED_RECORD,
-                    start,
-                )
+        while True:
+            base = self.page_base(block)
+            slots, live, dead, free_start, free_end = struct.unpack_from(self.PAGE_HEADER, page, base)
+
+            # records forward from free_start, their new slots backward from free_end
+            n, offsets, end = 0, list(), free_start
+            while i + n < len(records) and end + len(records[i + n]) <= free_end - (n + 1) * self.SLOT_SIZE:
+                offsets.append(end)
+                end += len(records[i + n])
+                n += 1
+
+            if n > 0:
+                chunk = records[i:i + n]
+                page[free_start:end] = b''.join(chunk)
+
+                directory = [v for k in range(n - 1, -1, -1) for v in (offsets[k], len(chunk[k]))]
+                struct.pack_into(f'={2 * n}H', page, free_end - n * self.SLOT_SIZE, *directory)
+                struct.pack_into(self.PAGE_HEADER, page, base, slots + n, live + n, dead, end, free_end - n * self.SLOT_SIZE)
+
+                self.pool.mark_dirty(block, page)
+                self.fsm.set(block, free_end - n * self.SLOT_SIZE - end + dead)
 
-                offset3 = unpack_start[3]
+                if index:
+                    pointers = [v for slot in range(slots + 1, slots + n + 1) for v in (block, slot)]
+                    punned = struct.unpack(f'{n}I', struct.pack(f'{2 * n}H', *pointers))
+                    ids = range(serial + i + 1, serial + i + n + 1)
 
-                if unpack_start[0] == 1 or not unpack_start[4] == id:
-                    next_pointer = self.next_pointer(pointer, offset3)
-                    if next_pointer[0] > pointer[0]:
-                        accessed_blocks += 1
-                    pointer = next_pointer
+                    self.id_index.insert_many(serial + i + 1, punned)
+                    self.zones.add_many(block, ids, [row[1] for row in rows[i:i + n]], [row[0] for row in rows[i:i + n]])
 
+                    if self.year_index is not None:
+                        for row, value in zip(rows[i:i + n], punned):
+                            self.year_index.add(row[1], value)
+
+                last_pointer = (block, slots + n)
+                i += n
+
+            if i == len(records):
+                return last_pointer, serial + len(records)
+
+            block += 1
+            page = self.write_block(block)
+
+
+    def scan_records(self, stats: SelectIterator | None = None, blocks=None):
+        """
+            Yields (pointer, page, fixed fields) for every live record, from
+            the first block up to the last one, or of the given blocks. The
+            pointer is (block, slot) and page is its block. Blocks read are
+            counted in stats.
+
+            With block latches page is a copy of the block, taken under its
+            latch, as inserts may be changing it.
+        """
+        blocks = blocks if blocks is not None else range(1, self.last_register_pointer()[0] + 1)
+
+        for block in blocks:
+            if self.block_latches:
+                with self.pool.latch(block):
+                    page = bytes(self.pool.get(block))
+            else:
+                page = self.pool.get(block)
+
+            if stats is not None:
+                stats.accessed_blocks += 1
+
+            slots = struct.unpack_from('=H', page, self.page_base(block))[0]
+
+            for slot in range(1, slots + 1):
+                offset, length = self.read_slot(page, slot)
+
+                if length == 0:
                     continue
 
-                THIS_DELETED_STRUCT = RecordVar.FIXED_RECORD + f'{offset3 - RecordVar.FIXED_RECORD_SIZE}s'
+                yield (block, slot), page, struct.unpack_from(RecordVar.FIXED_RECORD, page, offset)
 
-                f.seek(self.calculate_offset(pointer))
 
-                deleted_buffer = struct.pack(
-                    THIS_DELETED_STRUCT,
-                    1,
-                    unpack_start[1],
-                    unpack_start[2],
-                    unpack_start[3],
-                    0,
-                    0,
-                    0,
-                    ''.ljust(offset3 - RecordVar.FIXED_RECORD_SIZE, '\x00')[:(offset3 - RecordVar.FIXED_RECORD_SIZE)].encode('utf-8')
-                )
+    def blocks_to_scan(self, predicate: Predicate | None, stats: SelectIterator):
+        # the blocks the zone map cannot rule out for predicate
+        bounds = self.zones.bounds(predicate)
+
+        for block in range(1, self.last_register_pointer()[0] + 1):
+            if self.zones.may_match(block, bounds):
+                yield block
+            else:
+                stats.skipped_blocks += 1
+
+
+    def read_var_tokens(self, pointer: tuple, page: bytearray, unpack_start: tuple) -> list:
+        """Returns the strings of the record as tokens: their codes, or the decoded strings kept inline."""
+        return self.tokens_at(page, self.read_slot(page, pointer[1])[0], unpack_start)
+
+
+    def tokens_at(self, page: bytearray, start: int, unpack_start: tuple) -> list:
+        # tokens of the record starting at start, see read_var_tokens()
+        flags = unpack_start[0]
+
+        if flags == RecordVar.ALL_CODED:
+            start += RecordVar.FIXED_RECORD_SIZE
+            return [page[start], page[start + 1], page[start + 2]]
+
+        # the offsets are the ends of the strings, from the start of the record
+        ends = (RecordVar.FIXED_RECORD_SIZE, *unpack_start[1:4])
+
+        return [
+            page[start + ends[k]] if flags >> k & 1 else page[start + ends[k]:start + ends[k + 1]].decode('utf-8')
+            for k in range(3)
+        ]
+
+
+    def read_var_fields(self, pointer: tuple, page: bytearray, unpack_start: tuple) -> list:
+        if unpack_start[0] == RecordVar.ALL_CODED:
+            start = self.read_slot(page, pointer[1])[0] + RecordVar.FIXED_RECORD_SIZE
+            values = self.dictionary.values
+
+            return [values[0][page[start]], values[1][page[start + 1]], values[2][page[start + 2]]]
+
+        return self.dictionary.decode(self.read_var_tokens(pointer, page, unpack_start))
+
+
+    def read_record(self, pointer: tuple) -> tuple:
+        """Returns (page, fixed fields) of the record at pointer, or (page, None) for a free slot."""
+        page = self.pool.get(pointer[0])
+        slots = struct.unpack_from('=H', page, self.page_base(pointer[0]))[0]
+
+        if pointer[1] > slots:
+            return page, None
+
+        offset, length = self.read_slot(page, pointer[1])
+
+        if length == 0:
+            return page, None
+
+        return page, struct.unpack_from(RecordVar.FIXED_RECORD, page, offset)
+
+
+    def build_id_index(self):
+        """(Re)builds the id index from the records in the file."""
+        self.id_index.reset()
+
+        for pointer, page, unpack_start in self.scan_records():
+            self.id_index.insert(unpack_start[4], self.punn(self.pointer(*pointer)))
+
+        self.id_index.flush()
+
+
+    def build_free_space_map(self):
+        """(Re)builds the free space map from the page headers."""
+        self.fsm.reset()
+
+        for block in range(1, self.last_register_pointer()[0] + 1):
+            self.fsm.set(block, self.free_space(block, self.pool.get(block)))
+
+        self.fsm.flush()
+
+
+    def build_zone_map(self):
+        """(Re)builds the zone map from the records in the file."""
+        self.zones.reset()
+
+        for pointer, page, unpack_start in self.scan_records():
+            self.zones.add(pointer[0], unpack_start[4], unpack_start[6], unpack_start[5])
+
+        self.zones.flush()
 
-                f.write(deleted_buffer)
 
-                deleted_struct_size = struct.calcsize(THIS_DELETED_STRUCT)
+    def build_year_index(self):
+        """(Re)builds the year index from the records in the file."""
+        self.year_index.reset()
+
+        for pointer, page, unpack_start in self.scan_records():
+            self.year_index.add(unpack_start[6], self.punn(self.pointer(*pointer)))
+
+        self.year_index.flush()
+
+
+    def index_record(self, pointer: tuple, id: int, year: int, age: int):
+        # adds a record just written at pointer to the indexes and zone map
+        punned = self.punn(self.pointer(*pointer))
+        self.id_index.insert(id, punned)
+        self.zones.add(pointer[0], id, year, age)
+
+        if self.year_index is not None:
+            self.year_index.add(year, punned)
+
+
+    def delete_record(self, pointer: tuple, unpack_start: tuple) -> int:
+        """Frees the slot of the record; its bytes are reclaimed by compact_page()."""
+        block, slot = pointer
+        page = self.pool.get(block)
+        base = self.page_base(block)
+
+        length = self.read_slot(page, slot)[1]
+        struct.pack_into(self.SLOT_STRUCT, page, self.BLOCK_SIZE - slot * self.SLOT_SIZE, 0, 0)
+
+        slots, live, dead, free_start, free_end = struct.unpack_from(self.PAGE_HEADER, page, base)
+        struct.pack_into(self.PAGE_HEADER, page, base, slots, live - 1, dead + length, free_start, free_end)
+
+        self.pool.mark_dirty(block, page)
+        self.fsm.set(block, free_end - free_start + dead + length)
+        self.zones.remove(block)
+
+        return length
     
-                break
+
+    def delete_by_id(self, id: int) -> int:
+        deleted_struct_size = 0
+        accessed_blocks = self.id_index.height
+        value = self.id_index.search(id)
+
+        if value is not None:
+            pointer = self.deref(value)
+            page, unpack_start = self.read_record(pointer)
+            accessed_blocks += 1
+
+            if unpack_start is not None and unpack_start[4] == id:
+                deleted_struct_size = self.delete_record(pointer, unpack_start)
+                self.id_index.delete(id)
+
+                if self.year_index is not None:
+                    self.year_index.remove(unpack_start[6], value)
         
         if deleted_struct_size != 0:
-            compressed, blocks = self.write_header(deleted_bytes=deleted_struct_size)
-
-            if compressed == 1:
-                accessed_blocks += self.last_register_pointer()[0] + blocks
+            self.write_header(deleted_bytes=deleted_struct_size)
     
         return accessed_blocks
 
 
     def delete_by_year(self, year: int) -> int:
-        pointer = (1, self.HEADER_SIZE)
-        last_pointer  = self.last_register_pointer()
-        deleted_struct_size = 0
-        accessed_blocks = 1
+        if self.year_index is not None:
+            return self.delete_by_year_index(year)
 
-        with open(self.FILENAME, 'rb+') as f:
-            while pointer != last_pointer:
-                f.seek(self.calculate_offset(pointer))
+        deleted_struct_size = 0
+        accessed_blocks = self.last_register_pointer()[0]
 
-                start = f.read(RecordVar.FIXED_RECORD_SIZE)
-                unpack_start = struct.unpack(
-                    RecordVar.FIXED_RECORD,
-                    start,
-                )
+        for pointer, page, unpack_start in self.scan_records():
+            if not unpack_start[6] == year:
+                continue
 
-                offset3 = unpack_start[3]
+            deleted_struct_size += self.delete_record(pointer, unpack_start)
+            self.id_index.delete(unpack_start[4])
+        
+        if deleted_struct_size != 0:
+            self.write_header(deleted_bytes=deleted_struct_size)
+    
+        return accessed_blocks
 
-                if unpack_start[0] == 1 or not unpack_start[6] == year:
-                    next_pointer = self.next_pointer(pointer, offset3)
-                    if next_pointer[0] > pointer[0]:
-                        accessed_blocks += 1
-                    pointer = next_pointer
 
-                    continue
+    def delete_by_year_index(self, year: int) -> int:
+        values, accessed_blocks = self.year_index.lookup(year)
+        deleted_struct_size = 0
+        data_blocks = set()
 
-                THIS_DELETED_STRUCT = RecordVar.FIXED_RECORD + f'{offset3 - RecordVar.FIXED_RECORD_SIZE}s'
+        for pointer in sorted(map(self.deref, values)):
+            page, unpack_start = self.read_record(pointer)
+            data_blocks.add(pointer[0])
 
-                f.seek(self.calculate_offset(pointer))
+            if unpack_start is None or unpack_start[6] != year:
+                continue
 
-                deleted_buffer = struct.pack(
-                    THIS_DELETED_STRUCT,
-                    1,
-                    unpack_start[1],
-                    unpack_start[2],
-                    unpack_start[3],
-                    0,
-                    0,
-                    0,
-                    ''.ljust(offset3 - RecordVar.FIXED_RECORD_SIZE, '\x00')[:(offset3 - RecordVar.FIXED_RECORD_SIZE)].encode('utf-8')
-                )
+            deleted_struct_size += self.delete_record(pointer, unpack_start)
+            self.id_index.delete(unpack_start[4])
 
-                f.write(deleted_buffer)
+        self.year_index.drop(year)
+        accessed_blocks += len(data_blocks)
 
-                deleted_struct_size += struct.calcsize(THIS_DELETED_STRUCT)
-    
-        
         if deleted_struct_size != 0:
-            compressed, blocks = self.write_header(deleted_bytes=deleted_struct_size)
+            self.write_header(deleted_bytes=deleted_struct_size)
 
-            if compressed == 1:
-                accessed_blocks += self.last_register_pointer()[0] + blocks
-    
         return accessed_blocks
+
+
+    def delete_where(self, predicate: Predicate) -> int:
+        candidates = SelectIterator(self.where_candidates, predicate)
+        deleted_struct_size = 0
+        year_values: dict = dict()
+
+        for pointer, page, unpack_start, tokens in candidates:
+            deleted_struct_size += self.delete_record(pointer, unpack_start)
+            self.id_index.delete(unpack_start[4])
+            year_values.setdefault(unpack_start[6], set()).add(self.punn(self.pointer(*pointer)))
+
+        # one pass over the posting list of every year
+        if self.year_index is not None:
+            for year, values in year_values.items():
+                self.year_index.remove_many(year, values)
+
+        if deleted_struct_size != 0:
+            self.write_header(deleted_bytes=deleted_struct_size)
+
+        return candidates.accessed_blocks
     
 
-    def read_by_id(self, id: int | set):
-        pointer = (1, self.HEADER_SIZE)
-        last_pointer  = self.last_register_pointer()
-        accessed_blocks = 1
+    def iter_by_id(self, id: int | set, stats: SelectIterator):
+        # index lookups: accessed blocks are the index pages plus the data blocks
+        ids = sorted(id) if type(id) == set else [id]
+        data_blocks = set()
 
-        table = list()
+        for key in ids:
+            stats.accessed_blocks += self.id_index.height
+            value = self.id_index.search(key)
 
-        with open(self.FILENAME, 'rb') as f:
-            while pointer != last_pointer:
-                f.seek(self.calculate_offset(pointer))
+            if value is None:
+                continue
 
-                start = f.read(RecordVar.FIXED_RECORD_SIZE)
-                unpack_start = struct.unpack(
-                    RecordVar.FIXED_RECORD,
-                    start,
-                )
+            pointer = self.deref(value)
+            page, unpack_start = self.read_record(pointer)
 
-                offset1 = unpack_start[1]
-                offset2 = unpack_start[2]
-                offset3 = unpack_start[3]
-                
-                next_pointer = self.next_pointer(pointer, offset3)
-                if next_pointer[0] > pointer[0]:
-                    accessed_blocks += 1
-                pointer = next_pointer
+            if pointer[0] not in data_blocks:
+                data_blocks.add(pointer[0])
+                stats.accessed_blocks += 1
 
-                if unpack_start[0] == 1 or not self.compare(unpack_start[4], id):
-                    continue
+            if unpack_start is None or unpack_start[4] != key:
+                continue
 
-                VAR_RECORD = self.var_struct(offset1, offset2, offset3)
-                VAR_SIZE   = struct.calcsize(VAR_RECORD)
+            readable_end = self.read_var_fields(pointer, page, unpack_start)
 
-                end = f.read(VAR_SIZE)
-                unpack_end = struct.unpack(VAR_RECORD, end)
+            yield [*unpack_start[4:], *readable_end]
 
-                readable_end = list(map(lambda word: word.decode('utf-8'), unpack_end))
 
-                table.append([*unpack_start[4:], *readable_end])
+    def iter_by_year(self, year: int | set, stats: SelectIterator):
+        yield from self.iter_where(self.predicate(year=year), stats)
 
-                if type(id) == int:
-                    break
-                else:
-                    id.remove(unpack_start[4])
-                
-                if type(id) == set and len(id) == 0:
-                    break
-        
-        return (table, accessed_blocks)
 
+    def predicate(self, where=None, id=None, year=None) -> Predicate:
+        # id and year are conditions too, so they can be combined with where
+        conditions = list(where.items()) if type(where) == dict else list(where or ())
 
-    def read_by_year(self, year: int):
-        pointer = (1, self.HEADER_SIZE)
-        last_pointer  = self.last_register_pointer()
-        accessed_blocks = 1
+        if id is not None:
+            conditions.append(('id', id))
+        if year is not None:
+            conditions.append(('year', year))
 
-        table = list()
+        # strings are compared as tokens, see read_var_tokens()
+        return Predicate(conditions, self.COLUMNS, dictionaries=self.dictionaries())
 
-        with open(self.FILENAME, 'rb') as f:
-            while pointer != last_pointer:
-                f.seek(self.calculate_offset(pointer))
 
-                start = f.read(RecordVar.FIXED_RECORD_SIZE)
-                unpack_start = struct.unpack(
-                    RecordVar.FIXED_RECORD,
-                    start,
-                )
+    def dictionaries(self) -> dict:
+        # the values of the string columns by code, for tokens
+        return {
+            column: self.dictionary.values[position]
+            for column, (source, position, width) in self.COLUMNS.items() if source == 's'
+        }
+
+
+    def where_candidates(self, predicate: Predicate, stats: SelectIterator):
+        """
+            Yields (pointer, page, fixed fields, tokens) for every record that
+            passes predicate, found through the id index, the year index or a
+            scan. tokens, see read_var_tokens(), is None when the predicate did
+            not need them.
+        """
+        if self.uses_index(predicate):
+            records = self.index_candidates(predicate, stats)
+        else:
+            records = self.scan_records(stats, self.blocks_to_scan(predicate, stats))
+
+        for pointer, page, unpack_start in records:
+            if not predicate.test(unpack_start):
+                continue
 
-                offset1 = unpack_start[1]
-                offset2 = unpack_start[2]
-                offset3 = unpack_start[3]
-                
-                next_pointer = self.next_pointer(pointer, offset3)
-                if next_pointer[0] > pointer[0]:
-                    accessed_blocks += 1
-                pointer = next_pointer
+            tokens = None
 
-                if unpack_start[0] == 1 or not self.compare(unpack_start[6], year):
+            if predicate.has_strings:
+                tokens = self.read_var_tokens(pointer, page, unpack_start)
+
+                if not predicate.test_strings(tokens):
                     continue
 
-                VAR_RECORD = self.var_struct(offset1, offset2, offset3)
-                VAR_SIZE   = struct.calcsize(VAR_RECORD)
+            yield pointer, page, unpack_start, tokens
 
-                end = f.read(VAR_SIZE)
-                unpack_end = struct.unpack(VAR_RECORD, end)
 
-                readable_end = list(map(lambda word: word.decode('utf-8'), unpack_end))
+    def uses_index(self, predicate: Predicate) -> bool:
+        # one index search per id costs about height blocks, so large id sets
+        # are cheaper to check during a single scan
+        use_id_index = predicate.ids is not None and \
+            len(predicate.ids) * self.id_index.height < self.last_register_pointer()[0]
 
-                table.append([*unpack_start[4:], *readable_end])
-        
-        return (table, accessed_blocks)
-    
+        return use_id_index or (predicate.ids is None and predicate.years is not None and self.year_index is not None)
+
+
+    def index_candidates(self, predicate: Predicate, stats: SelectIterator):
+        # accessed blocks are the index pages plus the data blocks
+        pointers = list()
+
+        if predicate.ids is not None:
+            for key in predicate.ids:
+                stats.accessed_blocks += self.id_index.height
+                value = self.id_index.search(key)
+
+                if value is not None:
+                    pointers.append(value)
+
+        else:
+            for key in predicate.years:
+                values, pages = self.year_index.lookup(key)
+                stats.accessed_blocks += pages
+                pointers.extend(values)
+
+        data_blocks = set()
+
+        for pointer in sorted(map(self.deref, pointers)):
+            page, unpack_start = self.read_record(pointer)
+
+            if pointer[0] not in data_blocks:
+                data_blocks.add(pointer[0])
+                stats.accessed_blocks += 1
+
+            if unpack_start is not None:
+                yield pointer, page, unpack_start
+
+
+    def iter_where(self, predicate: Predicate, stats: SelectIterator):
+        for pointer, page, unpack_start, tokens in self.where_candidates(predicate, stats):
+            readable_end = self.dictionary.decode(tokens) if tokens is not None else self.read_var_fields(pointer, page, unpack_start)
 
-    def read_sequence(self):
-        pointer = (1, self.HEADER_SIZE)
-        last_pointer  = self.last_register_pointer()
-        accessed_blocks = 1
+            yield [*unpack_start[4:], *readable_end]
 
-        table = list()
 
-        with open(self.FILENAME, 'rb') as f:
-            while pointer != last_pointer:
-                f.seek(self.calculate_offset(pointer))
+    def iter_sequence(self, stats: SelectIterator):
+        for pointer, page, unpack_start in self.scan_records(stats, self.blocks_to_scan(None, stats)):
+            readable_end = self.read_var_fields(pointer, page, unpack_start)
 
-                start = f.read(RecordVar.FIXED_RECORD_SIZE)
-                unpack_start = struct.unpack(
-                    RecordVar.FIXED_RECORD,
-                    start,
+            yield [*unpack_start[4:], *readable_end]
+
+
+    def block_records(self, block: int) -> tuple:
+        """
+            Returns (page, starts, fixed fields) of the live records of block,
+            reading its slot directory at once. With block latches page is a
+            copy, as in scan_records().
+        """
+        if self.block_latches:
+            with self.pool.latch(block):
+                page = bytes(self.pool.get(block))
+        else:
+            page = self.pool.get(block)
+
+        slots = struct.unpack_from('=H', page, self.page_base(block))[0]
+
+        # the directory grows backward: slot s is entry slots - s
+        directory = struct.unpack_from(f'={2 * slots}H', page, self.BLOCK_SIZE - slots * self.SLOT_SIZE)
+        starts = [directory[k] for k in range(2 * slots - 2, -1, -2) if directory[k + 1] != 0]
+        fixed = struct.Struct(RecordVar.FIXED_RECORD)
+
+        return page, starts, [fixed.unpack_from(page, start) for start in starts]
+
+
+    def iter_aggregate(self, predicate: Predicate, aggregation: Aggregation, stats: SelectIterator):
+        if self.uses_index(predicate):
+            records = self.where_candidates(predicate, stats)
+
+            if aggregation.has_strings:
+                aggregation.add(
+                    (unpack_start, tokens if tokens is not None else self.read_var_tokens(pointer, page, unpack_start))
+                    for pointer, page, unpack_start, tokens in records
                 )
+            else:
+                aggregation.add(unpack_start for pointer, page, unpack_start, tokens in records)
 
-                offset1 = unpack_start[1]
-                offset2 = unpack_start[2]
-                offset3 = unpack_start[3]
-                
-                next_pointer = self.next_pointer(pointer, offset3)
-                if next_pointer[0] > pointer[0]:
-                    accessed_blocks += 1
-                pointer = next_pointer
+            yield from aggregation.rows()
+            return
 
-                if unpack_start[0] == 1:
-                    continue
+        # scans go a block at a time, and read the strings, as tokens, only
+        # when the conditions, groups or aggregates need them
+        strings = predicate.has_strings or aggregation.has_strings
 
-                VAR_RECORD = self.var_struct(offset1, offset2, offset3)
-                VAR_SIZE   = struct.calcsize(VAR_RECORD)
+        for block in self.blocks_to_scan(predicate, stats):
+            page, starts, records = self.block_records(block)
+            stats.accessed_blocks += 1
 
-                end = f.read(VAR_SIZE)
-                unpack_end = struct.unpack(VAR_RECORD, end)
+            if not strings:
+                aggregation.add(predicate.records(records))
+                continue
 
-                readable_end = list(map(lambda word: word.decode('utf-8'), unpack_end))
+            passed = [
+                (unpack_start, self.tokens_at(page, start, unpack_start))
+                for start, unpack_start in zip(starts, records) if predicate.test(unpack_start)
+            ]
+
+            if predicate.has_strings:
+                passed = [(unpack_start, tokens) for unpack_start, tokens in passed if predicate.test_strings(tokens)]
+
+            aggregation.add(passed if aggregation.has_strings else [unpack_start for unpack_start, tokens in passed])
+
+        yield from aggregation.rows()
+
+
+    def read_by_id(self, id: int | set):
+        rows = SelectIterator(self.locked('read', self.iter_by_id, 'select_by_id'), id)
+        return (list(rows), rows.accessed_blocks)
+
+
+    def read_by_year(self, year: int | set):
+        rows = SelectIterator(self.locked('read', self.iter_by_year, 'select_by_year'), year)
+        return (list(rows), rows.accessed_blocks)
+
+
+    def read_sequence(self, workers: int | None = None):
+        rows = self.iter_select(workers=workers)
+        return (list(rows), rows.accessed_blocks)
 
-                table.append([*unpack_start[4:], *readable_end])
-        
-        return (table, accessed_blocks)
 
-    
     def write_header(
         self, 
         last_pointer: tuple | None = None, 
         new_serial: int | None = None,
         deleted_bytes: int | None = None,
-    ) -> tuple:
-        put_last_pointer  = self.pointer(*last_pointer) if last_pointer is not None else self.pointer(*self.last_register_pointer())
-        put_new_serial    = new_serial if new_serial is not None else self.actual_serial()
-        table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
-        timestamp_created = self.created_timestamp().ljust(64, '\x00')[:64]
-        timestamp_updated = str(datetime.now()).ljust(64, '\x00')[:64]
-        put_deleted_bytes = deleted_bytes + self.deleted_bytes() if deleted_bytes is not None else self.deleted_bytes()
-
-        if put_deleted_bytes >= 2 ** 16: # 65536
-            blocks = self.compress()
-            return (1, blocks)
-
-        with open(self.FILENAME, 'rb+') as f:
-            f.seek(0)
+    ):
+        # only the cached header is changed here, see flush()
+        # deleted bytes count the bytes of deleted records not reclaimed yet,
+        # so a negative value is given when a page is compacted
+        header_data       = self.read_header()
+        put_deleted_bytes = max(0, deleted_bytes + header_data[2]) if deleted_bytes is not None else header_data[2]
+
+        if put_deleted_bytes >= self.COMPACTION_THRESHOLD:
+            put_deleted_bytes = self.COMPACTION_THRESHOLD
+            self.start_compaction()
+
+        header_data[2] = put_deleted_bytes
+        if last_pointer is not None:
+            header_data[3] = tuple(last_pointer)
+        if new_serial is not None:
+            header_data[4] = new_serial
+
+        header_data[7] = str(datetime.now())
+
+        self.header_dirty = True
+        self.pending_header_writes += 1
+
+        if self.pending_header_writes >= self.header_flush_interval:
+            self.flush()
+
+
+    def indexes(self) -> list:
+        return [self.id_index, self.fsm, self.zones, self.dictionary] + ([self.year_index] if self.year_index is not None else [])
+
+
+    def reload(self):
+        super().reload()
+
+        # the other process may have finished the compaction, or started one
+        self.compacting = False
+
+        if self.deleted_bytes() >= self.COMPACTION_THRESHOLD:
+            self.start_compaction()
+
+
+    def write_changes(self):
+        # dirty pages and the header go to the files, or to the log if there is one
+        if self.header is not None and self.header_dirty:
+            header_data       = self.header
+            table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
+            timestamp_created = header_data[6].ljust(64, '\x00')[:64]
+            timestamp_updated = header_data[7].ljust(64, '\x00')[:64]
 
             header = struct.pack(
                 self.HEADER_STRUCT,
                 # ----------------------------------
                 self.BLOCK_SIZE,
                 self.HEADER_SIZE,
-                put_deleted_bytes,
-                self.punn(put_last_pointer),
-                put_new_serial,
+                header_data[2],
+                self.punn(self.pointer(*header_data[3])),
+                header_data[4],
                 table_name.encode('utf-8'),
                 timestamp_created.encode('utf-8'),
                 timestamp_updated.encode('utf-8'),
                 # ----------------------------------
             )
 
-            f.write(header)
-        
-        return (0, 0)
+            # the header shares the first block with the records
+            self.write_bytes((1, 0), header)
+            self.io.count('header_writes')
+
+            self.header_dirty = False
+            self.pending_header_writes = 0
+
+        # the codes go before the records using them
+        self.dictionary.flush()
+        self.pool.flush()
+        self.id_index.flush()
+        self.fsm.flush()
+        self.zones.flush()
+
+        if self.year_index is not None:
+            self.year_index.flush()
 
 
-    def read_header(self):
+    def close(self):
+        self.stop_committer()
+
+        with self.lock.hold('write'):
+            self.flush()
+
+            if self.wal is not None:
+                self.wal.close()
+
+            self.pool.close()
+            self.id_index.close()
+            self.fsm.close()
+            self.zones.close()
+            self.dictionary.close()
+
+            if self.year_index is not None:
+                self.year_index.close()
+
+        if self.parallel_scan is not None:
+            self.parallel_scan.close()
+            self.parallel_scan = None
+
+        self.lock.close()
+
+
+    def read_header(self) -> list:
+        """Returns the cached header, reading it from the file the first time."""
+        if self.header is None:
+            self.header = self.load_header()
+
+        return self.header
+
+
+    def load_header(self) -> list:
         """Read the header information."""
-        with open(self.FILENAME, 'rb') as f:
+        self.io.count('header_reads')
+
+        with self.io.open(self.FILENAME, 'rb') as f:
             f.seek(0)
             header = f.read(self.HEADER_SIZE)
             unpacked_data = struct.unpack(self.HEADER_STRUCT, header)
@@ -459,46 +1166,171 @@ class DatabaseVar:
         return block * self.BLOCK_SIZE + register_start
 
 
-    def next_pointer(self, pointer: tuple, register_size: int) -> tuple:
-        if pointer[1] + register_size >= self.BLOCK_SIZE:
-            next_block = pointer[0] + 1
-        else:
-            next_block = pointer[0]
-        
-        next_register_byte = (pointer[1] + register_size) % self.BLOCK_SIZE
+    def start_compaction(self):
+        if self.compacting:
+            return
+
+        self.compacting = True
+        self.io.count('compactions')
+        self.compaction = {
+            'started':         str(datetime.now()),
+            'steps':           0,
+            'records_moved':   0,
+            'blocks_released': 0,
+            'start_blocks':    self.last_register_pointer()[0],
+        }
+
+
+    def compaction_progress(self) -> dict:
+        """Returns the state of the current (or last) compaction."""
+        progress = dict(self.compaction)
+        progress['running'] = self.compacting
+        progress['blocks'] = self.last_register_pointer()[0]
+
+        return progress
+
+
+    def compact_step(self, max_blocks: int | None = None, max_seconds: float | None = None) -> bool:
+        """
+            Runs one step of the compaction, releasing at most max_blocks
+            blocks from the end of the file or working for about max_seconds.
+            Returns True when there is no compaction left to do.
+        """
+        if not self.compacting:
+            return True
+
+        with self.io.operation('compact_step'), self.lock.hold('write'):
+            max_blocks  = max_blocks if max_blocks is not None else self.COMPACTION_STEP_BLOCKS
+            max_seconds = max_seconds if max_seconds is not None else self.COMPACTION_STEP_SECONDS
+            started     = time.perf_counter()
+            released    = 0
 
-        return (next_block, next_register_byte)
+            self.compaction['steps'] += 1
+            self.io.count('compaction_steps')
+
+            deadline    = started + max_seconds
+
+            while released < max_blocks and time.perf_counter() < deadline:
+                last_block = self.last_register_pointer()[0]
+                emptied = self.release_block(last_block, deadline) if last_block != 1 else False
+
+                # the time ran out halfway through the block
+                if emptied is None:
+                    return False
+
+                if not emptied:
+                    self.finish_compaction()
+                    return True
+
+                released += 1
+
+            return False
 
 
     def compress(self) -> int:
-        print("Compressing File...:")
+        """Runs the whole compaction at once, returning the blocks released."""
+        with self.lock.hold('write'):
+            self.start_compaction()
 
-        # Arquivo Antigo
-        data, blocks = self.read_sequence()
-        temp_filename = 'uncompressed.bin'
-        os.rename(self.FILENAME, temp_filename)
+            while not self.compact_step(max_blocks=2 ** 32, max_seconds=float('inf')):
+                pass
 
-        # Arquivo Novo
-        self.create_file()
-        for row in data:
-            self.write_record(*row[1:])
-        
-        os.remove(temp_filename)
+            self.group_commit()
 
-        return blocks
+            return self.compaction['blocks_released']
 
 
-    def var_struct(self, offset1: int, offset2: int, offset3: int):
-        struct = f'={offset1 - RecordVar.FIXED_RECORD_SIZE}s {offset2 - offset1}s {offset3 - offset2}s'
-        return struct
-    
+    def release_block(self, block: int, deadline: float = float('inf')) -> bool | None:
+        """
+            Moves every record of block to earlier blocks and cuts it from the
+            end of the file. Returns False, keeping the block, when a record
+            does not fit anywhere else, and None when the time.perf_counter()
+            deadline passes before the block is empty: the records moved so
+            far stay moved, and the next call goes on with the others.
+        """
+        page = self.pool.get(block)
+        slots = struct.unpack_from('=H', page, self.page_base(block))[0]
+        moved = 0
+
+        for slot in range(1, slots + 1):
+            if moved and time.perf_counter() >= deadline:
+                return None
+
+            page, unpack_start = self.read_record((block, slot))
+
+            if unpack_start is None:
+                continue
+
+            if not self.move_record((block, slot), page, unpack_start):
+                return False
+
+            moved += 1
+
+        # the header must point before the block when it leaves the file
+        previous = self.pool.get(block - 1)
+        previous_slots = struct.unpack_from('=H', previous, self.page_base(block - 1))[0]
+
+        self.write_header(last_pointer=(block - 1, previous_slots))
+
+        # the log keeps the truncation after the header, so it needs no flush
+        if self.wal is None:
+            self.flush()
+
+        self.pool.drop(block)
+        self.pool.truncate(block)
+
+        self.compaction['blocks_released'] += 1
+
+        return True
 
-    def distance_end_of_block(self, pointer: tuple) -> int:
-        return self.BLOCK_SIZE - pointer[1]
-    
 
-    def pointer(self, block: int, start_register_byte: int) -> bytes:
-        return struct.pack('HH', block, start_register_byte)
+    def move_record(self, pointer: tuple, page: bytearray, unpack_start: tuple) -> bool:
+        # the copy is written and indexed before the old slot is freed. When a
+        # crash kept the old record but the index already points to the copy,
+        # the old record is only dropped here as the compaction resumes
+        punned = self.punn(self.pointer(*pointer))
+
+        if self.id_index.search(unpack_start[4]) != punned:
+            self.delete_record(pointer, unpack_start)
+            return True
+
+        offset, length = self.read_slot(page, pointer[1])
+        data = bytes(page[offset:offset + length])
+
+        block = self.fsm.find(length + self.SLOT_SIZE, pointer[0] - 1)
+
+        if block is None:
+            return False
+
+        new_punned = self.punn(self.pointer(block, self.place_record(block, self.pool.get(block), data)))
+        self.id_index.insert(unpack_start[4], new_punned)
+        self.zones.add(block, unpack_start[4], unpack_start[6], unpack_start[5])
+
+        if self.year_index is not None:
+            self.year_index.remove(unpack_start[6], punned)
+            self.year_index.add(unpack_start[6], new_punned)
+
+        self.delete_record(pointer, unpack_start)
+        self.compaction['records_moved'] += 1
+
+        return True
+
+
+    def finish_compaction(self):
+        # deleted bytes left in the pages are reclaimed as new records arrive
+        self.read_header()[2] = 0
+        self.header_dirty = True
+
+        self.compacting = False
+        self.compaction['finished'] = str(datetime.now())
+
+        # with the log the next group commit makes it durable
+        if self.wal is None:
+            self.flush()
+
+
+    def pointer(self, block: int, slot: int) -> bytes:
+        return struct.pack('HH', block, slot)
     
 
     def deref_bytes(self, bytes_pointer: bytes) -> tuple:
@@ -538,32 +1370,202 @@ class DatabaseVar:
     
 
     def insert(self, age: int, year: int, education: str, city: str, gender: str):
-        self.write_record(age, year, education, city, gender)
+        mode = self.insert_mode()
+
+        with self.io.operation('insert'), self.lock.hold(mode):
+            self.write_record(age, year, education, city, gender)
+
+            if mode == 'write':
+                self.compact_step()
+
+            self.group_commit()
+
+
+    def load_csv(self, path: str, mapping: dict | None = None, rebuild_indexes: bool = False) -> int:
+        """
+            Bulk loads the rows of a CSV file, like COPY, and returns how many.
+
+            The file is read LOAD_CHUNK_ROWS rows at a time (see read_chunks()
+            for mapping) and the records are appended a block at a time after
+            the last one: the free space of earlier blocks is left to inserts.
+            The header is written once, at the end. With rebuild_indexes the
+            indexes and the zone map are rebuilt from the file afterwards
+            instead of kept up to date row by row.
+
+            A bad row stops the load with a ValueError; the rows before its
+            chunk stay loaded.
+        """
+        with self.io.operation('load_csv') as operation, self.lock.hold('write'):
+            header_data  = self.read_header()
+            last_pointer = header_data[3]
+            serial       = first = header_data[4]
 
+            try:
+                for rows in read_chunks(path, mapping, self.LOAD_CHUNK_ROWS):
+                    last_pointer, serial = self.append_records(rows, last_pointer, serial, not rebuild_indexes)
+            finally:
+                if serial > first:
+                    self.write_header(last_pointer=last_pointer, new_serial=serial)
 
-    def delete(self, id=None, year=None):
-        if id == None and year == None:
+                    if rebuild_indexes:
+                        self.build_id_index()
+                        self.build_zone_map()
+
+                        if self.year_index is not None:
+                            self.build_year_index()
+
+            operation.details = {'rows': serial - first}
+
+        self.commit()
+
+        return serial - first
+
+
+    def insert_mode(self) -> str:
+        # with block latches, scans read the blocks an insert changes under
+        # their latches, so inserts need not wait for them. Compaction steps
+        # move records between blocks and still need the table alone.
+        return 'append' if self.block_latches and not self.compacting else 'write'
+
+
+    def delete(self, id=None, year=None, where=None):
+        if id == None and year == None and where == None:
          raise KeyError("DELETION must have a key")
-        elif id != None and year == None:
-            return self.delete_by_id(id)
-        elif id == None and year != None:
-            return self.delete_by_year(year)
-        else:
-            raise NotImplemented
 
+        with self.io.operation('delete'), self.lock.hold('write'):
+            # a compaction started by this delete only runs in later steps
+            compacting = self.compacting
 
-    def select(self, id=None, year=None):
-        if id == None and year == None:
-            data, blocks = self.read_sequence()
-        elif id != None and year == None:
-            data, blocks = self.read_by_id(id)
-        elif id == None and year != None:
-            data, blocks = self.read_by_year(year)
-        else:
-            raise NotImplemented
+            if id != None and year == None and where == None and type(id) != set:
+                blocks = self.delete_by_id(id)
+            elif id == None and year != None and where == None:
+                blocks = self.delete_by_year(year)
+            else:
+                blocks = self.delete_where(self.predicate(where, id, year))
+
+            if compacting:
+                self.compact_step()
+
+            self.group_commit()
 
-        # pprint(data)
         return blocks
 
 
-db = DatabaseVar()
+    def iter_select(self, id=None, year=None, where=None, workers: int | None = None) -> SelectIterator:
+        """
+            Returns an iterator over the rows of the query, read lazily. Its
+            accessed_blocks are final once it is exhausted or closed. The table
+            lock is held until then, so a query left unfinished should be closed,
+            or used in a with block.
+
+            where takes conditions on any column, see Predicate, for example
+            [('year', '>=', 2015), ('city', 'in', {'Pune', 'New Delhi'})].
+
+            With workers, a query answered by a full scan is split between that
+            many processes, see ParallelScan. Workers read the file itself, so
+            the scans of a compressed file are not split.
+        """
+        if workers is not None and workers > 1 and not self.compressed:
+            predicate = self.predicate(where, id, year)
+
+            if not self.uses_index(predicate):
+                return SelectIterator(self.locked('read', self.parallel(workers).rows, 'parallel_scan'), predicate)
+
+        if id == None and year == None and where == None:
+            return SelectIterator(self.locked('scan', self.iter_sequence, 'scan'))
+        elif id != None and year == None and where == None and type(id) != set:
+            return SelectIterator(self.locked('read', self.iter_by_id, 'select_by_id'), id)
+        else:
+            # sets of ids go through uses_index(), which scans when that is cheaper
+            return SelectIterator(self.locked('read', self.iter_where, 'select_where'), self.predicate(where, id, year))
+
+
+    def aggregate(self, group_by=None, aggs=None, where=None, id=None, year=None) -> SelectIterator:
+        """
+            Returns an iterator over the groups of a GROUP BY query, as dicts
+            of the group columns and the aggregates, for example
+            aggregate(['city', 'year'], {'headcount': 'count', 'age': ('avg', 'age')}).
+            See Aggregation.
+
+            The aggregates are computed in the scan loop, or over the records
+            found by an index. Strings are read only when the query uses them,
+            as dictionary codes, and decoded once per group. The table lock is
+            held until the iterator is exhausted or closed, as in iter_select().
+        """
+        aggregation = Aggregation(group_by, aggs, self.COLUMNS, self.dictionaries())
+        mode = 'scan' if id == None and year == None and where == None else 'read'
+
+        return SelectIterator(self.locked(mode, self.iter_aggregate, 'aggregate'), self.predicate(where, id, year), aggregation)
+
+
+    def compression_stats(self) -> dict | None:
+        """
+            Returns the sizes of the compressed blocks and the images read and
+            written so far (see CompressedStore.stats()), with the hits and
+            misses of the buffer pool, or None for a plain file.
+        """
+        if not self.compressed:
+            return None
+
+        stats = self.pool.store.stats()
+        stats['cache_hits']   = self.pool.hits
+        stats['cache_misses'] = self.pool.misses
+
+        return stats
+
+
+    def pools(self) -> dict:
+        """Returns the buffer pools of the table by name."""
+        pools = {
+            'data': self.pool, 'id_index': self.id_index.pool, 'free_space_map': self.fsm.pool,
+            'zone_map': self.zones.pool, 'dictionary': self.dictionary.pool,
+        }
+
+        if self.year_index is not None:
+            pools['year_index'] = self.year_index.pool
+        if self.compressed:
+            pools['block_directory'] = self.pool.store.directory
+
+        return pools
+
+
+    def stats(self, reset: bool = False) -> dict:
+        """
+            Returns the I/O counters and the latencies of the operations and
+            queries so far (see IOStats.snapshot()), the hits and misses of
+            every buffer pool, the commits and checkpoints of the log, the
+            figures of compression_stats() and the compaction_progress().
+            With reset the counters and latencies start over.
+        """
+        stats = self.io.snapshot()
+        stats['cache'] = {name: {'hits': pool.hits, 'misses': pool.misses} for name, pool in self.pools().items()}
+        stats['wal'] = {'commits': self.wal.commits, 'checkpoints': self.wal.checkpoints, 'size': self.wal.size} if self.wal is not None else None
+        stats['compression'] = self.compression_stats()
+        stats['compaction'] = self.compaction_progress()
+
+        if reset:
+            self.io.reset()
+
+        return stats
+
+
+    def parallel(self, workers: int) -> ParallelScan:
+        """Returns the parallel scans of this table with workers processes."""
+        if self.parallel_scan is not None and self.parallel_scan.workers != workers:
+            self.parallel_scan.close()
+            self.parallel_scan = None
+
+        if self.parallel_scan is None:
+            self.parallel_scan = ParallelScan(self, workers, RecordVar.FIXED_RECORD)
+
+        return self.parallel_scan
+
+
+    def select(self, id=None, year=None, where=None, workers: int | None = None):
+        rows = self.iter_select(id, year, where, workers)
+
+        for row in rows:
+            pass # pprint(row)
+
+        return rows.accessed_blocks
+
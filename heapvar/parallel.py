@@ -0,0 +1,103 @@
+import mmap
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from common.predicate import Predicate
+
+
+def scan_range(task):
+    """Filters and decodes the records of one block range, in a worker process."""
+    filename, layout, blocks, conditions, columns, dictionaries = task
+    block_size, header_size, slot_structure, fixed_record = layout
+
+    slot      = struct.Struct(slot_structure)
+    fixed     = struct.Struct(fixed_record)
+    predicate = Predicate(conditions, columns, dictionaries=dictionaries)
+    rows      = list()
+
+    # values by code of every string, see StringDictionary
+    values = [dictionaries[column] for column in sorted(dictionaries, key=lambda column: columns[column][1])]
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for block in blocks:
+                # every block is a slotted page, readable on its own
+                page = mm[(block - 1) * block_size:block * block_size]
+                slots = struct.unpack_from('=H', page, header_size if block == 1 else 0)[0]
+
+                for s in range(1, slots + 1):
+                    offset, length = slot.unpack_from(page, block_size - s * slot.size)
+
+                    if length == 0:
+                        continue
+
+                    unpack_start = fixed.unpack_from(page, offset)
+
+                    if not predicate.test(unpack_start):
+                        continue
+
+                    # the fixed fields start with the flags of the coded strings
+                    # and end with the end offsets of the strings
+                    flags = unpack_start[0]
+                    ends = (fixed.size, *unpack_start[1:4])
+
+                    if flags == 0b111:
+                        tokens = list(page[offset + fixed.size:offset + fixed.size + 3])
+                    else:
+                        tokens = [
+                            page[offset + ends[k]] if flags >> k & 1 else page[offset + ends[k]:offset + ends[k + 1]].decode('utf-8')
+                            for k in range(3)
+                        ]
+
+                    if predicate.has_strings and not predicate.test_strings(tokens):
+                        continue
+
+                    rows.append([*unpack_start[4:], *[values[k][t] if t.__class__ is int else t for k, t in enumerate(tokens)]])
+
+    return rows
+
+
+class ParallelScan:
+    """
+        Full scans of a DatabaseVar file split into block ranges, each one
+        filtered and decoded by a worker process.
+
+        Slotted pages find their records through their own slot directory,
+        so a worker can start at any block. The ranges are contiguous and
+        handed out in file order, a few per worker so a slow range does not
+        hold back the others, and their rows are merged back in the same
+        order. Workers read the file itself, so the changes kept in memory
+        are written back before a scan.
+    """
+
+    RANGES_PER_WORKER = 4
+
+    def __init__(self, db, workers, fixed_record):
+        self.db           = db
+        self.workers      = workers
+        self.fixed_record = fixed_record # RecordVar.FIXED_RECORD
+        self.executor     = ProcessPoolExecutor(workers)
+
+
+    def tasks(self, predicate, stats):
+        blocks = list(self.db.blocks_to_scan(predicate, stats))
+        size = max(1, -(-len(blocks) // (self.workers * self.RANGES_PER_WORKER)))
+        layout = (self.db.BLOCK_SIZE, self.db.HEADER_SIZE, self.db.SLOT_STRUCT, self.fixed_record)
+
+        for first in range(0, len(blocks), size):
+            yield (self.db.FILENAME, layout, blocks[first:first + size], predicate.conditions, predicate.columns, predicate.dictionaries)
+
+
+    def rows(self, predicate, stats):
+        # generator for SelectIterator: accessed blocks are the blocks scanned
+        self.db.flush()
+
+        tasks = list(self.tasks(predicate, stats))
+
+        for task, rows in zip(tasks, self.executor.map(scan_range, tasks)):
+            stats.accessed_blocks += len(task[2])
+            yield from rows
+
+
+    def close(self):
+        self.executor.shutdown()
@@ -1,156 +1,98 @@
 from main import DatabaseVar
+from common.enginetest import EngineTest
 
 import time
+from collections import Counter
 
-db = DatabaseVar()
 
-def load_data():
-	total_time = 0
-	count = 0
+class VarTest(EngineTest):
+	def checks(self):
+		self.free_space()
+		self.string_dictionary()
+		self.parallel_scans()
+		self.compressed_store()
+		self.csv_load()
+		self.compaction()
 
-	with open('data/Employee.csv', 'r') as data:
-		head = data.readline()
 
-		for line in data:
-			ls = line.split(',')
-			ls[4] = ls[4].rstrip('\n')
-			
-			start_time = time.time()
-			db.insert(int(ls[3]), int(ls[1]), ls[0], ls[2], ls[4])
-			end_time = time.time()
+	def free_space(self):
+		db = self.db
 
-			total_time += end_time - start_time
-			count += 1
-	
-	last_pointer = db.last_register_pointer()
+		print('Reusing deleted space')
+		ids = self.ids()
+		blocks = db.last_register_pointer()[0]
+		serial = db.actual_serial()
 
-	print(f"Total blocks: {last_pointer[0]}")
-	
-	return total_time / count
+		for row in list(self.csv_rows())[:200]:
+			db.insert(*row)
 
+		new = list(range(serial + 1, db.actual_serial() + 1))
+		wrong = [block for block in range(1, db.last_register_pointer()[0] + 1) if db.fsm.get(block) > db.free_space(block, db.pool.get(block))]
 
-def main():
-	if db.last_register_pointer() == (1, DatabaseVar.HEADER_SIZE):
-		print('Loading Data:')
-		for i in range(10):
-			mean = load_data()
-			print(f"Mean time for all insertions: {mean}\n")
-	
-	blocks_list = []
-	times = []
-	SELECTION_TIMES = 10
+		print("-------------------------------")
+		print(f'    Blocks: {blocks} -> {db.last_register_pointer()[0]} ---- Rows: {len(ids)} -> {len(self.ids())}')
+		print(f'    Blocks with more free space in the map than in the page: {wrong}')
 
-	print('Selecting All')
-	for i in range(SELECTION_TIMES):
-		start_time = time.time()
-		blocks = db.select()
-		end_time = time.time()
+		assert db.last_register_pointer()[0] <= blocks
+		assert sorted(self.ids()) == sorted(ids + new)
+		assert sorted(self.ids(id=set(new))) == new
+		assert not wrong
 
-		total = end_time - start_time
+		print('\n\n')
 
-		blocks_list.append(blocks)
-		times.append(total)
-	
 
-	for i in range(SELECTION_TIMES):
-		print(f'    {i+1}º Read: {times[i]}s ---- {blocks_list[i]} blocks')
-	
-	print("-------------------------------")
-	print(f'    Mean Time: {sum(times) / len(times)}')
-	print(f'    Mean Accessed Blocks: {sum(blocks_list) / len(blocks_list)}')
+	def string_dictionary(self):
+		db = self.db
 
-	print('\n\n')
-	
+		print('Selecting by coded strings')
+		dictionaries = db.dictionaries()
+		records = [self.record(row) for row in db.iter_select()]
 
-	ids = [44, 64, 94, 491, 930, 8519, 20192, 58392, 83921, 98493, 120183, 284932, 328492, 389432, 400000]
-	blocks_list = []
-	times = []
+		for column, values in dictionaries.items():
+			counts = Counter(record[column] for record in records)
 
-	print('Selecting by id')
-	for id in ids:
-		start_time = time.time()
-		blocks = db.select(id=id)
-		end_time = time.time()
+			print(f'    {column}: {len(values)} coded values')
+			assert set(counts) <= set(values)
 
-		total = end_time - start_time
+			for value in values:
+				assert len(list(db.iter_select(where=[(column, value)]))) == counts[value]
 
-		blocks_list.append(blocks)
-		times.append(total)
-	
+		print('\n\n')
 
-	for i in range(len(ids)):
-		print(f'    {i+1}º Read: {times[i]}s ---- {blocks_list[i]} blocks')
-	
-	print("-------------------------------")
-	print(f'    Mean Time: {sum(times) / len(times)}')
-	print(f'    Mean Accessed Blocks: {sum(blocks_list) / len(blocks_list)}')
 
-	print('\n\n')
+	def compaction(self):
+		db = self.db
 
+		print('Compacting in steps')
+		ids = sorted(self.ids())
+		blocks = db.last_register_pointer()[0]
 
-	print('Selecting by ids')
-	ids_set = set(ids)
+		db.start_compaction()
+		steps = []
 
-	start_time = time.time()
-	blocks = db.select(id=ids_set)
-	end_time = time.time()
+		while True:
+			start_time = time.perf_counter()
+			done = db.compact_step()
+			steps.append(time.perf_counter() - start_time)
 
-	total = end_time - start_time
-	
-	print("-------------------------------")
-	print(f'    Total Time: {total}')
-	print(f'    Accessed Blocks: {blocks}')
+			if done:
+				break
 
-	print('\n\n')
+		compacted = sorted(self.ids())
+		db = self.reopen()
+		reopened = sorted(self.ids())
 
+		print("-------------------------------")
+		print(f'    Steps: {len(steps)} ---- Slowest step: {max(steps)}s ---- Budget: {db.COMPACTION_STEP_SECONDS}s')
+		print(f'    Blocks: {blocks} -> {db.last_register_pointer()[0]} ---- Rows: {len(ids)} -> {len(reopened)}')
 
-	ids = [44, 64, 94, 491, 930, 8519, 20192]
-	blocks_list = []
-	times = []
+		assert compacted == ids and reopened == ids
+		assert db.last_register_pointer()[0] <= blocks
 
-	print("Deleting series by id:")
-	for i, id in enumerate(ids):
-		start_time = time.time()
-		block = db.delete(id=id)
-		end_time = time.time()
+		print('\n\n')
 
-		total_time = end_time - start_time
 
-		blocks_list.append(block)
-		times.append(total_time)
+select_ids = [44, 64, 94, 491, 930, 8519, 20192, 58392, 83921, 98493, 120183, 284932, 328492, 389432, 400000]
+delete_ids = [44, 64, 94, 491, 930, 8519, 20192]
 
-		print(f"    Record {i}: {total_time}s --- {block} blocks accessed.")
-	
-	print("-------------------------------")
-	print(f"\n    Deletions by id mean time: {sum(times) / len(times)}")
-	print(f"    Mean accessed blocks: {sum(blocks_list) / len(blocks_list)}")
-
-	print('\n\n')
-
-
-	blocks_list = []
-	times = []
-
-	print('Deleting by year - Many registers erased')
-	year = 2017
-
-	start_time = time.time()
-	blocks = db.delete(year=year)
-	end_time = time.time()
-
-	total_time = end_time - start_time
-
-	print("-------------------------------")
-	print(f'    Total Time: {total_time}')
-	print(f'    Accessed Blocks: {blocks}')
-
-	print('\n\n')
-
-	print('Inserting Again')
-
-	for i in range(4):
-		mean = load_data()
-		print(f"    Mean time: {mean}")
-
-
-main()
\ No newline at end of file
+VarTest(DatabaseVar(), id_position=0, empty_pointer=(1, 0), select_ids=select_ids, delete_ids=delete_ids).main()
@@ -0,0 +1,733 @@
+import os
+import sys
+import atexit
+import struct
+import threading
+from itertools import repeat
+from datetime import datetime
+from pprint import pprint
+
+# the modules shared by the engines are in common/, at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.iddirectory import IdDirectory
+from common.bufferpool import BufferPool
+from common.zonemap import ZoneMap
+from common.wal import WriteAheadLog
+from common.concurrency import TableLock
+from common.iostats import IOStats
+from common.predicate import Predicate
+from common.aggregate import Aggregation
+from common.table import SelectIterator, Table
+
+
+class DatabasePax(Table):
+   """
+      The employee table of DatabaseHeap in PAX blocks: the registers of a
+      block are split by column, each column in its own minipage, so a query
+      reads and decodes only the columns it uses.
+
+      Every block holds REGISTERS registers. The minipage of a column starts
+      at REGISTERS times the sizes of the columns before it, and register r
+      (starting at 1) of the block is entry r - 1 of every minipage. The
+      header comes before the first block.
+
+      A deleted register has its deleted mark set and keeps in its id the
+      next register of the free list, whose head is in the header, as in
+      DatabaseHeap.
+   """
+
+   FILENAME         = 'pax.bin'
+   ID_INDEX         = 'pax.id.dir'
+   ZONE_MAP         = 'pax.zone'
+   WAL_FILE         = 'pax.wal'
+   LOCK_FILE        = 'pax.lock'
+   BLOCK_SIZE       = 4096
+   HEADER_STRUCTURE = f'=H H I I I I 64s 64s 64s'
+   TABLE_NAME       = 'employee'
+   HEADER_SIZE      = struct.calcsize(HEADER_STRUCTURE)
+
+   # minipages of a block, in order: (column, format of one value)
+   MINIPAGES = (
+      ('deleted',   'B'),
+      ('id',        'I'),
+      ('age',       'I'),
+      ('year',      'I'),
+      ('education', '9s'),
+      ('city',      '9s'),
+      ('gender',    '6s'),
+   )
+
+   RECORD_SIZE = sum(struct.calcsize('=' + fmt) for column, fmt in MINIPAGES)
+   REGISTERS   = BLOCK_SIZE // RECORD_SIZE # registers per block
+
+   # where= columns: (source, position in the record, string width)
+   COLUMNS = {
+      'id':        ('r', 1, None),
+      'age':       ('r', 2, None),
+      'year':      ('r', 3, None),
+      'education': ('r', 4, 9),
+      'city':      ('r', 5, 9),
+      'gender':    ('r', 6, 6),
+   }
+
+   HEADER_FLUSH_INTERVAL = 1000 # header updates kept in memory before writing
+   BUFFER_POOL_SIZE      = 4 * 1024 * 1024 # bytes of blocks kept in memory
+   INDEX_POOL_SIZE       = 1024 * 1024     # bytes of index pages kept in memory
+   COMMIT_INTERVAL       = 0.05            # seconds between group commits of the log
+   CHECKPOINT_SIZE       = 16 * 1024 * 1024 # bytes of log that start a checkpoint
+
+   def __init__(self, header_flush_interval = None, buffer_pool_size = None, wal = True, commit_interval = None, shared = False,
+                trace = None):
+      # I/O counters and latencies of the operations, see stats(). trace is
+      # called with a dict for every operation and query, see IOStats.
+      self.io = IOStats(trace)
+
+      # Many readers or one writer at a time, see TableLock. With shared the
+      # lock is also taken on LOCK_FILE, for other processes using the table.
+      self.lock        = TableLock(self.LOCK_FILE if shared else None)
+      self.flush_latch = threading.RLock()
+      self.lock.acquire('write')
+
+      # column -> (offset of its minipage, struct of one value, struct of the minipage)
+      self.minipages = dict()
+      offset = 0
+
+      for column, fmt in self.MINIPAGES:
+         value = struct.Struct('=' + fmt)
+         self.minipages[column] = (offset, value, struct.Struct('=' + ' '.join([fmt] * self.REGISTERS)))
+         offset += value.size * self.REGISTERS
+
+      # The header is parsed once and kept in memory. Changes are written back
+      # by flush(), on exit, or after HEADER_FLUSH_INTERVAL header updates.
+      self.header = None
+      self.header_dirty = False
+      self.pending_header_writes = 0
+      self.header_flush_interval = header_flush_interval if header_flush_interval is not None else self.HEADER_FLUSH_INTERVAL
+
+      # Changes go to the write-ahead log first, synced once per group commit:
+      # after an operation, when COMMIT_INTERVAL has passed since the last one,
+      # or by the committer thread once it passed after the last operation.
+      # A log left by a crash is redone before anything else is read.
+      self.wal = WriteAheadLog(
+         self.WAL_FILE,
+         {0: self.FILENAME, 1: self.ID_INDEX, 2: self.ZONE_MAP},
+         commit_interval if commit_interval is not None else self.COMMIT_INTERVAL,
+         self.CHECKPOINT_SIZE,
+      )
+      self.wal.recover()
+
+      if not wal:
+         self.wal.close()
+         os.remove(self.WAL_FILE)
+         self.wal = None
+
+      if not os.path.exists(self.FILENAME):
+         self.create_file()
+
+      self.pool = BufferPool(self.FILENAME, self.BLOCK_SIZE, buffer_pool_size or self.BUFFER_POOL_SIZE, base_offset=self.HEADER_SIZE)
+
+      # primary key index: id -> punned pointer (block, register), one entry per serial
+      build_id_index = not os.path.exists(self.ID_INDEX)
+      self.id_index = IdDirectory(self.ID_INDEX, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+      if build_id_index:
+         self.build_id_index()
+
+      # min/max id, year and age and live records of every block
+      build_zone_map = not os.path.exists(self.ZONE_MAP)
+      self.zones = ZoneMap(self.ZONE_MAP, self.BLOCK_SIZE, self.INDEX_POOL_SIZE)
+
+      if build_zone_map:
+         self.build_zone_map()
+
+      if self.wal is not None:
+         self.wal.attach(0, self.pool)
+         self.wal.attach(1, self.id_index.pool)
+         self.wal.attach(2, self.zones.pool)
+         self.io.attach(self.wal)
+
+      for pool in self.pools().values():
+         self.io.attach(pool)
+
+      self.lock.changed = self.reload
+      self.lock.publish = self.flush
+      self.lock.release()
+
+      self.start_committer()
+      atexit.register(self.close)
+
+
+   def create_file(self):
+      """Creates a new file with a header."""
+      with open(self.FILENAME, 'wb') as f:
+         table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
+         timestamp_created = str(datetime.now()).ljust(64, '\x00')[:64]
+
+         f.write(struct.pack(
+            self.HEADER_STRUCTURE,
+          # ---------------------------------- #
+            self.BLOCK_SIZE,                   # 4096
+            self.HEADER_SIZE,                  # 212
+            self.RECORD_SIZE,                  # 37
+            self.punn(self.pointer(1, 1)),     # pointer to first block and first record
+            self.punn(self.pointer(0, 0)),     # pointer to 0, 0 (NULL)
+            0,                                 # SERIAL starts in 0
+            table_name.encode('utf-8'),        # Table Name
+            timestamp_created.encode('utf-8'), # Timestamps
+            timestamp_created.encode('utf-8'), # Timestamps
+          # ---------------------------------- #
+         ))
+
+      self.header = None
+      self.header_dirty = False
+      self.pending_header_writes = 0
+
+
+   def read_column(self, page, column, registers):
+      """Returns the values of column of the first registers of page, undecoded."""
+      offset, value, minipage = self.minipages[column]
+      return minipage.unpack_from(page, offset)[:registers]
+
+
+   def read_value(self, page, column, register):
+      offset, value, minipage = self.minipages[column]
+      return value.unpack_from(page, offset + (register - 1) * value.size)[0]
+
+
+   def write_value(self, page, column, register, data):
+      offset, value, minipage = self.minipages[column]
+      value.pack_into(page, offset + (register - 1) * value.size, data)
+
+
+   def read_register(self, pointer):
+      """Returns the register at pointer as the record (deleted, id, age, year, education, city, gender)."""
+      page = self.pool.get(pointer[0])
+      return tuple(self.read_value(page, column, pointer[1]) for column, fmt in self.MINIPAGES)
+
+
+   def readable(self, column, values):
+      # strings are padded with \x00 to their width
+      if self.COLUMNS[column][2] is None:
+         return values
+
+      return [value.decode('utf-8').rstrip('\x00') for value in values]
+
+
+   def write_register(self, age=None, year=None, education=None, city=None, gender=None):
+      del_pointer  = self.del_register_pointer()
+      last_pointer = self.last_register_pointer()
+      NEW_SERIAL   = self.actual_serial() + 1
+
+      values = (
+         0,
+         NEW_SERIAL,
+         age if age is not None else 0,
+         year if year is not None else 0,
+         (education if education is not None else '').encode('utf-8'),
+         (city if city is not None else '').encode('utf-8'),
+         (gender if gender is not None else '').encode('utf-8'),
+      )
+
+      # every value is packed before the page changes, so a bad one leaves
+      # the register, and the free list link in its id, as they were
+      packed = [self.minipages[column][1].pack(value) for (column, fmt), value in zip(self.MINIPAGES, values)]
+
+      # a deleted register is reused before the file grows
+      pointer = del_pointer if del_pointer != (0, 0) else last_pointer
+
+      if pointer == last_pointer and pointer[1] == 1:
+         page = self.write_block(pointer[0])
+      else:
+         page = self.pool.get(pointer[0])
+
+      if del_pointer != (0, 0):
+         new_head_deleted = self.deref(self.read_value(page, 'id', pointer[1]))
+
+      for (column, fmt), data in zip(self.MINIPAGES, packed):
+         offset, value, minipage = self.minipages[column]
+         start = offset + (pointer[1] - 1) * value.size
+         page[start:start + value.size] = data
+
+      self.pool.mark_dirty(pointer[0], page)
+      self.index_register(pointer, NEW_SERIAL, values[3], values[2])
+
+      if del_pointer != (0, 0):
+         self.write_header(del_pointer=self.pointer(*new_head_deleted), new_serial=NEW_SERIAL)
+         return
+
+      if pointer[1] < self.REGISTERS:
+         next_register = self.pointer(pointer[0], pointer[1] + 1)
+      else:
+         next_register = self.pointer(pointer[0] + 1, 1)
+
+      self.write_header(last_pointer=next_register, new_serial=NEW_SERIAL)
+
+
+   def write_block(self, block):
+      # new blocks only exist in the buffer pool until they are written back
+      return self.pool.new_block(block)
+
+
+   def index_register(self, pointer, serial, year, age):
+      # adds a register just written at pointer to the id index and zone map
+      self.id_index.insert(serial, self.punn(self.pointer(*pointer)))
+      self.zones.add(pointer[0], serial, year, age)
+
+
+   def build_id_index(self):
+      """(Re)builds the id index from the registers in the file."""
+      self.id_index.reset()
+
+      for block, registers in self.blocks_in_use():
+         page = self.pool.get(block)
+
+         for register, (deleted, id) in enumerate(zip(self.read_column(page, 'deleted', registers), self.read_column(page, 'id', registers))):
+            if deleted == 0:
+               self.id_index.insert(id, self.punn(self.pointer(block, register + 1)))
+
+      self.id_index.flush()
+
+
+   def build_zone_map(self):
+      """(Re)builds the zone map from the registers in the file."""
+      self.zones.reset()
+
+      for block, registers in self.blocks_in_use():
+         page = self.pool.get(block)
+         columns = [self.read_column(page, column, registers) for column in ('deleted', 'id', 'year', 'age')]
+
+         for deleted, id, year, age in zip(*columns):
+            if deleted == 0:
+               self.zones.add(block, id, year, age)
+
+      self.zones.flush()
+
+
+   def blocks_in_use(self):
+      last_pointer = self.last_register_pointer()
+
+      for block in range(1, last_pointer[0] + 1):
+         registers = last_pointer[1] - 1 if block == last_pointer[0] else self.REGISTERS
+
+         if registers == 0:
+            break
+
+         yield block, registers
+
+
+   def blocks_to_scan(self, predicate, stats):
+      # the blocks in use the zone map cannot rule out for predicate
+      bounds = self.zones.bounds(predicate)
+
+      for block, registers in self.blocks_in_use():
+         if self.zones.may_match(block, bounds):
+            yield block, registers
+         else:
+            stats.skipped_blocks += 1
+
+
+   def predicate(self, where=None, id=None, year=None):
+      # id and year are conditions too, so they can be combined with where
+      conditions = list(where.items()) if type(where) == dict else list(where or ())
+
+      if id is not None:
+         conditions.append(('id', id))
+      if year is not None:
+         conditions.append(('year', year))
+
+      return Predicate(conditions, self.COLUMNS, guard='r[0] == 0')
+
+
+   def output_columns(self, columns):
+      columns = list(columns) if columns is not None else list(self.COLUMNS)
+
+      if not columns:
+         raise ValueError("NO COLUMNS TO SELECT")
+
+      for column in columns:
+         if column not in self.COLUMNS:
+            raise KeyError(f"UNKNOWN COLUMN {column}")
+
+      return columns
+
+
+   def where_candidates(self, predicate, columns, stats):
+      """
+         Yields (block, registers, values) for the registers of every block
+         that pass predicate, found through the id index or a scan. values
+         holds, for every column of columns, the list of its undecoded values
+         for the registers.
+
+         A scan reads the minipages of the columns of predicate for every
+         block, and those of columns only for the blocks with a register
+         that passed.
+      """
+      if self.uses_index(predicate):
+         for pointer, data in self.index_candidates(predicate, stats):
+            yield pointer[0], [pointer[1]], [[data[self.COLUMNS[column][1]]] for column in columns]
+
+         return
+
+      # the records tested hold only the columns of the conditions, None elsewhere
+      tested = {column for column, operator, value in predicate.conditions}
+      unread = repeat(None)
+
+      for block, registers in self.blocks_to_scan(predicate, stats):
+         page = self.pool.get(block)
+         stats.accessed_blocks += 1
+
+         fields = {
+            column: self.read_column(page, column, registers)
+            for column, fmt in self.MINIPAGES if column == 'deleted' or column in tested
+         }
+
+         passed = [register for register, data in predicate.positions(zip(*[fields.get(column, unread) for column, fmt in self.MINIPAGES]))]
+
+         if not passed:
+            continue
+
+         values = list()
+
+         for column in columns:
+            field = fields[column] if column in fields else self.read_column(page, column, registers)
+            values.append(list(field) if len(passed) == registers else [field[register] for register in passed])
+
+         yield block, [register + 1 for register in passed], values
+
+
+   def uses_index(self, predicate):
+      # one index search per id costs about height blocks, so large id sets
+      # are cheaper to check during a single scan
+      return predicate.ids is not None and len(predicate.ids) * self.id_index.height < self.last_register_pointer()[0]
+
+
+   def index_candidates(self, predicate, stats):
+      # accessed blocks are the index pages plus the data blocks
+      pointers = list()
+
+      for key in predicate.ids:
+         stats.accessed_blocks += self.id_index.height
+         value = self.id_index.search(key)
+
+         if value is not None:
+            pointers.append(value)
+
+      data_blocks = set()
+
+      for pointer in sorted(map(self.deref, pointers)):
+         if pointer[0] not in data_blocks:
+            data_blocks.add(pointer[0])
+            stats.accessed_blocks += 1
+
+         data = self.read_register(pointer)
+
+         if predicate.test(data):
+            yield pointer, data
+
+
+   def iter_by_id(self, id, columns, stats):
+      yield from self.iter_where(self.predicate(id=id), columns, stats)
+
+
+   def iter_by_year(self, year, columns, stats):
+      yield from self.iter_where(self.predicate(year=year), columns, stats)
+
+
+   def iter_where(self, predicate, columns, stats):
+      # rows are put together a block at a time, from the decoded columns
+      for block, registers, values in self.where_candidates(predicate, columns, stats):
+         yield from zip(*[self.readable(column, value) for column, value in zip(columns, values)])
+
+
+   def iter_aggregate(self, predicate, aggregation, stats):
+      if self.uses_index(predicate):
+         aggregation.add(data for pointer, data in self.index_candidates(predicate, stats))
+         yield from aggregation.rows()
+         return
+
+      # only the minipages of the groups, aggregates and conditions are read
+      read = aggregation.used | {column for column, operator, value in predicate.conditions}
+      unread = repeat(None)
+
+      for block, registers in self.blocks_to_scan(predicate, stats):
+         page = self.pool.get(block)
+         stats.accessed_blocks += 1
+
+         fields = [
+            self.read_column(page, column, registers) if column == 'deleted' or column in read else unread
+            for column, fmt in self.MINIPAGES
+         ]
+
+         aggregation.add(predicate.records(zip(*fields)))
+
+      yield from aggregation.rows()
+
+
+   def read_by_id(self, id, columns=None):
+      rows = SelectIterator(self.locked('read', self.iter_by_id, 'select_by_id'), id, self.output_columns(columns))
+      return (list(rows), rows.accessed_blocks)
+
+
+   def read_by_year(self, year, columns=None):
+      rows = SelectIterator(self.locked('read', self.iter_by_year, 'select_by_year'), year, self.output_columns(columns))
+      return (list(rows), rows.accessed_blocks)
+
+
+   def read_many_registers(self, columns=None):
+      rows = self.iter_select(columns=columns)
+      return (list(rows), rows.accessed_blocks)
+
+
+   def deletion_where(self, predicate):
+      # every deleted register is chained in front of the free list in memory,
+      # and the header gets the new head of the list once, at the end
+      candidates = SelectIterator(self.where_candidates, predicate, ['id'])
+      deleted_pointers = self.del_register_pointer()
+
+      for block, registers, (ids,) in candidates:
+         page = self.pool.get(block)
+
+         for register, id in zip(registers, ids):
+            self.write_value(page, 'deleted', register, 1)
+            self.write_value(page, 'id', register, self.punn(self.pointer(*deleted_pointers)))
+
+            self.id_index.delete(id)
+            self.zones.remove(block)
+
+            deleted_pointers = (block, register)
+
+         self.pool.mark_dirty(block, page)
+
+      if deleted_pointers != self.del_register_pointer():
+         self.write_header(del_pointer=self.pointer(*deleted_pointers))
+
+      return candidates.accessed_blocks
+
+
+   def write_header(self, last_pointer = None, del_pointer = None, new_serial = None):
+      # the pointers are bytes; only the cached header is changed here
+      header_data = self.read_header()
+
+      if last_pointer is not None:
+         header_data[3] = struct.unpack('HH', last_pointer)
+      if del_pointer is not None:
+         header_data[4] = struct.unpack('HH', del_pointer)
+      if new_serial is not None:
+         header_data[5] = new_serial
+
+      header_data[8] = str(datetime.now())
+
+      self.header_dirty = True
+      self.pending_header_writes += 1
+
+      if self.pending_header_writes >= self.header_flush_interval:
+         self.flush()
+
+
+   def indexes(self):
+      return [self.id_index, self.zones]
+
+
+   def write_changes(self):
+      # dirty pages and the header go to the files, or to the log if there is one
+      self.pool.flush()
+      self.id_index.flush()
+      self.zones.flush()
+
+      if self.header is None or not self.header_dirty:
+         return
+
+      header_data       = self.header
+      table_name        = self.TABLE_NAME.ljust(64, '\x00')[:64]
+      timestamp_created = header_data[7].ljust(64, '\x00')[:64]
+      timestamp_updated = header_data[8].ljust(64, '\x00')[:64]
+
+      header = struct.pack(
+         self.HEADER_STRUCTURE,
+       # ----------------------------------
+         self.BLOCK_SIZE,
+         self.HEADER_SIZE,
+         self.RECORD_SIZE,
+         self.punn(self.pointer(*header_data[3])),
+         self.punn(self.pointer(*header_data[4])),
+         header_data[5],
+         table_name.encode('utf-8'),
+         timestamp_created.encode('utf-8'),
+         timestamp_updated.encode('utf-8'),
+       # ----------------------------------
+      )
+
+      if self.wal is not None:
+         self.wal.log(0, 0, header)
+      else:
+         with self.io.open(self.FILENAME, 'rb+') as f:
+            f.seek(0)
+            f.write(header)
+
+      self.io.count('header_writes')
+
+      self.header_dirty = False
+      self.pending_header_writes = 0
+
+
+   def close(self):
+      self.stop_committer()
+
+      with self.lock.hold('write'):
+         self.flush()
+
+         if self.wal is not None:
+            self.wal.close()
+
+         self.pool.close()
+         self.id_index.close()
+         self.zones.close()
+
+      self.lock.close()
+
+
+   def read_header(self):
+      """Returns the cached header, reading it from the file the first time."""
+      if self.header is None:
+         self.header = self.load_header()
+
+      return self.header
+
+
+   def load_header(self):
+      """Read the header information."""
+      self.io.count('header_reads')
+
+      with self.io.open(self.FILENAME, 'rb') as f:
+         unpacked_data = struct.unpack(self.HEADER_STRUCTURE, f.read(self.HEADER_SIZE))
+
+      return [
+         unpacked_data[0],                                  # block size
+         unpacked_data[1],                                  # header size
+         unpacked_data[2],                                  # register size
+         self.deref(unpacked_data[3]),                      # pointer to the last register
+         self.deref(unpacked_data[4]),                      # pointer to the first deleted register
+         unpacked_data[5],                                  # SERIAL
+         unpacked_data[6].decode('utf-8').rstrip('\x00'),   # table name
+         unpacked_data[7].decode('utf-8').rstrip('\x00'),   # created
+         unpacked_data[8].decode('utf-8').rstrip('\x00'),   # updated
+      ]
+
+
+   def pointer(self, block, register):
+      # returns bytes
+      return struct.pack('HH', block, register)
+
+
+   def punn(self, pointer):
+      # this pointer is bytes, returns a int
+      return struct.unpack('I', pointer)[0]
+
+
+   def deref(self, pointer_number):
+      # this pointer is a int, returns a tuple
+      return struct.unpack('HH', struct.pack('I', pointer_number))
+
+
+   def last_register_pointer(self):
+      return self.read_header()[3]
+
+
+   def del_register_pointer(self):
+      return self.read_header()[4]
+
+
+   def actual_serial(self):
+      return self.read_header()[5]
+
+
+   def created_timestamp(self):
+      return self.read_header()[7]
+
+
+   def updated_timestamp(self):
+      return self.read_header()[8]
+
+
+   def insert(self, age, year, education, city, gender):
+      with self.io.operation('insert'), self.lock.hold('write'):
+         self.write_register(age, year, education, city, gender)
+         self.group_commit()
+
+
+   def iter_select(self, id=None, year=None, where=None, columns=None) -> SelectIterator:
+      """
+         Returns an iterator over the rows of the query, read lazily. Its
+         accessed_blocks are final once it is exhausted or closed. The table
+         lock is held until then, so a query left unfinished should be closed,
+         or used in a with block.
+
+         where takes conditions on any column, see Predicate. Rows hold the
+         given columns, in their order, or all of them; only the minipages
+         of these columns and of the conditions are read.
+      """
+      columns = self.output_columns(columns)
+      mode = 'scan' if id == None and year == None and where == None else 'read'
+
+      return SelectIterator(self.locked(mode, self.iter_where, 'scan' if mode == 'scan' else 'select_where'), self.predicate(where, id, year), columns)
+
+
+   def aggregate(self, group_by=None, aggs=None, where=None, id=None, year=None) -> SelectIterator:
+      """
+         Returns an iterator over the groups of a GROUP BY query, as dicts of
+         the group columns and the aggregates, for example
+         aggregate(['city', 'year'], {'headcount': 'count', 'age': ('avg', 'age')}).
+         See Aggregation.
+
+         The aggregates are computed in the scan loop, over the minipages of
+         the columns of the query only, or over the registers found by the id
+         index. The table lock is held until the iterator is exhausted or
+         closed, as in iter_select().
+      """
+      aggregation = Aggregation(group_by, aggs, self.COLUMNS)
+      mode = 'scan' if id == None and year == None and where == None else 'read'
+
+      return SelectIterator(self.locked(mode, self.iter_aggregate, 'aggregate'), self.predicate(where, id, year), aggregation)
+
+
+   def pools(self):
+      """Returns the buffer pools of the table by name."""
+      return {'data': self.pool, 'id_index': self.id_index.pool, 'zone_map': self.zones.pool}
+
+
+   def stats(self, reset = False):
+      """
+         Returns the I/O counters and the latencies of the operations and
+         queries so far (see IOStats.snapshot()), the hits and misses of every
+         buffer pool and the commits and checkpoints of the log. With reset
+         the counters and latencies start over.
+      """
+      stats = self.io.snapshot()
+      stats['cache'] = {name: {'hits': pool.hits, 'misses': pool.misses} for name, pool in self.pools().items()}
+      stats['wal'] = {'commits': self.wal.commits, 'checkpoints': self.wal.checkpoints, 'size': self.wal.size} if self.wal is not None else None
+
+      if reset:
+         self.io.reset()
+
+      return stats
+
+
+   def select(self, id=None, year=None, where=None, columns=None):
+      rows = self.iter_select(id, year, where, columns)
+
+      for row in rows:
+         pass # pprint(row)
+
+      return rows.accessed_blocks
+
+
+   def delete(self, id=None, year=None, where=None):
+      if id == None and year == None and where == None:
+         raise KeyError("DELETION must have a key")
+
+      with self.io.operation('delete'), self.lock.hold('write'):
+         blocks = self.deletion_where(self.predicate(where, id, year))
+         self.group_commit()
+
+      return blocks
@@ -0,0 +1,44 @@
+from main import DatabasePax
+from common.enginetest import EngineTest
+
+import struct
+
+
+class PaxTest(EngineTest):
+	def selects(self):
+		super().selects()
+
+		self.timed_selects('Selecting one column (year >= 2015)', [{'where': [('year', '>=', 2015)], 'columns': ['year']}] * self.SELECTION_TIMES)
+
+
+	def checks(self):
+		db = self.db
+
+		print('Inserting a bad row')
+		serial = db.actual_serial()
+		count = len(self.ids(columns=['id']))
+
+		try:
+			db.insert('bad', 2015, 'Bachelors', 'Pune', 'Male')
+		except struct.error as error:
+			print(f'    Error: {error}')
+
+		for i in range(5):
+			db.insert(30, 2015, 'Bachelors', 'Pune', 'Male')
+
+		ids = self.ids(columns=['id'])
+		missing = [id for id in range(serial + 1, db.actual_serial() + 1) if not list(db.iter_select(id=id))]
+
+		print("-------------------------------")
+		print(f'    Serial: {serial} -> {db.actual_serial()} ---- Rows: {count} -> {len(ids)}')
+		print(f'    Duplicated ids: {len(ids) - len(set(ids))} ---- Missing ids: {missing}')
+
+		assert db.actual_serial() == serial + 5 and len(ids) == count + 5
+		assert len(ids) == len(set(ids)) and not missing
+
+		print('\n\n')
+
+
+ids = [44, 64, 94, 491, 930, 1381, 2084, 3085, 10930, 15939, 35329, 40000]
+
+PaxTest(DatabasePax(), id_position=0, empty_pointer=(1, 1), select_ids=ids, delete_ids=ids).main()